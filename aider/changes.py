@@ -0,0 +1,330 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+import threading
+import time
+
+from .dump import dump  # noqa: F401
+
+
+class ChangeTracker:
+    """
+    Tells each subscriber which of the files it was given changed since it
+    last asked, so they can revisit just those instead of stat-ing every file.
+
+    The owner hands it the files with set_files(), and calls poll() once a
+    turn. get_changes() then returns the set of absolute paths which changed
+    before that poll, or None when the changes aren't known, like on the
+    first call. Then the subscriber has to check all of its files itself.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.lock = threading.Lock()
+
+        self.files = frozenset()
+
+        # subscriber token -> set of changed paths, or None if unknown
+        self.pending = dict()
+
+    def subscribe(self):
+        with self.lock:
+            token = len(self.pending)
+            self.pending[token] = None
+            return token
+
+    def set_files(self, fnames):
+        "Track just the absolute paths fnames, and count the ones added or dropped as changed"
+        fnames = frozenset(fnames)
+        with self.lock:
+            if fnames == self.files:
+                return
+
+            added = fnames - self.files
+            removed = self.files - fnames
+            self.files = fnames
+            self.update_files(added, removed)
+            self.add_changes(added | removed)
+
+    def poll(self):
+        "Collect the changes since the last poll, for every subscriber"
+        with self.lock:
+            self.check()
+
+    def get_changes(self, token):
+        with self.lock:
+            changes = self.pending[token]
+            self.pending[token] = set()
+            return changes
+
+    def add_changes(self, paths):
+        for changes in self.pending.values():
+            if changes is not None:
+                changes.update(paths)
+
+    def add_unknown_changes(self):
+        for token in self.pending:
+            self.pending[token] = None
+
+    def update_files(self, added, removed):
+        "Start and stop watching files as they're added and removed"
+        raise NotImplementedError
+
+    def check(self):
+        "Find the changes since the last check(), and add them"
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InotifyChangeTracker(ChangeTracker):
+    """
+    Watches the directories which hold the files with linux inotify, so
+    ignored trees like node_modules are never watched. Polling just drains
+    the events the kernel queued, so it costs no syscalls per file.
+    """
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_ISDIR = 0x40000000
+
+    mask = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+    )
+
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, root):
+        super().__init__(root)
+
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+
+        # watch descriptor -> directory
+        self.dirs = dict()
+
+        # every directory at or above one holding a file, to spot the ones
+        # which appear or vanish with files in them
+        self.file_dirs = set()
+
+    def add_watch(self, dname):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dname), self.mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                # gone already, or not ours to read
+                return
+            # out of watches
+            raise OSError(err, f"inotify_add_watch failed for {dname}")
+        return wd
+
+    def update_files(self, added, removed):
+        file_dirs = set()
+        for fname in self.files:
+            dname = os.path.dirname(fname)
+            while dname not in file_dirs and dname != os.path.dirname(dname):
+                file_dirs.add(dname)
+                dname = os.path.dirname(dname)
+        self.file_dirs = file_dirs
+
+        self.update_watches()
+
+    def update_watches(self):
+        "Watch the directory of each file, or the nearest one above it which exists"
+        if self.fd is None:
+            return
+
+        dirs = dict()
+        try:
+            for dname in set(os.path.dirname(fname) for fname in self.files):
+                while True:
+                    wd = self.add_watch(dname)
+                    if wd is not None:
+                        dirs[wd] = dname
+                        break
+                    if dname == self.root or dname == os.path.dirname(dname):
+                        break
+                    dname = os.path.dirname(dname)
+        except OSError:
+            # out of watches, so from now on the subscribers check every file themselves
+            self.close()
+            self.add_unknown_changes()
+            return
+
+        for wd in set(self.dirs) - set(dirs):
+            self.libc.inotify_rm_watch(self.fd, wd)
+        self.dirs = dirs
+
+    def files_below(self, dname):
+        prefix = os.path.join(dname, "")
+        return [fname for fname in self.files if fname.startswith(prefix)]
+
+    def check(self):
+        if self.fd is None:
+            self.add_unknown_changes()
+            return
+
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            self.handle_events(buf)
+
+    def handle_events(self, buf):
+        changed = set()
+        rewatch = False
+
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = self.event_header.unpack_from(buf, offset)
+            offset += self.event_header.size
+            name = os.fsdecode(buf[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                self.add_unknown_changes()
+                rewatch = True
+                continue
+
+            dname = self.dirs.get(wd)
+            if dname is None:
+                continue
+
+            # a watched directory went away, and the files in it with it
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF | self.IN_IGNORED):
+                changed.update(self.files_below(dname))
+                rewatch = True
+                continue
+
+            path = os.path.join(dname, name)
+            if path in self.files:
+                changed.add(path)
+
+            # a directory with files in it appeared or vanished, files and all
+            if mask & self.IN_ISDIR and path in self.file_dirs:
+                changed.update(self.files_below(path))
+                rewatch = True
+
+        self.add_changes(changed)
+        if rewatch:
+            self.update_watches()
+
+    def close(self):
+        if getattr(self, "fd", None) is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
+
+
+class PollingChangeTracker(ChangeTracker):
+    """
+    Finds the changes by stat-ing the files. Files edited in place don't
+    touch their directory's mtime, so each file which exists is still
+    stat-ed every poll. A missing one is only looked for again once its
+    directory's mtime says an entry was added.
+    """
+
+    racy_ns = 2 * 10**9
+
+    def __init__(self, root):
+        super().__init__(root)
+
+        # file -> (size, mtime_ns, inode), or None if it's missing
+        self.signatures = dict()
+
+        # directory of a missing file -> its mtime_ns, or None if it's missing too
+        self.dir_mtimes = dict()
+
+    def get_signature(self, fname):
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            return
+        return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def get_dir_mtime(self, dname):
+        try:
+            return os.stat(dname).st_mtime_ns
+        except OSError:
+            return
+
+    def update_files(self, added, removed):
+        for fname in removed:
+            del self.signatures[fname]
+        for fname in added:
+            self.signatures[fname] = self.get_signature(fname)
+
+    def check(self):
+        changed = set()
+        dir_mtimes = dict()
+        now = time.time_ns()
+
+        for fname, signature in self.signatures.items():
+            if signature is None:
+                # the directory is read before the file, so an entry added in
+                # between still moves its mtime on from the one kept
+                dname = os.path.dirname(fname)
+                if dname not in dir_mtimes:
+                    dir_mtimes[dname] = self.get_dir_mtime(dname)
+                if dname in self.dir_mtimes and self.dir_mtimes[dname] == dir_mtimes[dname]:
+                    continue
+
+            new_signature = self.get_signature(fname)
+            if new_signature != signature:
+                self.signatures[fname] = new_signature
+                changed.add(fname)
+
+        # a directory mtime this recent may not move on when an entry is added within
+        # the same tick of a coarse clock, so its missing files are looked for again
+        self.dir_mtimes = dict(
+            (dname, mtime)
+            for dname, mtime in dir_mtimes.items()
+            if mtime is None or mtime < now - self.racy_ns
+        )
+        self.add_changes(changed)
+
+
+def get_change_tracker(root, allow_polling=True):
+    """
+    An inotify tracker on linux, falling back to polling if allow_polling,
+    or else None.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyChangeTracker(root)
+        except (OSError, AttributeError):
+            pass
+
+    if allow_polling:
+        return PollingChangeTracker(root)
@@ -9,19 +9,29 @@ import traceback
 from json.decoder import JSONDecodeError
 from pathlib import Path, PurePosixPath
 
+import aiohttp
 import backoff
 import git
 import openai
-import requests
 from jsonschema import Draft7Validator
-from openai.error import APIError, RateLimitError, ServiceUnavailableError, Timeout
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
 from rich.console import Console, Text
 from rich.live import Live
 from rich.markdown import Markdown
 
 from aider import models, prompts, utils
+from aider.changes import get_change_tracker
 from aider.commands import Commands
+from aider.gitbatch import GitBatch
+from aider.mdstream import MarkdownStream
 from aider.repomap import RepoMap
+from aider.transport import get_transport
 
 from ..dump import dump  # noqa: F401
 
@@ -41,8 +51,12 @@ def wrap_fence(name):
 class Coder:
     abs_fnames = None
     repo = None
+    git_batch = None
     last_aider_commit_hash = None
     last_asked_for_commit_time = 0
+    last_modified = None
+    change_tracker = None
+    tracked_files = None
     repo_map = None
     functions = None
     total_cost = 0.0
@@ -106,11 +120,18 @@ class Coder:
         dirty_commits=True,
         dry_run=False,
         map_tokens=1024,
+        map_workers=1,
+        map_cache_stats=False,
+        map_stats_json=None,
+        map_warmup=False,
+        track_changes=False,
         verbose=False,
         assistant_output_color="blue",
         code_theme="default",
         stream=True,
+        render_fps=10,
         use_git=True,
+        transport=None,
     ):
         if not fnames:
             fnames = []
@@ -125,6 +146,8 @@ class Coder:
 
         self.io = io
         self.stream = stream
+        self.transport = transport or get_transport()
+        self.render_fps = render_fps
 
         if not auto_commits:
             dirty_commits = False
@@ -158,6 +181,16 @@ class Coder:
         if self.repo:
             rel_repo_dir = self.get_rel_repo_dir()
             self.io.tool_output(f"Git repo: {rel_repo_dir}")
+
+            # shared with the repo map, so neither has to stat every file each turn.
+            # None turns it on only where it's cheap, without polling every file.
+            if track_changes is not False:
+                self.change_tracker = get_change_tracker(
+                    self.root, allow_polling=track_changes is True
+                )
+            if self.change_tracker:
+                self.change_token = self.change_tracker.subscribe()
+                self.abs_paths = dict()
         else:
             self.io.tool_output("Git repo: none")
             self.find_common_root()
@@ -170,10 +203,20 @@ class Coder:
                 io,
                 self.gpt_prompts.repo_content_prefix,
                 self.verbose,
+                map_workers,
+                repo=self.repo,
+                map_cache_stats=map_cache_stats,
+                map_stats_json=map_stats_json,
+                change_tracker=self.change_tracker,
             )
 
             if self.repo_map.use_ctags:
                 self.io.tool_output(f"Repo-map: universal-ctags using {map_tokens} tokens")
+            elif self.repo_map.use_tags:
+                self.io.tool_output(
+                    f"Repo-map: python ast using {map_tokens} tokens"
+                    f" ({self.repo_map.ctags_disabled_reason})"
+                )
             elif not self.repo_map.has_ctags and map_tokens > 0:
                 self.io.tool_output(
                     f"Repo-map: basic using {map_tokens} tokens"
@@ -181,6 +224,10 @@ class Coder:
                 )
             else:
                 self.io.tool_output("Repo-map: disabled because map_tokens == 0")
+
+            if map_warmup:
+                other_files = set(self.get_all_abs_files()) - set(self.abs_fnames)
+                self.repo_map.warm_up(self.abs_fnames, other_files)
         else:
             self.io.tool_output("Repo-map: disabled")
 
@@ -257,12 +304,12 @@ class Coder:
         self.repo = git.Repo(repo_paths.pop(), odbt=git.GitDB)
 
         self.root = utils.safe_abs_path(self.repo.working_tree_dir)
+        self.git_batch = GitBatch(self.root)
 
         new_files = []
+        tracked_files = self.get_tracked_files()
         for fname in self.abs_fnames:
             relative_fname = self.get_rel_fname(fname)
-
-            tracked_files = set(self.get_tracked_files())
             if relative_fname not in tracked_files:
                 new_files.append(relative_fname)
 
@@ -273,13 +320,14 @@ class Coder:
             for fn in new_files:
                 self.io.tool_output(f" - {fn}")
             if self.io.confirm_ask("Add them?"):
+                self.git_batch.run("add", "--", *new_files)
                 for relative_fname in new_files:
-                    self.repo.git.add(relative_fname)
                     self.io.tool_output(f"Added {relative_fname} to the git repo")
                 show_files = ", ".join(new_files)
                 commit_message = f"Added new files to the git repo: {show_files}"
-                self.repo.git.commit("-m", commit_message, "--no-verify")
-                commit_hash = self.repo.head.commit.hexsha[:7]
+                self.git_batch.run("commit", "-m", commit_message, "--no-verify")
+                self.tracked_files = None
+                commit_hash = self.git_batch.rev_parse("HEAD")[:7]
                 self.io.tool_output(f"Commit {commit_hash} {commit_message}")
             else:
                 self.io.tool_error("Skipped adding new files to the git repo.")
@@ -386,11 +434,16 @@ class Coder:
                 if with_message:
                     new_user_message = with_message
                     self.io.user_input(with_message)
+                    self.poll_changes()
                 else:
+                    # polls for changes once the input arrives
                     new_user_message = self.run_loop()
 
                 while new_user_message:
                     new_user_message = self.send_new_user_message(new_user_message)
+                    if new_user_message:
+                        # the reply may have edited files before asking for a reflection
+                        self.poll_changes()
 
                 if with_message:
                     return
@@ -425,10 +478,11 @@ class Coder:
             return
         if not self.repo:
             return
-        if not self.repo.is_dirty():
-            return
+        # with a change tracker this is free when nothing changed, unlike git status
         if self.last_asked_for_commit_time >= self.get_last_modified():
             return
+        if not self.git_batch.is_dirty():
+            return
         return True
 
     def move_back_cur_messages(self, message):
@@ -448,6 +502,7 @@ class Coder:
             self.commands,
         )
 
+        self.poll_changes()
         if self.should_dirty_commit(inp):
             self.io.tool_output("Git repo has uncommitted changes, preparing commit...")
             self.commit(ask=True, which="repo_files")
@@ -467,7 +522,7 @@ class Coder:
 
         self.check_for_file_mentions(inp)
 
-        return self.send_new_user_message(inp)
+        return inp
 
     def fmt_system_reminder(self):
         prompt = self.gpt_prompts.system_reminder
@@ -634,7 +689,10 @@ class Coder:
             APIError,
             ServiceUnavailableError,
             RateLimitError,
-            requests.exceptions.ConnectionError,
+            APIConnectionError,
+            # openai wraps these when connecting, but not while reading the reply
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
         ),
         max_tries=10,
         on_backoff=lambda details: print(
@@ -661,7 +719,7 @@ class Coder:
         hash_object = hashlib.sha1(json.dumps(kwargs, sort_keys=True).encode())
         self.chat_completion_call_hashes.append(hash_object.hexdigest())
 
-        res = openai.ChatCompletion.create(**kwargs)
+        res = self.transport.chat_completion(**kwargs)
         return res
 
     def send(self, messages, model=None, silent=False, functions=None):
@@ -744,8 +802,15 @@ class Coder:
 
     def show_send_output_stream(self, completion, silent):
         live = None
+        md_stream = None
         if self.pretty and not silent:
-            live = Live(vertical_overflow="scroll")
+            live = Live(vertical_overflow="scroll", auto_refresh=False)
+            md_stream = MarkdownStream(
+                live,
+                style=self.assistant_output_color,
+                code_theme=self.code_theme,
+                fps=self.render_fps,
+            )
 
         try:
             if live:
@@ -777,22 +842,25 @@ class Coder:
                     continue
 
                 if self.pretty:
-                    self.live_incremental_response(live, False)
+                    self.live_incremental_response(md_stream, False)
                 else:
                     sys.stdout.write(text)
                     sys.stdout.flush()
         finally:
             if live:
-                self.live_incremental_response(live, True)
+                self.live_incremental_response(md_stream, True)
                 live.stop()
 
-    def live_incremental_response(self, live, final):
+    def live_incremental_response(self, md_stream, final):
+        # skip building the response text until the next redraw is due
+        if not md_stream.is_due(final):
+            return
+
         show_resp = self.render_incremental_response(final)
         if not show_resp:
             return
 
-        md = Markdown(show_resp, style=self.assistant_output_color, code_theme=self.code_theme)
-        live.update(md)
+        md_stream.update(show_resp)
 
     def render_incremental_response(self, final):
         return self.partial_response_content
@@ -844,11 +912,14 @@ class Coder:
 
         return commit_message
 
-    def get_diffs(self, *args):
+    def get_diffs(self, *args, paths=None):
         if self.pretty:
             args = ["--color"] + list(args)
 
-        diffs = self.repo.git.diff(*args)
+        if paths is not None:
+            return self.git_batch.run_paths(["diff"] + list(args), paths)
+
+        diffs = self.git_batch.run("diff", *args)
         return diffs
 
     def commit(self, history=None, prefix=None, ask=False, message=None, which="chat_files"):
@@ -856,41 +927,33 @@ class Coder:
         if not repo:
             return
 
-        if not repo.is_dirty():
-            return
-
-        def get_dirty_files_and_diffs(file_list):
-            diffs = ""
-            relative_dirty_files = []
-            for fname in file_list:
-                relative_fname = self.get_rel_fname(fname)
-                relative_dirty_files.append(relative_fname)
-
-                try:
-                    current_branch_commit_count = len(
-                        list(self.repo.iter_commits(self.repo.active_branch))
-                    )
-                except git.exc.GitCommandError:
-                    current_branch_commit_count = None
-
-                if not current_branch_commit_count:
-                    continue
-
-                these_diffs = self.get_diffs("HEAD", "--", relative_fname)
-
-                if these_diffs:
-                    diffs += these_diffs + "\n"
-
-            return relative_dirty_files, diffs
-
         if which == "repo_files":
-            all_files = [os.path.join(self.root, f) for f in self.get_all_relative_files()]
-            relative_dirty_fnames, diffs = get_dirty_files_and_diffs(all_files)
+            fnames = None
+            status = self.git_batch.get_status()
         elif which == "chat_files":
-            relative_dirty_fnames, diffs = get_dirty_files_and_diffs(self.abs_fnames)
+            fnames = set(self.get_rel_fname(fname) for fname in self.abs_fnames)
+            status = self.git_batch.get_status(sorted(fnames))
         else:
             raise ValueError(f"Invalid value for 'which': {which}")
 
+        # one status call finds the dirty files, and the rest are left alone
+        dirty = []
+        for code, path in status:
+            # convert to appropriate os.sep, since git always normalizes to /
+            path = str(Path(PurePosixPath(path)))
+            if fnames is None or path in fnames:
+                dirty.append((code, path))
+
+        if not dirty:
+            return
+
+        relative_dirty_fnames = [path for _code, path in dirty]
+
+        # a branch without commits has nothing to diff against
+        diffs = ""
+        if self.git_batch.rev_parse("HEAD"):
+            diffs = self.get_diffs("HEAD", paths=relative_dirty_fnames)
+
         if self.show_diffs or ask:
             # don't use io.tool_output() because we don't want to log or further colorize
             print(diffs)
@@ -927,11 +990,15 @@ class Coder:
             if res.lower() not in ["y", "yes"] and res:
                 commit_message = res
 
-        repo.git.add(*relative_dirty_fnames)
+        # files already deleted from the index are staged as they are
+        add_fnames = [path for code, path in dirty if code != "D "]
+        if add_fnames:
+            self.git_batch.run_paths(["add"], add_fnames)
 
         full_commit_message = commit_message + "\n\n# Aider chat conversation:\n\n" + context
-        repo.git.commit("-m", full_commit_message, "--no-verify")
-        commit_hash = repo.head.commit.hexsha[:7]
+        self.git_batch.run("commit", "-m", full_commit_message, "--no-verify")
+        self.tracked_files = None
+        commit_hash = self.git_batch.rev_parse("HEAD")[:7]
         self.io.tool_output(f"Commit {commit_hash} {commit_message}")
 
         return commit_hash, commit_message
@@ -953,14 +1020,52 @@ class Coder:
 
     def get_all_abs_files(self):
         files = self.get_all_relative_files()
-        files = [self.abs_root_path(path) for path in files]
-        return files
+        if not self.change_tracker:
+            return [self.abs_root_path(path) for path in files]
+
+        # resolving a path stats it, so remember them while the tracker is watching
+        abs_files = []
+        for path in files:
+            abs_path = self.abs_paths.get(path)
+            if abs_path is None:
+                abs_path = self.abs_paths[path] = self.abs_root_path(path)
+            abs_files.append(abs_path)
+        return abs_files
+
+    def poll_changes(self):
+        """
+        Once a turn, tell the change tracker which files to watch and collect
+        what changed, for it and the repo map to share.
+        """
+        if not self.change_tracker:
+            return
+
+        self.change_tracker.set_files(set(self.get_all_abs_files()) | self.abs_fnames)
+        self.change_tracker.poll()
 
     def get_last_modified(self):
+        if self.change_tracker:
+            changes = self.change_tracker.get_changes(self.change_token)
+            if changes is not None and self.last_modified is not None:
+                if not changes:
+                    return self.last_modified
+
+                # only the files which changed can have moved it forward, but a
+                # deleted or dropped file may have been the latest, so then check them all
+                files = [Path(fn) for fn in changes]
+                if changes.issubset(self.get_all_abs_files()) and all(
+                    path.exists() for path in files
+                ):
+                    mtimes = [path.stat().st_mtime for path in files]
+                    self.last_modified = max([self.last_modified] + mtimes)
+                    return self.last_modified
+
         files = [Path(fn) for fn in self.get_all_abs_files() if Path(fn).exists()]
         if not files:
-            return 0
-        return max(path.stat().st_mtime for path in files)
+            self.last_modified = 0
+        else:
+            self.last_modified = max(path.stat().st_mtime for path in files)
+        return self.last_modified
 
     def get_addable_relative_files(self):
         return set(self.get_all_relative_files()) - set(self.get_inchat_relative_files())
@@ -989,11 +1094,12 @@ class Coder:
 
         # Check if the file is already in the repo
         if self.repo:
-            tracked_files = set(self.get_tracked_files())
+            tracked_files = self.get_tracked_files()
             relative_fname = self.get_rel_fname(full_path)
             if relative_fname not in tracked_files and self.io.confirm_ask(f"Add {path} to git?"):
                 if not self.dry_run:
-                    self.repo.git.add(full_path)
+                    self.git_batch.run("add", "--", full_path)
+                    self.tracked_files = None
 
         if write_content:
             self.io.write_text(full_path, write_content)
@@ -1001,24 +1107,37 @@ class Coder:
         return full_path
 
     def get_tracked_files(self):
+        """
+        The files in the index, which are the ones in the HEAD commit and the
+        ones staged since, as a frozenset. Listing them is slow in big repos,
+        so the result is kept until HEAD moves or the index is written.
+        """
         if not self.repo:
-            return []
+            return frozenset()
 
-        try:
-            commit = self.repo.head.commit
-        except ValueError:
-            return set()
+        key = self.get_tracked_files_key()
+        if self.tracked_files and self.tracked_files[0] == key:
+            return self.tracked_files[1]
 
-        files = []
-        for blob in commit.tree.traverse():
-            if blob.type == "blob":  # blob is a file
-                files.append(blob.path)
+        files = self.git_batch.ls_files()
 
         # convert to appropriate os.sep, since git always normalizes to /
-        res = set(str(Path(PurePosixPath(path))) for path in files)
+        res = frozenset(str(Path(PurePosixPath(path))) for path in files)
 
+        self.tracked_files = (key, res)
         return res
 
+    def get_tracked_files_key(self):
+        head_sha = self.git_batch.rev_parse("HEAD")
+
+        try:
+            stat = os.stat(os.path.join(self.repo.git_dir, "index"))
+            index_stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            index_stat = None
+
+        return head_sha, index_stat
+
     apply_update_errors = 0
 
     def apply_updates(self):
@@ -1089,6 +1208,6 @@ class Coder:
 
 
 def check_model_availability(main_model):
-    available_models = openai.Model.list()
+    available_models = get_transport().list_models()
     model_ids = [model.id for model in available_models["data"]]
     return main_model.name in model_ids
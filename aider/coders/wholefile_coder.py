@@ -10,6 +10,7 @@ from .wholefile_prompts import WholeFilePrompts
 class WholeFileCoder(Coder):
     def __init__(self, *args, **kwargs):
         self.gpt_prompts = WholeFilePrompts()
+        self.live_diffs_state = None
         super().__init__(*args, **kwargs)
 
     def update_cur_messages(self, edited):
@@ -36,11 +37,13 @@ class WholeFileCoder(Coder):
             return self.partial_response_content
 
     def update_files(self, mode="update"):
+        if mode == "diff":
+            return self.update_live_diffs()
+
         content = self.partial_response_content
 
         chat_files = self.get_inchat_relative_files()
 
-        output = []
         lines = content.splitlines(keepends=True)
 
         edits = []
@@ -50,17 +53,12 @@ class WholeFileCoder(Coder):
         fname_source = None
         new_lines = []
         for i, line in enumerate(lines):
-            if line.startswith(self.fence[0]) or line.startswith(self.fence[1]):
+            if self.is_fence(line):
                 if fname is not None:
                     # ending an existing block
                     saw_fname = None
 
-                    full_path = (Path(self.root) / fname).absolute()
-
-                    if mode == "diff":
-                        output += self.do_live_diff(full_path, new_lines, True)
-                    else:
-                        edits.append((fname, fname_source, new_lines))
+                    edits.append((fname, fname_source, new_lines))
 
                     fname = None
                     fname_source = None
@@ -68,45 +66,13 @@ class WholeFileCoder(Coder):
                     continue
 
                 # fname==None ... starting a new block
-                if i > 0:
-                    fname_source = "block"
-                    fname = lines[i - 1].strip()
-                    # Did gpt prepend a bogus dir? It especially likes to
-                    # include the path/to prefix from the one-shot example in
-                    # the prompt.
-                    if fname and fname not in chat_files and Path(fname).name in chat_files:
-                        fname = Path(fname).name
-                if not fname:  # blank line? or ``` was on first line i==0
-                    if saw_fname:
-                        fname = saw_fname
-                        fname_source = "saw"
-                    elif len(chat_files) == 1:
-                        fname = chat_files[0]
-                        fname_source = "chat"
-                    else:
-                        # TODO: sense which file it is by diff size
-                        raise ValueError(
-                            f"No filename provided before {self.fence[0]} in file listing"
-                        )
+                prev_line = lines[i - 1] if i > 0 else None
+                fname, fname_source = self.get_block_fname(prev_line, saw_fname, chat_files)
 
             elif fname is not None:
                 new_lines.append(line)
             else:
-                for word in line.strip().split():
-                    word = word.rstrip(".:,;!")
-                    for chat_file in chat_files:
-                        quoted_chat_file = f"`{chat_file}`"
-                        if word == quoted_chat_file:
-                            saw_fname = chat_file
-
-                output.append(line)
-
-        if mode == "diff":
-            if fname is not None:
-                # ending an existing block
-                full_path = (Path(self.root) / fname).absolute()
-                output += self.do_live_diff(full_path, new_lines, False)
-            return "\n".join(output)
+                saw_fname = self.find_quoted_fname(line, chat_files, saw_fname)
 
         if fname:
             edits.append((fname, fname_source, new_lines))
@@ -128,17 +94,142 @@ class WholeFileCoder(Coder):
 
         return edited
 
-    def do_live_diff(self, full_path, new_lines, final):
-        if full_path.exists():
-            orig_lines = self.io.read_text(full_path).splitlines(keepends=True)
+    def is_fence(self, line):
+        return line.startswith(self.fence[0]) or line.startswith(self.fence[1])
+
+    def get_block_fname(self, prev_line, saw_fname, chat_files):
+        "Decide which file a block is for, given the line before its opening fence"
+        fname = None
+        if prev_line is not None:
+            fname_source = "block"
+            fname = prev_line.strip()
+            # Did gpt prepend a bogus dir? It especially likes to
+            # include the path/to prefix from the one-shot example in
+            # the prompt.
+            if fname and fname not in chat_files and Path(fname).name in chat_files:
+                fname = Path(fname).name
+        if not fname:  # blank line? or ``` was on first line i==0
+            if saw_fname:
+                fname = saw_fname
+                fname_source = "saw"
+            elif len(chat_files) == 1:
+                fname = chat_files[0]
+                fname_source = "chat"
+            else:
+                # TODO: sense which file it is by diff size
+                raise ValueError(f"No filename provided before {self.fence[0]} in file listing")
+
+        return fname, fname_source
+
+    def find_quoted_fname(self, line, chat_files, saw_fname):
+        for word in line.strip().split():
+            word = word.rstrip(".:,;!")
+            for chat_file in chat_files:
+                quoted_chat_file = f"`{chat_file}`"
+                if word == quoted_chat_file:
+                    saw_fname = chat_file
+        return saw_fname
+
+    def update_live_diffs(self):
+        """
+        Show the response with each file listing as a live diff. The parsing
+        and diffing state is kept between calls, so each call only handles
+        the lines which arrived since the last one.
+        """
+        content = self.partial_response_content
+
+        state = self.live_diffs_state
+        if state is None or not content.startswith(state.content):
+            state = self.live_diffs_state = LiveDiffsState()
+        state.content = content
+
+        chat_files = self.get_inchat_relative_files()
+
+        end = content.rfind("\n") + 1
+        if end > state.pos:
+            for line in content[state.pos : end].splitlines(keepends=True):
+                self.update_live_diffs_line(state, line, chat_files)
+                state.pos += len(line)
+
+        # the last line is still arriving, so just show it for now
+        last_line = content[state.pos :]
+        output = state.output
 
-            show_diff = diffs.diff_partial_update(
-                orig_lines,
-                new_lines,
-                final=final,
-            ).splitlines()
-            output = show_diff
+        if state.fname is not None:
+            if self.is_fence(last_line):
+                show = self.do_live_diff(state.live_diff, state.new_lines, True)
+            else:
+                new_lines = state.new_lines
+                if last_line:
+                    new_lines.append(last_line)
+                show = self.do_live_diff(state.live_diff, new_lines, False)
+                if last_line:
+                    new_lines.pop()
+            output = output + show
+        elif self.is_fence(last_line):
+            # a block is starting, an existing file has no diff to show yet
+            fname, _ = self.get_block_fname(state.prev_line, state.saw_fname, chat_files)
+            if not self.get_full_path(fname).exists():
+                output = output + self.do_live_diff(None, [], False)
+        elif last_line:
+            output = output + [last_line]
+
+        return "\n".join(output)
+
+    def update_live_diffs_line(self, state, line, chat_files):
+        if self.is_fence(line):
+            if state.fname is not None:
+                # ending an existing block
+                state.saw_fname = None
+                state.output += self.do_live_diff(state.live_diff, state.new_lines, True)
+
+                state.fname = None
+                state.live_diff = None
+                state.new_lines = []
+            else:
+                state.fname, _ = self.get_block_fname(state.prev_line, state.saw_fname, chat_files)
+                state.live_diff = self.get_live_diff(state.fname)
+
+        elif state.fname is not None:
+            state.new_lines.append(line)
+        else:
+            state.saw_fname = self.find_quoted_fname(line, chat_files, state.saw_fname)
+            state.output.append(line)
+
+        state.prev_line = line
+
+    def get_full_path(self, fname):
+        return (Path(self.root) / fname).absolute()
+
+    def get_live_diff(self, fname):
+        "A LiveDiff against the current content of fname, or None if it doesn't exist yet"
+        full_path = self.get_full_path(fname)
+        if not full_path.exists():
+            return
+
+        orig_lines = self.io.read_text(full_path).splitlines(keepends=True)
+        return diffs.LiveDiff(orig_lines)
+
+    def do_live_diff(self, live_diff, new_lines, final):
+        if live_diff:
+            output = live_diff.update(new_lines, final=final).splitlines()
         else:
             output = ["```"] + new_lines + ["```"]
 
         return output
+
+
+class LiveDiffsState:
+    "How far update_live_diffs() has got through the response"
+
+    def __init__(self):
+        self.content = ""
+        self.pos = 0
+
+        self.prev_line = None
+        self.saw_fname = None
+        self.fname = None
+        self.live_diff = None
+        self.new_lines = []
+
+        self.output = []
@@ -4,7 +4,6 @@ import subprocess
 import sys
 from pathlib import Path
 
-import git
 import tiktoken
 from prompt_toolkit.completion import Completion
 
@@ -27,19 +26,20 @@ class Commands:
         commands = []
         for attr in dir(self):
             if attr.startswith("cmd_"):
-                commands.append("/" + attr[4:])
+                # cmd_map_stats is run as /map-stats
+                commands.append("/" + attr[4:].replace("_", "-"))
 
         return commands
 
     def get_command_completions(self, cmd_name, partial):
-        cmd_completions_method_name = f"completions_{cmd_name}"
+        cmd_completions_method_name = "completions_" + cmd_name.replace("-", "_")
         cmd_completions_method = getattr(self, cmd_completions_method_name, None)
         if cmd_completions_method:
             for completion in cmd_completions_method(partial):
                 yield completion
 
     def do_run(self, cmd_name, args):
-        cmd_method_name = f"cmd_{cmd_name}"
+        cmd_method_name = "cmd_" + cmd_name.replace("-", "_")
         cmd_method = getattr(self, cmd_method_name, None)
         if cmd_method:
             return cmd_method(args)
@@ -80,7 +80,7 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
-        if not self.coder.repo.is_dirty():
+        if not self.coder.git_batch.is_dirty():
             self.io.tool_error("No more changes to commit.")
             return
 
@@ -158,28 +158,34 @@ class Commands:
             self.io.tool_error(f"{fmt(remaining)} tokens remaining, window exhausted!")
         self.io.tool_output(f"{fmt(limit)} tokens max context window size")
 
+    def cmd_map_stats(self, args):
+        "Show the time spent in each phase of building the last repo map"
+
+        if not self.coder.repo_map:
+            self.io.tool_error("The repo map is disabled.")
+            return
+
+        self.io.tool_output(self.coder.repo_map.stats.report())
+
     def cmd_undo(self, args):
         "Undo the last git commit if it was done by aider"
         if not self.coder.repo:
             self.io.tool_error("No git repository found.")
             return
 
-        if self.coder.repo.is_dirty():
+        git_batch = self.coder.git_batch
+        if git_batch.is_dirty():
             self.io.tool_error(
                 "The repository has uncommitted changes. Please commit or stash them before"
                 " undoing."
             )
             return
 
-        local_head = self.coder.repo.git.rev_parse("HEAD")
+        local_head = git_batch.rev_parse("HEAD")
         current_branch = self.coder.repo.active_branch.name
-        try:
-            remote_head = self.coder.repo.git.rev_parse(f"origin/{current_branch}")
-            has_origin = True
-        except git.exc.GitCommandError:
-            has_origin = False
+        remote_head = git_batch.rev_parse(f"origin/{current_branch}")
 
-        if has_origin:
+        if remote_head:
             if local_head == remote_head:
                 self.io.tool_error(
                     "The last commit has already been pushed to the origin. Undoing is not"
@@ -187,16 +193,18 @@ class Commands:
                 )
                 return
 
-        last_commit = self.coder.repo.head.commit
+        last_commit_message = git_batch.get_commit_message("HEAD") or ""
         if (
-            not last_commit.message.startswith("aider:")
-            or last_commit.hexsha[:7] != self.coder.last_aider_commit_hash
+            not last_commit_message.startswith("aider:")
+            or not local_head
+            or local_head[:7] != self.coder.last_aider_commit_hash
         ):
             self.io.tool_error("The last commit was not made by aider in this chat session.")
             return
-        self.coder.repo.git.reset("--hard", "HEAD~1")
+        git_batch.run("reset", "--hard", "HEAD~1")
+        self.coder.tracked_files = None
         self.io.tool_output(
-            f"{last_commit.message.strip()}\n"
+            f"{last_commit_message.strip()}\n"
             f"The above commit {self.coder.last_aider_commit_hash} "
             "was reset and removed from git.\n"
         )
@@ -274,7 +282,8 @@ class Commands:
             abs_file_path = self.coder.abs_root_path(matched_file)
 
             if self.coder.repo and matched_file not in git_files:
-                self.coder.repo.git.add(abs_file_path)
+                self.coder.git_batch.run("add", "--", abs_file_path)
+                self.coder.tracked_files = None
                 git_added.append(matched_file)
 
             if abs_file_path in self.coder.abs_fnames:
@@ -291,8 +300,9 @@ class Commands:
         if self.coder.repo and git_added:
             git_added = " ".join(git_added)
             commit_message = f"aider: Added {git_added}"
-            self.coder.repo.git.commit("-m", commit_message, "--no-verify")
-            commit_hash = self.coder.repo.head.commit.hexsha[:7]
+            self.coder.git_batch.run("commit", "-m", commit_message, "--no-verify")
+            self.coder.tracked_files = None
+            commit_hash = self.coder.git_batch.rev_parse("HEAD")[:7]
             self.io.tool_output(f"Commit {commit_hash} {commit_message}")
 
         if not added_fnames:
@@ -437,7 +447,7 @@ class Commands:
         "Show help about all commands"
         commands = sorted(self.get_commands())
         for cmd in commands:
-            cmd_method_name = f"cmd_{cmd[1:]}"
+            cmd_method_name = "cmd_" + cmd[1:].replace("-", "_")
             cmd_method = getattr(self, cmd_method_name, None)
             if cmd_method:
                 description = cmd_method.__doc__
@@ -1,4 +1,4 @@
-import difflib
+import bisect
 import sys
 
 from .dump import dump  # noqa: F401
@@ -64,23 +64,34 @@ def diff_partial_update(lines_orig, lines_updated, final=False, fname=None):
     if last_non_deleted is None:
         return ""
 
-    if num_orig_lines:
-        pct = last_non_deleted * 100 / num_orig_lines
-    else:
-        pct = 50
-    bar = create_progress_bar(pct)
-    bar = f" {last_non_deleted:3d} / {num_orig_lines:3d} lines [{bar}] {pct:3.0f}%\n"
+    bar = progress_bar_line(last_non_deleted, num_orig_lines)
 
     lines_orig = lines_orig[:last_non_deleted]
 
     if not final:
         lines_updated = lines_updated[:-1] + [bar]
 
-    diff = difflib.unified_diff(lines_orig, lines_updated, n=5)
+    opcodes = diff_lines(lines_orig, lines_updated)
+    diff = "".join(
+        format_hunk(group, lines_orig, lines_updated) for group in group_opcodes(opcodes, 5)
+    )
+
+    # print(diff)
+
+    return fence_diff(diff, fname)
+
 
-    diff = list(diff)[2:]
+def progress_bar_line(last_non_deleted, num_orig_lines):
+    if num_orig_lines:
+        pct = last_non_deleted * 100 / num_orig_lines
+    else:
+        pct = 50
+    bar = create_progress_bar(pct)
+    return f" {last_non_deleted:3d} / {num_orig_lines:3d} lines [{bar}] {pct:3.0f}%\n"
 
-    diff = "".join(diff)
+
+def fence_diff(diff, fname=None):
+    "Wrap the body of a unified diff in a ```diff fence that nothing in it can close"
     if not diff.endswith("\n"):
         diff += "\n"
 
@@ -98,31 +109,589 @@ def diff_partial_update(lines_orig, lines_updated, final=False, fname=None):
 
     show += f"{backticks}\n\n"
 
-    # print(diff)
-
     return show
 
 
 def find_last_non_deleted(lines_orig, lines_updated):
-    diff = list(difflib.ndiff(lines_orig, lines_updated))
-
-    num_orig = 0
-    last_non_deleted_orig = None
-
-    for line in diff:
-        # print(f"{num_orig:2d} {num_updated:2d} {line}", end="")
-        code = line[0]
-        if code == " ":
-            num_orig += 1
-            last_non_deleted_orig = num_orig
-        elif code == "-":
-            # line only in orig
-            num_orig += 1
-        elif code == "+":
-            # line only in updated
-            pass
-
-    return last_non_deleted_orig
+    """
+    The number of original lines up to the last one which is still in the
+    partial update, or None if none of them are.
+
+    The update is matched to the start of the original which takes the fewest
+    changes, so unlike difflib.ndiff() this won't skip ahead over more
+    original lines than it matches.
+    """
+    orig, updated = intern_lines(lines_orig, lines_updated)
+
+    matches = []
+    match_lines(orig, 0, len(orig), updated, 0, len(updated), matches, open_end=True)
+    if not matches:
+        return
+
+    return matches[-1][0] + 1
+
+
+def diff_lines(lines_a, lines_b):
+    "The opcodes which turn lines_a into lines_b, like SequenceMatcher.get_opcodes()"
+    a, b = intern_lines(lines_a, lines_b)
+
+    matches = []
+    match_lines(a, 0, len(a), b, 0, len(b), matches)
+
+    opcodes = []
+    i = j = 0
+    for i2, j2 in matches + [(len(a), len(b))]:
+        if i2 > i or j2 > j:
+            if i2 == i:
+                tag = "insert"
+            elif j2 == j:
+                tag = "delete"
+            else:
+                tag = "replace"
+            opcodes.append((tag, i, i2, j, j2))
+
+        if i2 == len(a) and j2 == len(b):
+            break
+
+        if opcodes and opcodes[-1][0] == "equal":
+            _, i1, _, j1, _ = opcodes.pop()
+            opcodes.append(("equal", i1, i2 + 1, j1, j2 + 1))
+        else:
+            opcodes.append(("equal", i2, i2 + 1, j2, j2 + 1))
+        i, j = i2 + 1, j2 + 1
+
+    return opcodes
+
+
+def intern_lines(lines_a, lines_b):
+    "Number the distinct lines, so the diff compares small ints instead of strings"
+    ids = dict()
+    a = [ids.setdefault(line, len(ids)) for line in lines_a]
+    b = [ids.setdefault(line, len(ids)) for line in lines_b]
+    return a, b
+
+
+def match_lines(a, alo, ahi, b, blo, bhi, matches, open_end=False):
+    """
+    Append the (i, j) pairs of a[alo:ahi] and b[blo:bhi] which match to
+    matches, with patience diff: lines which appear once on both sides
+    anchor the diff, and the gaps between them are matched the same way.
+    Gaps without any such lines fall back to myers.
+
+    If open_end, b is only the first part of the update, so the original
+    lines after the part of a it matches are expected to be left over.
+    """
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+
+    if alo == ahi or blo == bhi:
+        return
+
+    anchors = unique_lcs(a, alo, ahi, b, blo, bhi)
+    if not anchors:
+        if open_end:
+            match_myers_prefix(a, alo, ahi, b, blo, bhi, matches)
+        else:
+            match_myers(a, alo, ahi, b, blo, bhi, matches)
+        return
+
+    for i, j in anchors:
+        match_lines(a, alo, i, b, blo, j, matches)
+        matches.append((i, j))
+        alo, blo = i + 1, j + 1
+
+    match_lines(a, alo, ahi, b, blo, bhi, matches, open_end)
+
+
+def unique_lcs(a, alo, ahi, b, blo, bhi):
+    """
+    The longest run of (i, j) pairs, in order on both sides, of lines which
+    appear exactly once in a[alo:ahi] and once in b[blo:bhi].
+    """
+    # line -> its index, or -1 if it's there more than once
+    index_a = dict()
+    for i in range(alo, ahi):
+        index_a[a[i]] = -1 if a[i] in index_a else i
+    index_b = dict()
+    for j in range(blo, bhi):
+        index_b[b[j]] = -1 if b[j] in index_b else j
+
+    pairs = []
+    for j in range(blo, bhi):
+        i = index_a.get(b[j], -1)
+        if i >= 0 and index_b[b[j]] == j:
+            pairs.append((i, j))
+
+    # the longest increasing run of i, with patience sorting
+    tails = []
+    tail_pairs = []
+    prev = []
+    for num, (i, j) in enumerate(pairs):
+        pile = bisect.bisect_left(tails, i)
+        if pile == len(tails):
+            tails.append(i)
+            tail_pairs.append(num)
+        else:
+            tails[pile] = i
+            tail_pairs[pile] = num
+        prev.append(tail_pairs[pile - 1] if pile else None)
+
+    res = []
+    num = tail_pairs[-1] if tail_pairs else None
+    while num is not None:
+        res.append(pairs[num])
+        num = prev[num]
+    res.reverse()
+    return res
+
+
+# the most diagonal steps myers takes on one gap, before it settles for no matches
+MAX_MYERS_STEPS = 1_000_000
+
+
+def match_myers(a, alo, ahi, b, blo, bhi, matches):
+    "Append the pairs of a longest common subsequence of the ranges to matches"
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+
+    suffix = 0
+    while alo < ahi - suffix and blo < bhi - suffix:
+        if a[ahi - suffix - 1] != b[bhi - suffix - 1]:
+            break
+        suffix += 1
+    ahi -= suffix
+    bhi -= suffix
+
+    if alo < ahi and blo < bhi:
+        split = myers_middle_snake(a, alo, ahi, b, blo, bhi)
+        if split:
+            x, y = split
+            match_myers(a, alo, alo + x, b, blo, blo + y, matches)
+            match_myers(a, alo + x, ahi, b, blo + y, bhi, matches)
+
+    matches.extend((ahi + k, bhi + k) for k in range(suffix))
+
+
+def match_myers_prefix(a, alo, ahi, b, blo, bhi, matches):
+    """
+    Append to matches the pairs of the cheapest way to turn some start of
+    a[alo:ahi] into all of b[blo:bhi], with myers' O(ND) search. The rest
+    of a is left over, so it doesn't cost anything.
+    """
+    len_a = ahi - alo
+    len_b = bhi - blo
+
+    # diagonal k -> the furthest x reached on it, and v before each step
+    v = {1: 0}
+    trace = []
+
+    end = None
+    steps = 0
+    for d in range(len_a + len_b + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            x = myers_prefix_step(v, k, len_a)
+            if x < 0:
+                continue
+            y = x - k
+            while x < len_a and y < len_b and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+
+            # of the ways to the end of b with d edits, the furthest into a matches the most
+            if y >= len_b and (not end or x > end[0]):
+                end = x, y
+
+        if end:
+            break
+
+        steps += d + 1
+        if steps > MAX_MYERS_STEPS:
+            return
+
+    if not end:
+        return
+    x, y = end
+
+    # follow the steps back to the start, collecting the diagonal runs
+    res = []
+    for d in range(d, -1, -1):
+        k = x - y
+        if d:
+            start_x = myers_prefix_step(trace[d], k, len_a)
+        else:
+            start_x = 0
+        res += [(alo + i, blo + i - k) for i in range(x - 1, start_x - 1, -1)]
+
+        if not d:
+            break
+        if start_x == trace[d].get(k + 1):
+            # moved down from diagonal k + 1
+            x, y = start_x, start_x - k - 1
+        else:
+            # moved right from diagonal k - 1
+            x, y = start_x - 1, start_x - k
+
+    matches.extend(reversed(res))
+
+
+def myers_prefix_step(v, k, len_a):
+    "The x that diagonal k starts at in the next step, or -1 if it can't be reached"
+    x_down = v.get(k + 1, -1)
+    x_right = v.get(k - 1, -1)
+    if 0 <= x_right < len_a:
+        x_right += 1
+    else:
+        x_right = -1
+
+    return max(x_down, x_right)
+
+
+def myers_middle_snake(a, alo, ahi, b, blo, bhi):
+    """
+    Run myers' O(ND) search forwards from the start and backwards from the
+    end of the ranges until they meet. Returns the (x, y) offsets where the
+    ranges can be split in two smaller diffs, or None if there's no match.
+    """
+    len_a = ahi - alo
+    len_b = bhi - blo
+    max_d = (len_a + len_b + 1) // 2
+    offset = max_d
+    v_forward = [-1] * (2 * max_d + 2)
+    v_backward = [-1] * (2 * max_d + 2)
+    v_forward[offset + 1] = 0
+    v_backward[offset + 1] = 0
+
+    delta = len_a - len_b
+    # if delta is odd, the paths meet while searching forwards
+    front = delta % 2 != 0
+
+    # how far the diagonals have run off the edge of the ranges
+    k1_start = k1_end = k2_start = k2_end = 0
+
+    steps = 0
+    for d in range(max_d):
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and v_forward[k1_offset - 1] < v_forward[k1_offset + 1]):
+                x1 = v_forward[k1_offset + 1]
+            else:
+                x1 = v_forward[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < len_a and y1 < len_b and a[alo + x1] == b[blo + y1]:
+                x1 += 1
+                y1 += 1
+            v_forward[k1_offset] = x1
+
+            if x1 > len_a:
+                k1_end += 2
+            elif y1 > len_b:
+                k1_start += 2
+            elif front:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < len(v_backward) and v_backward[k2_offset] != -1:
+                    if x1 >= len_a - v_backward[k2_offset]:
+                        return x1, y1
+
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and v_backward[k2_offset - 1] < v_backward[k2_offset + 1]):
+                x2 = v_backward[k2_offset + 1]
+            else:
+                x2 = v_backward[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < len_a and y2 < len_b and a[ahi - x2 - 1] == b[bhi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v_backward[k2_offset] = x2
+
+            if x2 > len_a:
+                k2_end += 2
+            elif y2 > len_b:
+                k2_start += 2
+            elif not front:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < len(v_forward) and v_forward[k1_offset] != -1:
+                    x1 = v_forward[k1_offset]
+                    y1 = x1 - (k1_offset - offset)
+                    if x1 >= len_a - x2:
+                        return x1, y1
+
+        steps += 2 * d + 2
+        if steps > MAX_MYERS_STEPS:
+            return
+
+
+def group_opcodes(opcodes, n):
+    "Group opcodes into hunks with n lines of context, like SequenceMatcher.get_grouped_opcodes()"
+    if not opcodes:
+        return
+
+    codes = list(opcodes)
+    tag, i1, i2, j1, j2 = codes[0]
+    if tag == "equal":
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    tag, i1, i2, j1, j2 = codes[-1]
+    if tag == "equal":
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # split the hunks where there's a long run of unchanged lines
+        if tag == "equal" and i2 - i1 > n + n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def format_range(start, stop):
+    "A hunk header range, like difflib.unified_diff writes them"
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def format_hunk(group, lines_orig, lines_updated, last_line=None):
+    "Format a group of opcodes as a hunk, showing last_line in place of the last updated line"
+    first, last = group[0], group[-1]
+    res = [f"@@ -{format_range(first[1], last[2])} +{format_range(first[3], last[4])} @@\n"]
+
+    for tag, i1, i2, j1, j2 in group:
+        if tag == "equal":
+            res += [" " + line for line in lines_orig[i1:i2]]
+            continue
+        if tag in ("replace", "delete"):
+            res += ["-" + line for line in lines_orig[i1:i2]]
+        if tag in ("replace", "insert"):
+            if last_line is not None and j2 == len(lines_updated):
+                res += ["+" + line for line in lines_updated[j1 : j2 - 1]]
+                res.append("+" + last_line)
+            else:
+                res += ["+" + line for line in lines_updated[j1:j2]]
+
+    return "".join(res)
+
+
+class LiveDiff:
+    """
+    Shows the diff of a file while the updated lines stream in, like
+    diff_partial_update(), but keeps its state between updates. It lines up
+    just the newly arrived lines with the original, and formats each hunk
+    once it can't change anymore, so an update costs time in proportion to
+    the new lines rather than the whole file.
+
+    The partial diffs are greedy: changed lines count as back in sync after
+    sync_lines matching lines. So where a line is in the original more than
+    once, like a blank line or a return, they can line it up differently
+    from diff_partial_update(), and differ from it, while still being valid
+    diffs. The final diff is diff_partial_update()'s.
+
+    The list of updated lines is expected to only grow between updates.
+    """
+
+    context = 5
+
+    # lines that have to match in a row before diverged lines count as back in sync
+    sync_lines = 3
+
+    # the nearest original lines to try as the place where they sync back up
+    max_candidates = 100
+
+    def __init__(self, lines_orig, fname=None):
+        assert_newlines(lines_orig)
+
+        self.lines_orig = lines_orig
+        self.fname = fname
+        self.lines_updated = []
+
+        # line -> its indexes in lines_orig, built when the lines first diverge
+        self.positions = None
+
+        # lines_orig[:orig_pos] and lines_updated[:updated_pos] are lined up as opcodes
+        self.orig_pos = 0
+        self.updated_pos = 0
+        self.synced = False
+
+        # updated lines before scan_pos can't sync back up at or after orig_pos
+        self.scan_pos = 0
+
+        # the formatted hunks which are done, and the opcodes since
+        self.hunks = []
+        self.opcodes = []
+
+    def update(self, lines_updated, final=False):
+        self.lines_updated = lines_updated
+
+        if final:
+            # once, so the whole diff can be exact
+            return diff_partial_update(self.lines_orig, lines_updated, True, self.fname)
+
+        # the last line may still be incomplete
+        self.advance(len(lines_updated) - 1)
+
+        num_orig_lines = len(self.lines_orig)
+        i, j = self.orig_pos, self.updated_pos
+
+        opcodes = list(self.opcodes)
+        num_lines = len(lines_updated)
+
+        # like find_last_non_deleted(), the last few lines can match before they're sure to
+        sync = self.find_last_sync()
+        if sync:
+            p, q = sync
+            last_non_deleted = p + num_lines - q
+            self.add_opcode(opcodes, "replace", i, p, j, q)
+            self.add_opcode(opcodes, "equal", p, last_non_deleted - 1, q, num_lines - 1)
+            self.add_opcode(
+                opcodes,
+                "replace",
+                last_non_deleted - 1,
+                last_non_deleted,
+                num_lines - 1,
+                num_lines,
+            )
+        elif self.synced:
+            last_non_deleted = i
+            self.add_opcode(opcodes, "insert", i, i, j, num_lines)
+        else:
+            return ""
+
+        # the progress bar takes the place of the last line
+        last_line = progress_bar_line(last_non_deleted, num_orig_lines)
+
+        diff = list(self.hunks)
+        for group in group_opcodes(opcodes, self.context):
+            diff.append(format_hunk(group, self.lines_orig, lines_updated, last_line))
+
+        return fence_diff("".join(diff), self.fname)
+
+    def advance(self, num_lines):
+        "Line up lines_updated[updated_pos:num_lines] with the original, as far as possible"
+        lines_orig = self.lines_orig
+        lines_updated = self.lines_updated
+
+        while self.updated_pos < num_lines:
+            i, j = self.orig_pos, self.updated_pos
+            if i < len(lines_orig) and lines_orig[i] == lines_updated[j]:
+                self.add_opcode(self.opcodes, "equal", i, i + 1, j, j + 1)
+                continue
+
+            sync = self.find_sync(num_lines)
+            if not sync:
+                break
+
+            p, q = sync
+            self.add_opcode(self.opcodes, "replace", i, p, j, q)
+
+        self.finish_hunks()
+
+    def find_sync(self, num_lines):
+        """
+        Find the first updated line at or after updated_pos which starts a run
+        of sync_lines lines that match the original at or after orig_pos.
+        Returns (orig index, updated index), or None if there isn't one yet.
+        """
+        lines_orig = self.lines_orig
+        lines_updated = self.lines_updated
+        num = self.sync_lines
+
+        positions = self.get_positions()
+
+        self.scan_pos = max(self.scan_pos, self.updated_pos)
+        while self.scan_pos + num <= num_lines:
+            q = self.scan_pos
+            updated = lines_updated[q : q + num]
+
+            locs = positions.get(lines_updated[q], [])
+            start = bisect.bisect_left(locs, self.orig_pos)
+            for p in locs[start : start + self.max_candidates]:
+                if lines_orig[p : p + num] == updated:
+                    return p, q
+
+            self.scan_pos += 1
+
+    def find_last_sync(self):
+        """
+        Find where the updated lines left over by find_sync(), which are too
+        few to be sure of, match the original up to the last line.
+        Returns (orig index, updated index), or None.
+        """
+        lines_orig = self.lines_orig
+        lines_updated = self.lines_updated
+        positions = self.get_positions()
+
+        for q in range(max(self.scan_pos, self.updated_pos), len(lines_updated)):
+            updated = lines_updated[q:]
+
+            locs = positions.get(lines_updated[q], [])
+            start = bisect.bisect_left(locs, self.orig_pos)
+            for p in locs[start : start + self.max_candidates]:
+                if lines_orig[p : p + len(updated)] == updated:
+                    return p, q
+
+    def get_positions(self):
+        "Map each original line to its indexes, the first time they're needed"
+        if self.positions is None:
+            self.positions = dict()
+            for i, line in enumerate(self.lines_orig):
+                self.positions.setdefault(line, []).append(i)
+        return self.positions
+
+    def add_opcode(self, opcodes, tag, i1, i2, j1, j2):
+        if i1 == i2 and j1 == j2:
+            return
+
+        if opcodes is self.opcodes:
+            self.orig_pos, self.updated_pos = i2, j2
+            if tag == "equal":
+                self.synced = True
+
+        # merge with the previous opcode, like SequenceMatcher would have them
+        if opcodes and (opcodes[-1][0] == "equal") == (tag == "equal"):
+            _, i1, _, j1, _ = opcodes.pop()
+
+        if tag != "equal":
+            if i1 == i2:
+                tag = "insert"
+            elif j1 == j2:
+                tag = "delete"
+            else:
+                tag = "replace"
+
+        opcodes.append((tag, i1, i2, j1, j2))
+
+    def finish_hunks(self):
+        """
+        Format the hunks before a long enough run of unchanged lines, since the
+        lines after it can't change them.
+        """
+        opcodes = self.opcodes
+        if len(opcodes) < 2:
+            return
+
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        if tag != "equal" or i2 - i1 <= 2 * self.context:
+            return
+
+        head = (tag, i1, i1 + self.context, j1, j1 + self.context)
+        for group in group_opcodes(opcodes[:-1] + [head], self.context):
+            self.hunks.append(format_hunk(group, self.lines_orig, self.lines_updated))
+
+        self.opcodes = [opcodes[-1]]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+import hashlib
+import os
+from collections import Counter
+
+from diskcache import Cache
+
+from .dump import dump  # noqa: F401
+
+
+class FileCache:
+    """
+    One diskcache store for everything the repo map derives from a file: its
+    tags, its identifiers and the token counts of its map lines.
+
+    Entries are keyed on a hash of the file's content rather than its path and
+    mtime, so they survive branch switches, checkouts and moving the repo.
+    A (size, mtime_ns, inode) check avoids re-hashing files which haven't been
+    touched. The store is capped at size_limit bytes, evicting the least
+    recently used entries.
+    """
+
+    def __init__(self, directory, root, size_limit):
+        self.root = root
+        self.size_limit = size_limit
+        self.cache = Cache(
+            str(directory),
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+
+        # fname -> (stat signature, content key), for this process
+        self.content_keys = dict()
+
+        self.stats = Counter()
+
+    def get_content_key(self, fname):
+        "Returns a hash of the content of fname, or None if it can't be read"
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            return
+
+        signature = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+        entry = self.content_keys.get(fname)
+        if entry and entry[0] == signature:
+            return entry[1]
+
+        stat_key = ("stat", os.path.relpath(fname, self.root))
+        entry = self.cache.get(stat_key)
+        if entry and entry[0] == signature:
+            self.stats["stat hits"] += 1
+        else:
+            self.stats["stat misses"] += 1
+            try:
+                with open(fname, "rb") as f:
+                    content_key = hashlib.sha1(f.read()).hexdigest()
+            except OSError:
+                return
+
+            entry = (signature, content_key)
+            self.cache[stat_key] = entry
+
+        self.content_keys[fname] = entry
+        return entry[1]
+
+    def get(self, kind, content_key):
+        "kind is a tuple naming what is stored, like ('idents', '.py')"
+        value = self.cache.get(kind + (content_key,))
+        if value is None:
+            self.stats[f"{kind[0]} misses"] += 1
+        else:
+            self.stats[f"{kind[0]} hits"] += 1
+        return value
+
+    def set(self, kind, content_key, value):
+        self.cache[kind + (content_key,)] = value
+
+    def transact(self):
+        return self.cache.transact()
+
+    def close(self):
+        self.cache.close()
+
+    def report(self):
+        mb = 1024 * 1024
+        lines = [
+            f"Repo-map file cache: {len(self.cache)} entries,"
+            f" {self.cache.volume() / mb:.1f} of {self.size_limit / mb:.0f} MB"
+        ]
+        for kind in ("stat", "tags", "idents", "lines"):
+            hits = self.stats[f"{kind} hits"]
+            misses = self.stats[f"{kind} misses"]
+            lines.append(f"  {kind}: {hits} hits, {misses} misses")
+        return "\n".join(lines)
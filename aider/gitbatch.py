@@ -0,0 +1,179 @@
+import subprocess
+import threading
+
+from git.exc import GitCommandError
+
+from .dump import dump  # noqa: F401
+
+# keeps the command lines well under the ~32k chars windows allows
+MAX_PATHS_CHARS = 8000
+
+
+class GitBatch:
+    """
+    Runs git commands in the work tree at root, keeping one long lived
+    `git cat-file --batch` process to look up revisions and read objects,
+    so that doesn't cost a new process each time.
+
+    Errors are raised as GitPython's GitCommandError, like repo.git does.
+    """
+
+    def __init__(self, root, git_cmd="git"):
+        self.root = root
+        self.git_cmd = git_cmd
+
+        self.cat_file_proc = None
+        self.lock = threading.Lock()
+
+    def run(self, *args, check=True):
+        "Run git with args, and return its stdout as text"
+        cmd = [self.git_cmd] + list(args)
+        try:
+            res = subprocess.run(
+                cmd,
+                cwd=self.root,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except OSError as err:
+            raise GitCommandError(cmd, err)
+
+        if check and res.returncode:
+            raise GitCommandError(cmd, res.returncode, res.stderr, res.stdout)
+
+        return res.stdout.decode("utf-8", errors="replace").rstrip("\n")
+
+    def run_paths(self, args, paths, sep="\n"):
+        "Run git with args and then -- and the paths, in as many runs as it takes, joined by sep"
+        outputs = []
+
+        chunk = []
+        chunk_chars = 0
+        for path in paths:
+            chunk.append(path)
+            chunk_chars += len(path) + 1
+            if chunk_chars >= MAX_PATHS_CHARS:
+                outputs.append(self.run(*args, "--", *chunk))
+                chunk = []
+                chunk_chars = 0
+
+        if chunk:
+            outputs.append(self.run(*args, "--", *chunk))
+
+        return sep.join(output for output in outputs if output)
+
+    def start_cat_file(self):
+        if self.cat_file_proc and self.cat_file_proc.poll() is None:
+            return
+
+        self.cat_file_proc = subprocess.Popen(
+            [self.git_cmd, "cat-file", "--batch"],
+            cwd=self.root,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def cat_file(self, rev):
+        """
+        Look up rev, which can be anything git rev-parse takes. Returns the
+        (sha, type, content bytes) of the object, or None if there isn't one.
+        """
+        if "\n" in rev:
+            return
+
+        with self.lock:
+            self.start_cat_file()
+            proc = self.cat_file_proc
+            try:
+                proc.stdin.write(rev.encode("utf-8") + b"\n")
+                proc.stdin.flush()
+
+                header = proc.stdout.readline().decode("utf-8").split()
+                if len(header) != 3:
+                    # "<rev> missing", or "<rev> ambiguous"
+                    return
+
+                sha, kind, size = header
+                content = proc.stdout.read(int(size) + 1)[:-1]
+            except (OSError, ValueError):
+                self.close()
+                raise GitCommandError(["cat-file", "--batch", rev], "cat-file process failed")
+
+        return sha, kind, content
+
+    def rev_parse(self, rev):
+        "The sha rev names, or None"
+        res = self.cat_file(rev)
+        if res:
+            return res[0]
+
+    def get_commit_message(self, rev="HEAD"):
+        res = self.cat_file(rev)
+        if not res or res[1] != "commit":
+            return
+
+        # the headers end at the first blank line
+        content = res[2].decode("utf-8", errors="replace")
+        return content.partition("\n\n")[2]
+
+    def ls_files(self):
+        "The paths of the files in the index, except submodules, as git writes them"
+        out = self.run("ls-files", "-z", "--stage")
+
+        files = set()
+        for entry in out.split("\0"):
+            if not entry:
+                continue
+            info, _, path = entry.partition("\t")
+            # submodules are gitlinks, not files
+            if info.startswith("160000 "):
+                continue
+            files.add(path)
+        return files
+
+    def get_status(self, paths=None):
+        """
+        The tracked files which differ from HEAD in the index or the work
+        tree, as a list of (XY status code, path) like `git status --short`.
+        Only the given paths are looked at, if there are any.
+        """
+        # --no-optional-locks keeps status from rewriting the index
+        args = ["--no-optional-locks", "status", "--porcelain", "-z", "--untracked-files=no"]
+        if paths is None:
+            out = self.run(*args)
+        else:
+            out = self.run_paths(["--literal-pathspecs"] + args, paths, sep="\0")
+
+        status = []
+        entries = iter(out.split("\0"))
+        for entry in entries:
+            if not entry:
+                continue
+            code, path = entry[:2], entry[3:]
+            status.append((code, path))
+            # renames and copies are followed by the original path
+            if code[0] in "RC":
+                next(entries, None)
+        return status
+
+    def is_dirty(self):
+        "True if tracked files differ from HEAD, in the index or the work tree"
+        return bool(self.get_status())
+
+    def close(self):
+        proc = self.cat_file_proc
+        self.cat_file_proc = None
+        if not proc:
+            return
+
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+        proc.stdout.close()
+
+    def __del__(self):
+        self.close()
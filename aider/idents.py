@@ -0,0 +1,200 @@
+import bisect
+import keyword
+import os
+import re
+
+from .dump import dump  # noqa: F401
+
+# Fast, regex based replacements for lexing a whole file with pygments just to
+# collect its Token.Name strings. Each scanner returns the same list of names,
+# in the same order, as the pygments lexer for that language would.
+
+IDENT = r"[^\W\d]\w*"
+
+PY_NUMBER = (
+    r"(?:\d(?:_?\d)*\.(?:\d(?:_?\d)*)?|(?:\d(?:_?\d)*)?\.\d(?:_?\d)*)(?:[eE][+-]?\d(?:_?\d)*)?"
+    r"|\d(?:_?\d)*[eE][+-]?\d(?:_?\d)*j?"
+    r"|0[oO](?:_?[0-7])+"
+    r"|0[bB](?:_?[01])+"
+    r"|0[xX](?:_?[a-fA-F0-9])+"
+    r"|\d(?:_?\d)*"
+)
+
+PY_STRING = (
+    r"(?P<prefix>(?i:rb|br|rf|fr|r|u|b|f)?)"
+    r"(?P<body>'''(?:\\[\s\S]|[\s\S])*?(?:'''|\Z)"
+    r'|"""(?:\\[\s\S]|[\s\S])*?(?:"""|\Z)'
+    r"|'(?:[^'\\\n]|\\[\s\S])*'?"
+    r'|"(?:[^"\\\n]|\\[\s\S])*"?)'
+)
+
+PY_TOKEN = re.compile(
+    r"(?P<comment>#[^\n]*)"
+    rf"|(?P<string>{PY_STRING})"
+    rf"|(?P<number>{PY_NUMBER})"
+    r"|(?P<yieldfrom>yield from\b)"
+    rf"|(?P<fromimport>from(?:\s|\\\s)+(?P<fromns>(?:\.|(?!None\b){IDENT})*))"
+    rf"|(?P<import>import(?:\s|\\\s)+(?P<importns>(?:\.|{IDENT}|\s+as\s+|\s*,\s*)*))"
+    rf"|(?P<decorator>@{IDENT})"
+    rf"|(?P<ident>{IDENT})"
+)
+
+# inside an f-string {expression} there are no comments or import statements,
+# but brackets and the end of the expression matter
+PY_FSTRING_EXPR_TOKEN = re.compile(
+    rf"(?P<string>{PY_STRING})"
+    rf"|(?P<number>{PY_NUMBER})"
+    rf"|(?P<decorator>@{IDENT})"
+    rf"|(?P<ident>{IDENT})"
+    r"|(?P<open>[{(\[])"
+    r"|(?P<end>(?:=\s*)?(?:![sraf])?[}:])"
+    r"|(?P<close>[)\]])"
+)
+
+PY_FSTRING_SPECIAL = re.compile(r"\\N\{.*?\}|\\[\\\n'\"]|\{\{|\}\}|\{")
+PY_RAW_FSTRING_SPECIAL = re.compile(r"\\[\\\n'\"]|\{\{|\}\}|\{")
+
+PY_NAMESPACE_PART = re.compile(rf"\.|{IDENT}")
+
+PY_ROOT_KEYWORDS = set("""
+    assert async await break continue del elif else except finally for global if
+    lambda pass raise nonlocal return try while yield as with True False None
+    in is and or not
+    """.split())
+PY_EXPR_KEYWORDS = set("await else for if lambda yield True False None in is and or not".split())
+PY_DEF_KEYWORDS = ("def", "class")
+PY_DEF_SPACE = re.compile(r"\s|\\\s")
+
+PY_SOFT_KEYWORDS = ("match", "case")
+PY_NOT_SOFT_KEYWORD = re.compile(
+    r"[ \t]*(?:[:,;=^&|@~)\]}]|(?:" + "|".join(keyword.kwlist) + r")\b)"
+)
+PY_SOFT_KEYWORD_WILDCARD = re.compile(r"\s+[^\n_]*(_)\b")
+
+
+def scan_python_identifiers(content):
+    names = []
+    scan_python_tokens(content, names)
+    return names
+
+
+def scan_python_tokens(text, names):
+    line_starts = None
+    skip_wildcard = None
+
+    for match in PY_TOKEN.finditer(text):
+        kind = match.lastgroup
+
+        if kind == "ident":
+            name = match.group(kind)
+            if name in PY_ROOT_KEYWORDS:
+                continue
+
+            end = match.end()
+            if name in PY_DEF_KEYWORDS and PY_DEF_SPACE.match(text, end):
+                continue
+
+            start = match.start()
+            if name == "_" and start == skip_wildcard:
+                continue
+
+            if name in PY_SOFT_KEYWORDS:
+                if line_starts is None:
+                    line_starts = [0] + [m.end() for m in re.finditer("\n", text)]
+                line_start = line_starts[bisect.bisect_right(line_starts, start) - 1]
+                at_line_start = not text[line_start:start].strip(" \t")
+
+                if at_line_start and not PY_NOT_SOFT_KEYWORD.match(text, end):
+                    wildcard = PY_SOFT_KEYWORD_WILDCARD.match(text, end)
+                    if wildcard:
+                        skip_wildcard = wildcard.start(1)
+                    continue
+
+            names.append(name)
+        elif kind == "decorator":
+            names.append(match.group(kind))
+        elif kind == "fromimport":
+            names += PY_NAMESPACE_PART.findall(match.group("fromns"))
+        elif kind == "import":
+            parts = PY_NAMESPACE_PART.findall(match.group("importns"))
+            names += [part for part in parts if part != "as"]
+        elif kind == "string":
+            scan_python_string(match, names)
+
+
+def scan_python_string(match, names):
+    prefix = match.group("prefix").lower()
+    if "f" not in prefix:
+        return
+
+    body = match.group("body")
+    quote = body[:3] if body[:3] in ("'''", '"""') else body[0]
+    end = len(body) - len(quote) if body.endswith(quote) and len(body) > len(quote) else len(body)
+    body = body[len(quote) : end]
+
+    special = PY_RAW_FSTRING_SPECIAL if "r" in prefix else PY_FSTRING_SPECIAL
+
+    pos = 0
+    while True:
+        found = special.search(body, pos)
+        if not found:
+            return
+
+        if found.group() != "{":
+            pos = found.end()
+            continue
+
+        pos = scan_python_fstring_expr(body, found.end(), names)
+
+
+def scan_python_fstring_expr(text, pos, names):
+    "Collect the names in an f-string {expression}, return where it ends"
+    depth = 0
+    length = len(text)
+
+    while pos < length:
+        match = PY_FSTRING_EXPR_TOKEN.search(text, pos)
+        if not match:
+            return length
+        pos = match.end()
+
+        kind = match.lastgroup
+        if kind == "ident":
+            name = match.group(kind)
+            if name in PY_EXPR_KEYWORDS:
+                continue
+            if name == "async" and text.startswith(" for", pos):
+                continue
+            if name == "yield" and text.startswith(" from", pos):
+                pos += len(" from")
+                continue
+            names.append(name)
+        elif kind == "decorator":
+            names.append(match.group(kind))
+        elif kind == "string":
+            scan_python_string(match, names)
+        elif kind == "open":
+            depth += 1
+        elif kind == "close":
+            if depth:
+                depth -= 1
+        elif kind == "end":
+            if not depth:
+                return pos
+            if match.group(kind).endswith("}"):
+                depth -= 1
+
+    return pos
+
+
+IDENTIFIER_SCANNERS = {
+    ".py": scan_python_identifiers,
+    ".pyi": scan_python_identifiers,
+    ".pyw": scan_python_identifiers,
+}
+
+
+def get_identifier_scanner(fname):
+    "Returns the fast scanner for this kind of file, or None to fall back to pygments"
+    ext = os.path.splitext(fname)[1].lower()
+    return IDENTIFIER_SCANNERS.get(ext)
@@ -1,5 +1,7 @@
 import os
-from collections import defaultdict
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from datetime import datetime
 from pathlib import Path
 
@@ -91,6 +93,13 @@ class InputOutput:
     num_error_outputs = 0
     num_user_asks = 0
 
+    # max chars of file contents to keep in the read_text() cache
+    text_cache_size = 32 * 1024 * 1024
+
+    # a file whose mtime is this recent may be written again within the same
+    # tick of a coarse clock (HFS+, FAT, network mounts) without it moving on
+    text_racy_ns = 2 * 10**9
+
     def __init__(
         self,
         pretty=True,
@@ -131,6 +140,12 @@ class InputOutput:
         self.encoding = encoding
         self.dry_run = dry_run
 
+        # filename -> ((size, mtime_ns, inode), content), least recently used first
+        self.text_cache = OrderedDict()
+        self.text_cache_chars = 0
+        # the repo map warm up reads files from another thread
+        self.text_cache_lock = threading.Lock()
+
         if pretty:
             self.console = Console()
         else:
@@ -140,10 +155,25 @@ class InputOutput:
         self.append_chat_history(f"\n# aider chat started at {current_time}\n\n")
 
     def read_text(self, filename):
+        """
+        The same files get read many times a turn, so their contents are
+        cached until their size, mtime or inode changes. Files modified in
+        the last couple of seconds aren't cached, since their mtime can't be
+        trusted yet.
+        """
+        fname = str(filename)
         try:
-            with open(str(filename), "r", encoding=self.encoding) as f:
-                return f.read()
+            signature = self.get_text_signature(fname)
+            with self.text_cache_lock:
+                entry = self.text_cache.get(fname)
+                if entry and entry[0] == signature:
+                    self.text_cache.move_to_end(fname)
+                    return entry[1]
+
+            with open(fname, "r", encoding=self.encoding) as f:
+                content = f.read()
         except FileNotFoundError:
+            self.forget_text(fname)
             self.tool_error(f"{filename}: file not found error")
             return
         except UnicodeError as e:
@@ -151,12 +181,48 @@ class InputOutput:
             self.tool_error("Use --encoding to set the unicode encoding.")
             return
 
+        self.cache_text(fname, signature, content)
+        return content
+
     def write_text(self, filename, content):
         if self.dry_run:
             return
-        with open(str(filename), "w", encoding=self.encoding) as f:
+
+        fname = str(filename)
+        with open(fname, "w", encoding=self.encoding) as f:
             f.write(content)
 
+        # reading it back would translate any \r, so only cache it if there's none
+        if "\r" in content:
+            self.forget_text(fname)
+        else:
+            self.cache_text(fname, self.get_text_signature(fname), content)
+
+    def get_text_signature(self, fname):
+        stat = os.stat(fname)
+        return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def cache_text(self, fname, signature, content):
+        self.forget_text(fname)
+        if len(content) > self.text_cache_size:
+            return
+        if signature[1] > time.time_ns() - self.text_racy_ns:
+            return
+
+        with self.text_cache_lock:
+            self.text_cache[fname] = (signature, content)
+            self.text_cache_chars += len(content)
+
+            while self.text_cache_chars > self.text_cache_size:
+                _, (_, evicted) = self.text_cache.popitem(last=False)
+                self.text_cache_chars -= len(evicted)
+
+    def forget_text(self, fname):
+        with self.text_cache_lock:
+            entry = self.text_cache.pop(fname, None)
+            if entry:
+                self.text_cache_chars -= len(entry[1])
+
     def get_input(self, root, rel_fnames, addable_rel_fnames, commands):
         if self.pretty:
             style = dict(style=self.user_input_color) if self.user_input_color else dict()
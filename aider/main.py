@@ -159,6 +159,34 @@ def main(args=None, input=None, output=None):
         default=1024,
         help="Max number of tokens to use for repo map, use 0 to disable (default: 1024)",
     )
+    model_group.add_argument(
+        "--map-workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes used to build the repo map, use 0 for one per CPU"
+            " (default: 1)"
+        ),
+    )
+    model_group.add_argument(
+        "--map-cache-stats",
+        action="store_true",
+        help="Show repo map cache statistics each time the map is built",
+        default=False,
+    )
+    model_group.add_argument(
+        "--map-stats-json",
+        metavar="FILE",
+        default=None,
+        help="Append the timings and counts from building each repo map to a file, as JSON lines",
+    )
+    model_group.add_argument(
+        "--no-map-warmup",
+        action="store_false",
+        dest="map_warmup",
+        default=True,
+        help="Do not start building the repo map in the background at launch",
+    )
 
     ##########
     history_group = parser.add_argument_group("History Files")
@@ -214,6 +242,13 @@ def main(args=None, input=None, output=None):
         default=True,
         help="Disable streaming responses",
     )
+    output_group.add_argument(
+        "--render-fps",
+        type=int,
+        default=10,
+        metavar="FPS",
+        help="Redraw streaming responses at most this many times a second (default: 10)",
+    )
     output_group.add_argument(
         "--user-input-color",
         default="#00cc00",
@@ -284,6 +319,22 @@ def main(args=None, input=None, output=None):
         dest="dirty_commits",
         help="Disable commits when repo is found dirty",
     )
+    git_group.add_argument(
+        "--track-changes",
+        action="store_true",
+        dest="track_changes",
+        default=None,
+        help=(
+            "Watch the files for changes instead of checking every file each turn, polling"
+            " them where they can't be watched (default: only where they can be watched)"
+        ),
+    )
+    git_group.add_argument(
+        "--no-track-changes",
+        action="store_false",
+        dest="track_changes",
+        help="Check every file for changes each turn, instead of watching for them",
+    )
     git_group.add_argument(
         "--dry-run",
         action="store_true",
@@ -427,10 +478,16 @@ def main(args=None, input=None, output=None):
         dirty_commits=args.dirty_commits,
         dry_run=args.dry_run,
         map_tokens=args.map_tokens,
+        map_workers=args.map_workers,
+        map_cache_stats=args.map_cache_stats,
+        map_stats_json=args.map_stats_json,
+        map_warmup=args.map_warmup,
+        track_changes=args.track_changes,
         verbose=args.verbose,
         assistant_output_color=args.assistant_output_color,
         code_theme=args.code_theme,
         stream=args.stream,
+        render_fps=args.render_fps,
         use_git=args.git,
     )
 
@@ -0,0 +1,177 @@
+import re
+import time
+
+from rich.markdown import Markdown
+from rich.segment import Segment
+
+from .dump import dump  # noqa: F401
+
+fence_pattern = re.compile(r"(`{3,}|~{3,})")
+heading_pattern = re.compile(r"#{1,6}(\s|$)")
+list_item_pattern = re.compile(r"([-*+]|\d{1,9}[.)])(\s|$)")
+
+
+def split_blocks(text):
+    """
+    Split markdown text into the top level blocks which are already complete,
+    and the unfinished rest. A block ends at a closed code fence, an ATX
+    heading, or a blank line which is followed by an unindented line that
+    doesn't continue a list.
+
+    Returns (list of block texts, rest), and "".join(blocks) + rest == text.
+    """
+    blocks = []
+    start = 0
+    pos = 0
+
+    fence = None
+    content = False
+    blank = False
+
+    for line in text.splitlines(keepends=True):
+        # the end of the line may still change
+        if not line.endswith("\n"):
+            break
+
+        end = pos + len(line)
+        stripped = line.strip()
+        indent = len(line) - len(line.lstrip())
+
+        if fence:
+            if indent <= 3 and stripped.startswith(fence) and not stripped.strip(fence[0]):
+                fence = None
+                blocks.append(text[start:end])
+                start = end
+                content = False
+            pos = end
+            continue
+
+        if not stripped:
+            blank = content
+            pos = end
+            continue
+
+        if blank and not indent and not list_item_pattern.match(line):
+            blocks.append(text[start:pos])
+            start = pos
+
+        content = True
+        blank = False
+
+        if indent <= 3:
+            match = fence_pattern.match(stripped)
+            if match:
+                fence = match.group(1)
+            elif heading_pattern.match(stripped):
+                blocks.append(text[start:end])
+                start = end
+                content = False
+
+        pos = end
+
+    return blocks, text[start:]
+
+
+def is_blank(line):
+    return not "".join(segment.text for segment in line).strip("\n")
+
+
+class MarkdownBlock:
+    """
+    One block of markdown, which is parsed and rendered the first time it's
+    shown, and then again only if the width changes.
+    """
+
+    def __init__(self, text, style="none", code_theme="monokai"):
+        self.text = text
+        self.style = style
+        self.code_theme = code_theme
+
+        self.width = None
+        self.lines = None
+
+    def render(self, console, options):
+        if self.width == options.max_width:
+            return self.lines
+
+        md = Markdown(self.text, style=self.style, code_theme=self.code_theme)
+        lines = console.render_lines(md, options.update(height=None), pad=False)
+
+        # the stream puts one blank line between blocks, like rich does between elements
+        while lines and is_blank(lines[0]):
+            lines.pop(0)
+        while lines and is_blank(lines[-1]):
+            lines.pop()
+
+        self.width = options.max_width
+        self.lines = lines
+        return lines
+
+
+class MarkdownStream:
+    """
+    Shows a growing markdown response in a rich Live. The blocks which are
+    complete are rendered once and kept, so each refresh only parses the
+    unfinished tail. Refreshes are limited to fps a second, except the final
+    one.
+    """
+
+    def __init__(self, live, style="none", code_theme="monokai", fps=10):
+        self.live = live
+        self.style = style
+        self.code_theme = code_theme
+
+        self.min_delay = 1 / fps if fps and fps > 0 else 0
+        self.last_update = None
+
+        self.done_text = ""
+        self.blocks = []
+        self.tail = None
+
+    def is_due(self, final=False):
+        "True if it's time to update, so the caller can skip building the text until then"
+        if final or self.last_update is None:
+            return True
+        return time.monotonic() - self.last_update >= self.min_delay
+
+    def update(self, text):
+        self.last_update = time.monotonic()
+
+        if not text.startswith(self.done_text):
+            # an earlier part changed, start over
+            self.done_text = ""
+            self.blocks = []
+
+        blocks, rest = split_blocks(text[len(self.done_text) :])
+        for block in blocks:
+            self.blocks.append(self.make_block(block))
+        self.done_text += "".join(blocks)
+
+        if rest.strip():
+            self.tail = self.make_block(rest)
+        else:
+            self.tail = None
+
+        self.live.update(self, refresh=True)
+
+    def make_block(self, text):
+        return MarkdownBlock(text, style=self.style, code_theme=self.code_theme)
+
+    def __rich_console__(self, console, options):
+        blocks = self.blocks
+        if self.tail:
+            blocks = blocks + [self.tail]
+
+        new_line = Segment.line()
+        first = True
+        for block in blocks:
+            lines = block.render(console, options)
+            if not lines:
+                continue
+            if not first:
+                yield new_line
+            first = False
+
+            for line in lines:
+                yield from line
+                yield new_line
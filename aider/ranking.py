@@ -0,0 +1,500 @@
+from collections import Counter, defaultdict
+
+import networkx as nx
+import numpy as np
+
+from .dump import dump  # noqa: F401
+
+# Each engine takes the repo map's defines (ident -> set of files),
+# references (ident -> Counter of referencing file -> number of references),
+# personalization (file -> weight) and optionally the previous ranks to start
+# the power iteration from. It returns:
+#
+#   ranked: dict of file -> pagerank
+#   ranked_definitions: [((file, ident), rank), ...] sorted by descending rank
+#
+# They raise ZeroDivisionError if none of the personalized files are in the graph.
+
+
+def rank_networkx(defines, references, personalization, nstart=None):
+    "The reference implementation, one MultiDiGraph edge per (referencer, definer, ident)"
+    idents = set(defines.keys()).intersection(set(references.keys()))
+
+    G = nx.MultiDiGraph()
+
+    for ident in idents:
+        definers = defines[ident]
+        for referencer, num_refs in references[ident].items():
+            for definer in definers:
+                if referencer == definer:
+                    continue
+                G.add_edge(referencer, definer, weight=num_refs, ident=ident)
+
+    if personalization:
+        pers_args = dict(personalization=personalization, dangling=personalization)
+    else:
+        pers_args = dict()
+
+    # networkx can't start from a vector which is all zeros
+    if nstart and sum(nstart.get(node, 0) for node in G) > 0:
+        pers_args["nstart"] = nstart
+
+    ranked = nx.pagerank(G, weight="weight", **pers_args)
+
+    # distribute the rank from each source node, across all of its out edges
+    ranked_definitions = defaultdict(float)
+    for src in G.nodes:
+        src_rank = ranked[src]
+        total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
+        for _src, dst, data in G.out_edges(src, data=True):
+            data["rank"] = src_rank * data["weight"] / total_weight
+            ident = data["ident"]
+            ranked_definitions[(dst, ident)] += data["rank"]
+
+    ranked_definitions = sorted(ranked_definitions.items(), reverse=True, key=lambda x: x[1])
+    return ranked, ranked_definitions
+
+
+def rank_sparse(
+    defines, references, personalization, nstart=None, alpha=0.85, max_iter=100, tol=1e-6
+):
+    """
+    The same ranking as rank_networkx(), computed with int arrays of the
+    definitions and references instead of a graph of python objects.
+    """
+    idents = sorted(set(defines.keys()).intersection(set(references.keys())))
+
+    fnames = []
+    fname_ids = dict()
+
+    def fname_id(fname):
+        if fname not in fname_ids:
+            fname_ids[fname] = len(fnames)
+            fnames.append(fname)
+        return fname_ids[fname]
+
+    # (definer, ident) rows, and (referencer, ident, count) rows
+    def_fnames = []
+    def_idents = []
+    ref_fnames = []
+    ref_idents = []
+    ref_counts = []
+    for ident_id, ident in enumerate(idents):
+        for definer in defines[ident]:
+            def_fnames.append(fname_id(definer))
+            def_idents.append(ident_id)
+
+        for referencer, num_refs in references[ident].items():
+            ref_fnames.append(fname_id(referencer))
+            ref_idents.append(ident_id)
+            ref_counts.append(num_refs)
+
+    pers = None
+    if personalization:
+        pers = np.array([personalization.get(fname, 0) for fname in fnames], dtype=float)
+
+    start = None
+    if nstart:
+        start = np.array([nstart.get(fname, 0) for fname in fnames], dtype=float)
+
+    nodes, ranks, ranked_definitions = rank_ids(
+        np.array(def_fnames, dtype=np.int32),
+        np.array(def_idents, dtype=np.int32),
+        np.array(ref_fnames, dtype=np.int32),
+        np.array(ref_idents, dtype=np.int32),
+        np.array(ref_counts, dtype=float),
+        pers,
+        start,
+        alpha=alpha,
+        max_iter=max_iter,
+        tol=tol,
+    )
+
+    ranked = dict((fnames[node], rank) for node, rank in zip(nodes, ranks))
+    ranked_definitions = [
+        ((fnames[fname], idents[ident]), rank) for (fname, ident), rank in ranked_definitions
+    ]
+    return ranked, ranked_definitions
+
+
+def is_sorted(array):
+    return bool(np.all(array[:-1] <= array[1:]))
+
+
+def rank_ids(
+    def_fnames,
+    def_idents,
+    ref_fnames,
+    ref_idents,
+    ref_counts,
+    personalization=None,
+    nstart=None,
+    alpha=0.85,
+    max_iter=100,
+    tol=1e-6,
+):
+    """
+    The pagerank behind rank_sparse(), on int ids for the files and idents.
+    def_fnames and def_idents list each definition, ref_fnames, ref_idents
+    and ref_counts each referencing file and ident. personalization and
+    nstart are optional arrays of weights indexed by file id.
+
+    Returns the list of file ids in the graph, their ranks, and
+    [((file id, ident id), rank), ...] sorted by descending rank.
+    """
+    if not len(def_fnames) or not len(ref_fnames):
+        return [], [], []
+
+    num_fnames = int(max(def_fnames.max(), ref_fnames.max())) + 1
+    num_idents = int(max(def_idents.max(), ref_idents.max())) + 1
+
+    # sorted by (file, ident), which is also the order ties are ranked in
+    def_keys = def_fnames.astype(np.int64) * num_idents + def_idents
+    if not is_sorted(def_keys):
+        order = np.argsort(def_keys, kind="stable")
+        def_fnames, def_idents, def_keys = def_fnames[order], def_idents[order], def_keys[order]
+
+    # pair up the files which reference an ident they define themselves
+    ref_keys = ref_fnames.astype(np.int64)
+    ref_keys *= num_idents
+    ref_keys += ref_idents
+    order = None
+    if not is_sorted(ref_keys):
+        order = np.argsort(ref_keys, kind="stable")
+        ref_keys = ref_keys[order]
+    pos = np.minimum(np.searchsorted(ref_keys, def_keys), len(ref_keys) - 1)
+    is_self_ref = ref_keys[pos] == def_keys
+    self_defs = np.nonzero(is_self_ref)[0]
+    self_refs = pos[is_self_ref] if order is None else order[pos[is_self_ref]]
+    del ref_keys, order, pos, def_keys
+
+    # each reference has an edge of weight count to every other definer of its ident
+    num_definers = np.bincount(def_idents, minlength=num_idents).astype(np.int32)
+    num_targets = num_definers[ref_idents]
+    num_targets[self_refs] -= 1
+
+    out_weights = np.bincount(ref_fnames, weights=ref_counts * num_targets, minlength=num_fnames)
+
+    keep = num_targets > 0
+    del num_targets
+    new_rows = np.cumsum(keep, dtype=np.int32) - 1
+    is_kept = keep[self_refs]
+    self_defs, self_refs = self_defs[is_kept], new_rows[self_refs[is_kept]]
+    del new_rows
+    ref_fnames, ref_idents, ref_counts = ref_fnames[keep], ref_idents[keep], ref_counts[keep]
+    del keep
+
+    # a definition has an edge in, if some other file references its ident
+    num_referencers = np.bincount(ref_idents, minlength=num_idents)[def_idents]
+    num_referencers[self_defs] -= 1
+    has_edges = num_referencers > 0
+    new_rows = np.cumsum(has_edges, dtype=np.int32) - 1
+    is_kept = has_edges[self_defs]
+    self_defs, self_refs = new_rows[self_defs[is_kept]], self_refs[is_kept]
+    def_fnames, def_idents = def_fnames[has_edges], def_idents[has_edges]
+    del num_referencers, has_edges, new_rows
+
+    # only files with edges are nodes in the graph
+    is_node = out_weights > 0
+    is_node[def_fnames] = True
+    nodes = np.nonzero(is_node)[0]
+    num_nodes = len(nodes)
+    if not num_nodes:
+        return [], [], []
+
+    # the share of its referencer's rank which each reference passes to each definer
+    shares = ref_counts / out_weights[ref_fnames]
+    del ref_counts
+
+    flows = np.empty_like(shares)
+
+    def rank_in(x):
+        "The rank flowing into each definition, summed over every referencer of its ident"
+        np.take(x, ref_fnames, out=flows)
+        np.multiply(flows, shares, out=flows)
+        res = np.bincount(ref_idents, weights=flows, minlength=num_idents)[def_idents]
+        res[self_defs] -= flows[self_refs]
+        return res
+
+    if personalization is not None:
+        pers = np.where(is_node, personalization[:num_fnames], 0).astype(float)
+        if pers.sum() == 0:
+            raise ZeroDivisionError
+        pers /= pers.sum()
+    else:
+        pers = np.where(is_node, 1.0 / num_nodes, 0)
+
+    is_dangling = is_node & (out_weights == 0)
+
+    x = None
+    if nstart is not None:
+        x = np.where(is_node, nstart[:num_fnames], 0).astype(float)
+        x = x / x.sum() if x.sum() > 0 else None
+    if x is None:
+        x = np.where(is_node, 1.0 / num_nodes, 0)
+
+    for _ in range(max_iter):
+        xlast = x
+        x = np.bincount(def_fnames, weights=rank_in(x), minlength=num_fnames)
+        x = alpha * (x + xlast[is_dangling].sum() * pers) + (1 - alpha) * pers
+        if np.absolute(x - xlast).sum() < num_nodes * tol:
+            break
+    else:
+        raise nx.PowerIterationFailedConvergence(max_iter)
+
+    def_ranks = rank_in(x)
+    order = np.argsort(-def_ranks, kind="stable")
+    ranked_definitions = list(
+        zip(
+            zip(def_fnames[order].tolist(), def_idents[order].tolist()),
+            def_ranks[order].tolist(),
+        )
+    )
+
+    return nodes.tolist(), x[nodes].tolist(), ranked_definitions
+
+
+RANK_ENGINES = dict(
+    sparse=rank_sparse,
+    networkx=rank_networkx,
+)
+
+
+class FileRecord:
+    "What one file contributes to a ReferenceGraph, as interned ids"
+
+    __slots__ = ("fname_id", "defined", "ref_idents", "ref_counts", "definitions")
+
+    def __init__(self, fname_id, defined, ref_idents, ref_counts, definitions):
+        self.fname_id = fname_id
+
+        # sorted ident ids, and how often each is referenced, as int32 arrays
+        self.defined = defined
+        self.ref_idents = ref_idents
+        self.ref_counts = ref_counts
+
+        # ident -> tuple of the file's definitions of it
+        self.definitions = definitions
+
+
+class ReferenceGraph:
+    """
+    The definitions and references of a set of files, updated one file at a
+    time so that unchanged files needn't be re-read between turns.
+
+    Files and idents are interned as int ids, and each file's references are
+    kept as arrays of ids and counts rather than dicts of strings.
+    """
+
+    def __init__(self):
+        self.fnames = []
+        self.fname_ids = dict()
+        self.idents = []
+        self.ident_ids = dict()
+
+        # rel_fname -> FileRecord
+        self.files = dict()
+
+        # ident id -> tuple of the ids of the files which define it
+        self.definers = dict()
+
+        # the last pagerank, to warm start the next one
+        self.ranked = None
+
+    def intern_fname(self, fname):
+        fname_id = self.fname_ids.get(fname)
+        if fname_id is None:
+            fname_id = self.fname_ids[fname] = len(self.fnames)
+            self.fnames.append(fname)
+        return fname_id
+
+    def intern_ident(self, ident):
+        ident_id = self.ident_ids.get(ident)
+        if ident_id is None:
+            ident_id = self.ident_ids[ident] = len(self.idents)
+            self.idents.append(ident)
+        return ident_id
+
+    def add_file(self, rel_fname, definitions, idents):
+        """
+        Replace everything rel_fname contributes to the graph. definitions is a
+        list of (ident, definition) pairs, idents lists every referenced name.
+        """
+        self.remove_file(rel_fname)
+
+        fname_id = self.intern_fname(rel_fname)
+
+        file_definitions = defaultdict(list)
+        for ident, definition in definitions:
+            if definition not in file_definitions[ident]:
+                file_definitions[ident].append(definition)
+
+        defined = np.array(
+            sorted(self.intern_ident(ident) for ident in file_definitions), dtype=np.int32
+        )
+        for ident_id in defined.tolist():
+            self.definers[ident_id] = self.definers.get(ident_id, ()) + (fname_id,)
+
+        refs = Counter(self.intern_ident(ident) for ident in idents)
+        ref_idents = np.array(sorted(refs), dtype=np.int32)
+        ref_counts = np.array([refs[ident_id] for ident_id in ref_idents.tolist()], dtype=np.int32)
+
+        self.files[rel_fname] = FileRecord(
+            fname_id,
+            defined,
+            ref_idents,
+            ref_counts,
+            dict((ident, tuple(defs)) for ident, defs in file_definitions.items()),
+        )
+
+    def remove_file(self, rel_fname):
+        record = self.files.pop(rel_fname, None)
+        if not record:
+            return
+
+        for ident_id in record.defined.tolist():
+            definers = tuple(
+                fname_id for fname_id in self.definers[ident_id] if fname_id != record.fname_id
+            )
+            if definers:
+                self.definers[ident_id] = definers
+            else:
+                del self.definers[ident_id]
+
+    def get_definitions(self, rel_fname, ident):
+        record = self.files.get(rel_fname)
+        if not record:
+            return ()
+        return record.definitions.get(ident, ())
+
+    def get_defined(self, rel_fname):
+        "The idents defined in rel_fname"
+        return [self.idents[ident_id] for ident_id in self.files[rel_fname].defined.tolist()]
+
+    def get_definers(self, ident):
+        "The files which define ident"
+        ident_id = self.ident_ids.get(ident)
+        return set(self.fnames[fname_id] for fname_id in self.definers.get(ident_id, ()))
+
+    @property
+    def defines(self):
+        "ident -> set of files, as rank_networkx() takes it"
+        return self.subgraph(self.files)[0]
+
+    @property
+    def references(self):
+        "ident -> Counter of files -> number of references, as rank_networkx() takes it"
+        return self.subgraph(self.files)[1]
+
+    def neighborhood(self, fnames, hops, max_files):
+        """
+        The files within hops steps of fnames, stepping from each file to the
+        files which define the idents it references. The most referenced
+        files are taken first, and the search stops at max_files.
+        """
+        found = set(fname for fname in fnames if fname in self.files)
+        frontier = found
+
+        for _ in range(hops):
+            # sum per ident first, common idents like __init__ have
+            # thousands of definers
+            ident_refs = Counter()
+            for fname in frontier:
+                record = self.files[fname]
+                for ident_id, count in zip(record.ref_idents.tolist(), record.ref_counts.tolist()):
+                    ident_refs[ident_id] += count
+
+            num_refs = Counter()
+            for ident_id, count in ident_refs.items():
+                for fname_id in self.definers.get(ident_id, ()):
+                    definer = self.fnames[fname_id]
+                    if definer not in found:
+                        num_refs[definer] += count
+
+            room = max_files - len(found)
+            if not num_refs or room <= 0:
+                break
+
+            # most referenced first, ties broken by name
+            ranked = sorted(num_refs.items(), key=lambda item: (-item[1], item[0]))
+            frontier = set(fname for fname, _ in ranked[:room])
+            found.update(frontier)
+
+        return found
+
+    def subgraph(self, fnames):
+        "The defines and references made by just the files in fnames, as dicts of strings"
+        defines = defaultdict(set)
+        references = defaultdict(Counter)
+        for fname in fnames:
+            record = self.files[fname]
+            for ident_id in record.defined.tolist():
+                defines[self.idents[ident_id]].add(fname)
+            for ident_id, num_refs in zip(record.ref_idents.tolist(), record.ref_counts.tolist()):
+                references[self.idents[ident_id]][fname] = num_refs
+
+        return defines, references
+
+    def get_arrays(self, fnames):
+        "The definition and reference rows of the files in fnames, as id arrays"
+        # in file id order, so the rows come out sorted for rank_ids()
+        records = sorted(
+            (self.files[fname] for fname in fnames), key=lambda record: record.fname_id
+        )
+
+        def concat(arrays):
+            return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int32)
+
+        fname_ids = np.array([record.fname_id for record in records], dtype=np.int32)
+
+        def_idents = concat([record.defined for record in records])
+        def_fnames = np.repeat(fname_ids, [len(record.defined) for record in records])
+
+        ref_idents = concat([record.ref_idents for record in records])
+        ref_counts = concat([record.ref_counts for record in records])
+        ref_fnames = np.repeat(fname_ids, [len(record.ref_idents) for record in records])
+
+        return def_fnames, def_idents, ref_fnames, ref_idents, ref_counts
+
+    def rank(self, personalization, rank_engine, fnames=None):
+        """
+        Rank the whole graph, or only the part of it made by fnames, with the
+        named engine from RANK_ENGINES.
+        """
+        if fnames is None:
+            fnames = self.files
+
+        if rank_engine == "sparse":
+            ranked, ranked_definitions = self.rank_sparse(personalization, fnames)
+        else:
+            defines, references = self.subgraph(fnames)
+            ranked, ranked_definitions = RANK_ENGINES[rank_engine](
+                defines, references, personalization, nstart=self.ranked
+            )
+
+        self.ranked = ranked
+        return ranked, ranked_definitions
+
+    def rank_sparse(self, personalization, fnames):
+        "rank_sparse() straight from the interned arrays"
+
+        def by_fname_id(weights):
+            res = np.zeros(len(self.fnames), dtype=float)
+            for fname, weight in weights.items():
+                fname_id = self.fname_ids.get(fname)
+                if fname_id is not None:
+                    res[fname_id] = weight
+            return res
+
+        pers = by_fname_id(personalization) if personalization else None
+        nstart = by_fname_id(self.ranked) if self.ranked else None
+
+        # no references are kept here, so rank_ids() can free each array once it's done with it
+        nodes, ranks, ranked_definitions = rank_ids(*self.get_arrays(fnames), pers, nstart)
+
+        ranked = dict((self.fnames[node], rank) for node, rank in zip(nodes, ranks))
+        ranked_definitions = [
+            ((self.fnames[fname_id], self.idents[ident_id]), rank)
+            for (fname_id, ident_id), rank in ranked_definitions
+        ]
+        return ranked, ranked_definitions
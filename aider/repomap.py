@@ -1,21 +1,32 @@
 import colorsys
+import hashlib
+import heapq
 import json
+import multiprocessing
 import os
 import random
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from itertools import repeat
 from pathlib import Path
 
-import networkx as nx
 import tiktoken
-from diskcache import Cache
 from pygments.lexers import guess_lexer_for_filename
 from pygments.token import Token
 from pygments.util import ClassNotFound
 
 from aider import models
+from aider.filecache import FileCache
+from aider.idents import get_identifier_scanner
+from aider.ranking import ReferenceGraph
+from aider.tags import CtagsExtractor, PythonAstExtractor
 
 from .dump import dump  # noqa: F402
 
@@ -24,30 +35,70 @@ def to_tree(tags):
     if not tags:
         return ""
 
-    tags = sorted(tags)
+    return "".join(iter_tree_lines(sorted(tags)))
 
-    output = ""
-    last = [None] * len(tags[0])
+
+def iter_tree_lines(tags):
+    """
+    Yields the lines of to_tree() for tags which are already sorted. Each tag
+    only looks at the one before it, so rendering the next k tags costs O(k).
+    """
+    last = ()
     tab = "\t"
     for tag in tags:
-        tag = list(tag)
-
-        for i in range(len(last) + 1):
-            if i == len(last):
-                break
-            if last[i] != tag[i]:
+        num_common = 0
+        for prev_item, item in zip(last, tag):
+            if prev_item != item:
                 break
-
-        num_common = i
+            num_common += 1
 
         indent = tab * num_common
-        rest = tag[num_common:]
-        for item in rest:
-            output += indent + item + "\n"
+        for item in tag[num_common:]:
+            yield indent + item + "\n"
             indent += tab
         last = tag
 
-    return output
+
+def get_name_identifiers_from_content(fname, content):
+    scanner = get_identifier_scanner(fname)
+    if scanner:
+        return scanner(content)
+
+    return get_pygments_identifiers(fname, content)
+
+
+def get_pygments_identifiers(fname, content):
+    try:
+        lexer = guess_lexer_for_filename(fname, content)
+    except ClassNotFound:
+        return list()
+
+    # lexer.get_tokens_unprocessed() returns (char position in file, token type, token string)
+    tokens = list(lexer.get_tokens_unprocessed(content))
+    res = [token[2] for token in tokens if token[1] in Token.Name]
+    return res
+
+
+def get_name_identifiers_from_file(fname, encoding):
+    "Module level, so that it can be run in a worker process"
+    try:
+        with open(fname, "r", encoding=encoding) as f:
+            content = f.read()
+    except (FileNotFoundError, UnicodeError):
+        return list()
+
+    return get_name_identifiers_from_content(fname, content)
+
+
+def get_mp_context():
+    """
+    The workers are started by a forkserver, or spawned where there isn't one.
+    Forking them straight from this process could deadlock, since the map can
+    be built while other threads (the warm up, the prompt, the transport) run.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
 
 
 def fname_to_components(fname, with_colon):
@@ -60,6 +111,129 @@ def fname_to_components(fname, with_colon):
     return res
 
 
+class DirectorySummary:
+    """
+    A directory in the directory summary map, which is either expanded into
+    its files and subdirectories or summarized in a single line.
+    """
+
+    max_symbols = 3
+
+    def __init__(self, name):
+        self.name = name
+        self.subdirs = dict()
+        self.fnames = []
+        self.num_files = 0
+        self.rank = None
+        self.symbols = []
+        self.expanded = False
+
+    def add_file(self, rank, symbols):
+        "Count a file anywhere below this directory, adding them in rank order"
+        self.num_files += 1
+        if self.rank is None:
+            self.rank = rank
+
+        for symbol in symbols:
+            if len(self.symbols) >= self.max_symbols:
+                break
+            if symbol not in self.symbols:
+                self.symbols.append(symbol)
+
+    def header_line(self, depth):
+        return "\t" * depth + self.name + os.sep + "\n"
+
+    def summary_line(self, depth):
+        num_files = f"{self.num_files} file" + ("s" if self.num_files != 1 else "")
+        if self.symbols:
+            num_files += ": " + ", ".join(self.symbols)
+        return "\t" * depth + self.name + os.sep + f" ({num_files})\n"
+
+    def child_lines(self, depth):
+        "The lines listing the contents of this directory, when it is expanded"
+        entries = [(name + os.sep, subdir) for name, subdir in self.subdirs.items()]
+        entries += [(fname, None) for fname in self.fnames]
+
+        for name, subdir in sorted(entries, key=lambda entry: entry[0]):
+            if subdir is None:
+                yield "\t" * depth + name + "\n"
+            elif subdir.expanded:
+                yield subdir.header_line(depth)
+                yield from subdir.child_lines(depth + 1)
+            else:
+                yield subdir.summary_line(depth)
+
+
+class MapStats:
+    """
+    Timings and counts from building a repo map. Phases can nest, and the
+    time of each phase leaves out the phases nested inside it.
+    """
+
+    # in the order they run
+    phases = [
+        "warm up",
+        "cache key",
+        "stat",
+        "tags",
+        "idents",
+        "graph",
+        "rank",
+        "fit",
+        "listing",
+        "tokenize",
+    ]
+
+    def __init__(self, file_cache_stats=None):
+        self.secs = Counter()
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+        # per thread, the time spent in the phases nested in each running phase
+        self.local = threading.local()
+
+        self.file_cache_start = Counter(file_cache_stats or dict())
+
+    @contextmanager
+    def timer(self, phase):
+        nested = getattr(self.local, "nested", None)
+        if nested is None:
+            nested = self.local.nested = []
+
+        start = time.perf_counter()
+        nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.secs[phase] += elapsed - nested.pop()
+            if nested:
+                nested[-1] += elapsed
+
+    def add_file_cache_stats(self, file_cache_stats):
+        "Count the file cache hits and misses since this MapStats was made"
+        for name, count in (file_cache_stats - self.file_cache_start).items():
+            self.counts[f"file cache {name}"] = count
+
+    def to_dict(self):
+        return dict(
+            secs=dict((phase, round(secs, 6)) for phase, secs in self.secs.items()),
+            counts=dict(self.counts),
+        )
+
+    def report(self):
+        phases = [phase for phase in self.phases if phase in self.secs]
+        phases += sorted(phase for phase in self.secs if phase not in self.phases)
+
+        lines = [f"Repo-map stats, {sum(self.secs.values()):.3f}s in total:"]
+        for phase in phases:
+            lines.append(f"  {phase}: {self.secs[phase]:.3f}s")
+        for name, count in sorted(self.counts.items()):
+            lines.append(f"  {name}: {count}")
+        return "\n".join(lines)
+
+
 class RepoMap:
     CACHE_VERSION = 1
     ctags_cmd = [
@@ -69,8 +243,22 @@ class RepoMap:
         "--output-format=json",
         "--output-encoding=utf-8",
     ]
-    IDENT_CACHE_DIR = f".aider.ident.cache.v{CACHE_VERSION}"
-    TAGS_CACHE_DIR = f".aider.tags.cache.v{CACHE_VERSION}"
+    FILE_CACHE_DIR = f".aider.map.cache.v{CACHE_VERSION}"
+
+    # max bytes of tags, identifiers and line token counts to keep on disk
+    file_cache_size_limit = 256 * 1024 * 1024
+
+    # max number of files to hand to a single ctags process
+    ctags_batch_size = 1000
+
+    # how many rendered maps to remember
+    map_cache_size = 8
+
+    # in repos with more files than this, only the files near the chat files
+    # are ranked and the rest are just listed
+    neighborhood_threshold = 5000
+    neighborhood_hops = 2
+    neighborhood_max_files = 1000
 
     ctags_disabled_reason = "ctags not initialized"
 
@@ -82,16 +270,34 @@ class RepoMap:
         io=None,
         repo_content_prefix=None,
         verbose=False,
+        map_workers=1,
+        tag_extractors=None,
+        rank_engine="sparse",
+        repo=None,
+        map_cache_stats=False,
+        map_stats_json=None,
+        change_tracker=None,
     ):
         self.io = io
         self.verbose = verbose
+        self.map_cache_stats = map_cache_stats
+        self.map_stats_json = map_stats_json
+        self.rank_engine = rank_engine
+        self.repo = repo
+
+        if not map_workers or map_workers < 1:
+            map_workers = os.cpu_count() or 1
+        self.map_workers = map_workers
+
+        # started on first use, and kept for the later updates
+        self.executor = None
+        self.executor_lock = threading.Lock()
 
         if not root:
             root = os.getcwd()
         self.root = root
 
-        self.load_ident_cache()
-        self.load_tags_cache()
+        self.load_file_cache()
 
         self.max_map_tokens = map_tokens
         self.has_ctags = self.check_for_ctags()
@@ -101,10 +307,175 @@ class RepoMap:
         else:
             self.use_ctags = False
 
+        # the first extractor which accepts a file provides its tags
+        if tag_extractors is None:
+            tag_extractors = [PythonAstExtractor()]
+            if self.has_ctags:
+                tag_extractors.append(CtagsExtractor())
+        self.tag_extractors = tag_extractors
+
+        if map_tokens > 0 and self.tag_extractors:
+            self.use_tags = True
+        else:
+            self.use_tags = False
+
         self.tokenizer = tiktoken.encoding_for_model(main_model.name)
         self.repo_content_prefix = repo_content_prefix
 
+        # kept between turns, and only updated for the files which change
+        self.graph = ReferenceGraph()
+        self.graph_mtimes = dict()
+        self.last_ranked_tags = None
+
+        # rendered maps, keyed on everything which goes into them
+        self.map_cache = dict()
+        self.map_cache_hits = 0
+        self.map_cache_misses = 0
+
+        # token counts of the lines of rendered maps
+        self.line_tokens = dict()
+
+        self.warm_up_thread = None
+
+        # with a change tracker, the files are only stat-ed when it says they
+        # changed. Its owner gives it the files and polls it each turn.
+        # changed_fnames collects them until update_graph() runs, and is None
+        # when they all need checking.
+        self.change_tracker = change_tracker
+        if change_tracker:
+            self.change_token = change_tracker.subscribe()
+        self.changed_fnames = None
+        self.files_version = 0
+
+        # from the last get_repo_map(), and the warm up it waited for
+        self.stats = MapStats(self.file_cache.stats)
+
+    def warm_up(self, chat_files, other_files):
+        """
+        Start reading the files and ranking them in a background thread, so the
+        first get_repo_map() finds the caches and the graph ready.
+        """
+        if self.max_map_tokens <= 0 or not self.use_tags or not other_files:
+            return
+
+        self.stats = MapStats(self.file_cache.stats)
+        self.stats.counts["warm up"] = 1
+
+        self.warm_up_thread = threading.Thread(
+            target=self.run_warm_up,
+            args=(set(chat_files), set(other_files)),
+            daemon=True,
+        )
+        self.warm_up_thread.start()
+
+    def run_warm_up(self, chat_files, other_files):
+        try:
+            self.get_ranked_tags(chat_files, other_files)
+        except Exception:
+            # it's only a head start, get_repo_map() will redo whatever failed
+            pass
+
+    def wait_for_warm_up(self):
+        if not self.warm_up_thread:
+            return
+
+        self.warm_up_thread.join()
+        self.warm_up_thread = None
+
     def get_repo_map(self, chat_files, other_files):
+        if self.warm_up_thread:
+            with self.stats.timer("warm up"):
+                self.wait_for_warm_up()
+        else:
+            self.stats = MapStats(self.file_cache.stats)
+
+        with self.stats.timer("cache key"):
+            key = self.get_map_cache_key(chat_files, other_files)
+
+        if key in self.map_cache:
+            self.map_cache_hits += 1
+            self.stats.counts["map cache hits"] += 1
+            repo_content = self.map_cache[key]
+        else:
+            self.map_cache_misses += 1
+            self.stats.counts["map cache misses"] += 1
+            repo_content = self.render_repo_map(chat_files, other_files)
+
+            self.map_cache[key] = repo_content
+            while len(self.map_cache) > self.map_cache_size:
+                del self.map_cache[next(iter(self.map_cache))]
+
+        self.stats.add_file_cache_stats(self.file_cache.stats)
+
+        if self.verbose:
+            self.io.tool_output(
+                f"Repo-map cache: {self.map_cache_hits} hits, {self.map_cache_misses} misses"
+            )
+            self.io.tool_output(self.stats.report())
+        if self.map_cache_stats:
+            self.io.tool_output(self.file_cache.report())
+        if self.map_stats_json:
+            self.write_stats_json()
+
+        return repo_content
+
+    def write_stats_json(self):
+        "Append the stats as a line of json to the map_stats_json file"
+        stats = self.stats.to_dict()
+        stats["time"] = time.time()
+        stats["root"] = str(self.root)
+        stats["map_tokens"] = self.max_map_tokens
+
+        try:
+            with open(self.map_stats_json, "a", encoding="utf-8") as f:
+                f.write(json.dumps(stats) + "\n")
+        except OSError as err:
+            self.io.tool_error(f"Unable to write repo map stats to {self.map_stats_json}: {err}")
+
+    def get_map_cache_key(self, chat_files, other_files):
+        fingerprint = hashlib.sha1()
+        if self.change_tracker:
+            self.collect_changes()
+            fingerprint.update(f"{self.files_version}\n".encode())
+            for fname in sorted(set(chat_files).union(other_files)):
+                fingerprint.update(f"{fname}\n".encode())
+        else:
+            for fname in sorted(set(chat_files).union(other_files)):
+                try:
+                    stat = os.stat(fname)
+                    fingerprint.update(f"{fname}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode())
+                except OSError:
+                    fingerprint.update(f"{fname}\0\n".encode())
+
+        return (
+            frozenset(chat_files),
+            self.max_map_tokens,
+            fingerprint.hexdigest(),
+            self.get_head_sha(),
+        )
+
+    def collect_changes(self):
+        "Collect the files the change tracker saw change, and bump files_version if any did"
+        changes = self.change_tracker.get_changes(self.change_token)
+        if changes is None:
+            self.changed_fnames = None
+        elif not changes:
+            return
+        elif self.changed_fnames is not None:
+            self.changed_fnames.update(changes)
+
+        self.files_version += 1
+
+    def get_head_sha(self):
+        if not self.repo:
+            return
+
+        try:
+            return self.repo.head.commit.hexsha
+        except ValueError:
+            return
+
+    def render_repo_map(self, chat_files, other_files):
         res = self.choose_files_listing(chat_files, other_files)
         if not res:
             return
@@ -135,7 +506,7 @@ class RepoMap:
         if not other_files:
             return
 
-        if self.use_ctags:
+        if self.use_tags:
             files_listing = self.get_ranked_tags_map(chat_files, other_files)
             if files_listing:
                 num_tokens = self.token_count(files_listing)
@@ -144,14 +515,120 @@ class RepoMap:
                 ctags_msg = " with selected ctags info"
                 return files_listing, ctags_msg
 
-        files_listing = self.get_simple_files_map(other_files)
-        ctags_msg = ""
-        num_tokens = self.token_count(files_listing)
-        if self.verbose:
-            self.io.tool_output(f"simple map: {num_tokens/1024:.1f} k-tokens")
-        if num_tokens < self.max_map_tokens:
+        # every file takes at least a token, so don't list them all to find out
+        if len(other_files) < self.max_map_tokens:
+            with self.stats.timer("listing"):
+                files_listing = self.get_simple_files_map(other_files)
+            ctags_msg = ""
+            num_tokens = self.token_count(files_listing)
+            if self.verbose:
+                self.io.tool_output(f"simple map: {num_tokens/1024:.1f} k-tokens")
+            if num_tokens < self.max_map_tokens:
+                return files_listing, ctags_msg
+
+        with self.stats.timer("listing"):
+            files_listing = self.get_directory_summary_map(chat_files, other_files)
+        if files_listing:
+            if self.verbose:
+                num_tokens = self.token_count(files_listing)
+                self.io.tool_output(f"directory summary map: {num_tokens/1024:.1f} k-tokens")
+            ctags_msg = " summarized by directory"
             return files_listing, ctags_msg
 
+    def get_file_ranks(self, chat_files, other_files):
+        """
+        Returns each file's position in the ranked tags, and the names it
+        defines, best ranked first. Without tags, all the files rank the same.
+        """
+        ranks = dict()
+        symbols = defaultdict(list)
+        if not self.use_tags:
+            return ranks, symbols
+
+        for i, tag in enumerate(self.get_ranked_tags(chat_files, other_files)):
+            rel_fname = tag[0]
+            ranks.setdefault(rel_fname, i)
+            if len(tag) > 1:
+                symbols[rel_fname].append(tag[-1].split(" ")[0])
+
+        # files which nothing references still have their definitions
+        for rel_fname in self.graph.files:
+            if rel_fname not in symbols:
+                symbols[rel_fname] = sorted(self.graph.get_defined(rel_fname))
+
+        return ranks, symbols
+
+    def get_directory_summary_map(self, chat_files, other_files):
+        """
+        A map listing the top level of the repo with one summary line per
+        directory, then expanding the best ranked directories into their
+        contents for as long as the map fits in max_map_tokens.
+        """
+        ranks, symbols = self.get_file_ranks(chat_files, other_files)
+
+        rel_fnames = [self.get_rel_fname(fname) for fname in other_files]
+        unranked = len(rel_fnames) + len(ranks)
+        rel_fnames.sort(key=lambda rel_fname: (ranks.get(rel_fname, unranked), rel_fname))
+
+        root = DirectorySummary("")
+        for rel_fname in rel_fnames:
+            rank = ranks.get(rel_fname, unranked)
+            file_symbols = symbols.get(rel_fname, [])
+
+            *dir_names, fname = rel_fname.split(os.sep)
+            node = root
+            node.add_file(rank, file_symbols)
+            for name in dir_names:
+                if name not in node.subdirs:
+                    node.subdirs[name] = DirectorySummary(name)
+                node = node.subdirs[name]
+                node.add_file(rank, file_symbols)
+            node.fnames.append(fname)
+
+        def count(lines):
+            return sum(self.line_token_count(line) for line in lines)
+
+        root.expanded = True
+        num_tokens = count(root.child_lines(0))
+        if num_tokens > self.max_map_tokens:
+            return
+
+        # best ranked first, then the smallest
+        candidates = []
+
+        def add_candidates(node, depth):
+            for name, subdir in node.subdirs.items():
+                entry = (subdir.rank, subdir.num_files, name, depth, id(subdir), subdir)
+                heapq.heappush(candidates, entry)
+
+        add_candidates(root, 0)
+
+        expanded = []
+        while candidates:
+            *_, depth, _, node = heapq.heappop(candidates)
+
+            # only the lines of the directory itself change
+            delta = count(node.child_lines(depth + 1))
+            delta += self.line_token_count(node.header_line(depth))
+            delta -= self.line_token_count(node.summary_line(depth))
+            if num_tokens + delta > self.max_map_tokens:
+                continue
+
+            node.expanded = True
+            num_tokens += delta
+            expanded.append(node)
+            add_candidates(node, depth + 1)
+
+        # the line counts are estimates, so check the whole map
+        files_listing = "".join(root.child_lines(0))
+        while self.token_count(files_listing) > self.max_map_tokens:
+            if not expanded:
+                return
+            expanded.pop().expanded = False
+            files_listing = "".join(root.child_lines(0))
+
+        return files_listing
+
     def get_simple_files_map(self, other_files):
         fnames = []
         for fname in other_files:
@@ -162,7 +639,8 @@ class RepoMap:
         return to_tree(fnames)
 
     def token_count(self, string):
-        return len(self.tokenizer.encode(string))
+        with self.stats.timer("tokenize"):
+            return len(self.tokenizer.encode(string))
 
     def get_rel_fname(self, fname):
         return os.path.relpath(fname, self.root)
@@ -172,15 +650,6 @@ class RepoMap:
         return [path + ":"]
 
     def run_ctags(self, filename):
-        # Check if the file is in the cache and if the modification time has not changed
-        file_mtime = self.get_mtime(filename)
-        if file_mtime is None:
-            return []
-
-        cache_key = filename
-        if cache_key in self.TAGS_CACHE and self.TAGS_CACHE[cache_key]["mtime"] == file_mtime:
-            return self.TAGS_CACHE[cache_key]["data"]
-
         cmd = self.ctags_cmd + [
             f"--input-encoding={self.io.encoding}",
             filename,
@@ -196,11 +665,149 @@ class RepoMap:
                 self.io.tool_error(f"Error parsing ctags output: {err}")
                 self.io.tool_error(repr(line))
 
-        # Update the cache
-        self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
-        self.save_tags_cache()
         return data
 
+    def run_ctags_batch(self, filenames):
+        """
+        Run a single ctags process over many files, feeding the filenames via
+        `-L -`. Returns a dict mapping each filename to its list of tags.
+        """
+        cmd = self.ctags_cmd + [
+            f"--input-encoding={self.io.encoding}",
+            "-L",
+            "-",
+        ]
+        file_list = "".join(fname + "\n" for fname in filenames).encode("utf-8")
+        output = subprocess.check_output(cmd, input=file_list, stderr=subprocess.PIPE)
+        output_lines = output.decode("utf-8").splitlines()
+
+        data = dict((fname, []) for fname in filenames)
+        for line in output_lines:
+            try:
+                tag = json.loads(line)
+            except json.decoder.JSONDecodeError as err:
+                self.io.tool_error(f"Error parsing ctags output: {err}")
+                self.io.tool_error(repr(line))
+                continue
+
+            path = tag.get("path")
+            if path in data:
+                data[path].append(tag)
+
+        return data
+
+    def get_tag_extractor(self, fname):
+        for extractor in self.tag_extractors:
+            if extractor.accepts(fname):
+                return extractor
+
+    def get_tags_kind(self, fname, extractor):
+        # ctags picks a parser by file extension, so the same content can give other tags
+        return ("tags", extractor.name, os.path.splitext(fname)[1])
+
+    def get_content_key(self, fname):
+        content_key = self.file_cache.get_content_key(fname)
+        if content_key is None:
+            self.io.tool_error(f"File not found error: {fname}")
+        return content_key
+
+    def get_tags(self, fname):
+        extractor = self.get_tag_extractor(fname)
+        if not extractor:
+            return []
+
+        content_key = self.get_content_key(fname)
+        if content_key is None:
+            return []
+
+        kind = self.get_tags_kind(fname, extractor)
+        data = self.file_cache.get(kind, content_key)
+        if data is not None:
+            return data
+
+        data = extractor.get_tags(self, [fname]).get(fname)
+        if data is None:
+            return []
+
+        self.file_cache.set(kind, content_key, data)
+        return data
+
+    def update_tags_cache(self, filenames):
+        """
+        Bring the cached tags up to date for all the filenames, handing each
+        extractor one batch of the files it hasn't seen the content of.
+        Returns a dict mapping the filenames to their tags.
+        """
+        res = dict()
+        stale = defaultdict(list)
+        for fname in filenames:
+            extractor = self.get_tag_extractor(fname)
+            if not extractor:
+                continue
+
+            content_key = self.file_cache.get_content_key(fname)
+            if content_key is None:
+                # get_tags() will report it
+                continue
+
+            data = self.file_cache.get(self.get_tags_kind(fname, extractor), content_key)
+            if data is not None:
+                res[fname] = data
+                continue
+
+            stale[extractor].append((fname, content_key))
+
+        for extractor, batch in stale.items():
+            data = extractor.get_tags(self, [fname for fname, _ in batch])
+
+            with self.file_cache.transact():
+                for fname, content_key in batch:
+                    # anything missing is left to get_tags() to retry
+                    if fname not in data:
+                        continue
+                    kind = self.get_tags_kind(fname, extractor)
+                    self.file_cache.set(kind, content_key, data[fname])
+                    res[fname] = data[fname]
+
+        return res
+
+    # below this many files, starting and feeding the workers costs more than they save
+    min_worker_batch = 256
+
+    def map_in_workers(self, func, filenames):
+        """
+        Returns [func(fname, encoding) for fname in filenames], spread across a
+        pool of map_workers processes when there is enough work.
+        """
+        encoding = self.io.encoding
+
+        if self.map_workers <= 1 or len(filenames) < self.min_worker_batch:
+            return list(map(func, filenames, repeat(encoding)))
+
+        chunksize = max(1, len(filenames) // (self.map_workers * 4))
+        try:
+            executor = self.get_executor()
+            return list(executor.map(func, filenames, repeat(encoding), chunksize=chunksize))
+        except BrokenProcessPool:
+            # a worker died, so do these here and start a new pool next time
+            self.close_workers()
+            return list(map(func, filenames, repeat(encoding)))
+
+    def get_executor(self):
+        with self.executor_lock:
+            if not self.executor:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.map_workers, mp_context=get_mp_context()
+                )
+            return self.executor
+
+    def close_workers(self):
+        with self.executor_lock:
+            executor = self.executor
+            self.executor = None
+        if executor:
+            executor.shutdown(wait=False)
+
     def check_for_ctags(self):
         try:
             executable = self.ctags_cmd[0]
@@ -231,17 +838,12 @@ class RepoMap:
 
         return True
 
-    def load_tags_cache(self):
-        self.TAGS_CACHE = Cache(Path(self.root) / self.TAGS_CACHE_DIR)
-
-    def save_tags_cache(self):
-        pass
-
-    def load_ident_cache(self):
-        self.IDENT_CACHE = Cache(Path(self.root) / self.IDENT_CACHE_DIR)
-
-    def save_ident_cache(self):
-        pass
+    def load_file_cache(self):
+        self.file_cache = FileCache(
+            Path(self.root) / self.FILE_CACHE_DIR,
+            self.root,
+            self.file_cache_size_limit,
+        )
 
     def get_mtime(self, fname):
         try:
@@ -249,18 +851,20 @@ class RepoMap:
         except FileNotFoundError:
             self.io.tool_error(f"File not found error: {fname}")
 
+    def get_idents_kind(self, fname):
+        # the lexer is picked by file extension
+        return ("idents", os.path.splitext(fname)[1])
+
     def get_name_identifiers(self, fname, uniq=True):
-        file_mtime = self.get_mtime(fname)
-        if file_mtime is None:
+        content_key = self.get_content_key(fname)
+        if content_key is None:
             return set()
 
-        cache_key = fname
-        if cache_key in self.IDENT_CACHE and self.IDENT_CACHE[cache_key]["mtime"] == file_mtime:
-            idents = self.IDENT_CACHE[cache_key]["data"]
-        else:
+        kind = self.get_idents_kind(fname)
+        idents = self.file_cache.get(kind, content_key)
+        if idents is None:
             idents = self.get_name_identifiers_uncached(fname)
-            self.IDENT_CACHE[cache_key] = {"mtime": file_mtime, "data": idents}
-            self.save_ident_cache()
+            self.file_cache.set(kind, content_key, idents)
 
         if uniq:
             idents = set(idents)
@@ -271,103 +875,204 @@ class RepoMap:
         if content is None:
             return list()
 
-        try:
-            lexer = guess_lexer_for_filename(fname, content)
-        except ClassNotFound:
-            return list()
+        return get_name_identifiers_from_content(fname, content)
+
+    def update_ident_cache(self, filenames):
+        """
+        Bring the cached identifiers up to date for all the filenames, lexing
+        the unseen ones across a pool of map_workers processes. Returns a dict
+        mapping the filenames to their lists of identifiers.
+        """
+        res = dict()
+        stale = []
+        for fname in filenames:
+            content_key = self.file_cache.get_content_key(fname)
+            if content_key is None:
+                # get_name_identifiers() will report it
+                continue
+
+            idents = self.file_cache.get(self.get_idents_kind(fname), content_key)
+            if idents is not None:
+                res[fname] = idents
+                continue
+
+            stale.append((fname, content_key))
+
+        if not stale:
+            return res
+
+        stale_fnames = [fname for fname, _ in stale]
+        results = self.map_in_workers(get_name_identifiers_from_file, stale_fnames)
+
+        with self.file_cache.transact():
+            for (fname, content_key), idents in zip(stale, results):
+                self.file_cache.set(self.get_idents_kind(fname), content_key, idents)
+                res[fname] = idents
 
-        # lexer.get_tokens_unprocessed() returns (char position in file, token type, token string)
-        tokens = list(lexer.get_tokens_unprocessed(content))
-        res = [token[2] for token in tokens if token[1] in Token.Name]
         return res
 
-    def get_ranked_tags(self, chat_fnames, other_fnames):
-        defines = defaultdict(set)
-        references = defaultdict(list)
-        definitions = defaultdict(set)
+    def load_line_tokens(self, fname, definitions):
+        """
+        Fill in line_tokens for the map lines of fname's definitions, which
+        are cached by content. The file name lines depend on the path, so
+        those are counted as needed.
+        """
+        content_key = self.file_cache.get_content_key(fname)
+        if content_key is None:
+            return
 
-        personalization = dict()
+        kind = ("lines", self.tokenizer.name)
+        line_tokens = self.file_cache.get(kind, content_key)
+        if line_tokens is None:
+            line_tokens = dict()
+            for _ident, definition in definitions:
+                for depth in range(2, len(definition) + 1):
+                    line = "\t" * (depth - 1) + definition[depth - 1] + "\n"
+                    line_tokens[line] = self.line_token_count(line)
+            self.file_cache.set(kind, content_key, line_tokens)
+
+        self.line_tokens.update(line_tokens)
+
+    def update_graph(self, fnames):
+        """
+        Bring the reference graph up to date with fnames, re-reading only the
+        files which were added or modified since the last call. Returns True
+        if the graph changed.
+        """
+        changed = False
+
+        if self.change_tracker:
+            self.collect_changes()
+        changed_fnames = self.changed_fnames
+
+        fnames = set(fnames)
+        for fname in list(self.graph_mtimes):
+            if fname not in fnames:
+                self.graph.remove_file(self.get_rel_fname(fname))
+                del self.graph_mtimes[fname]
+                changed = True
+
+        stale = []
+        with self.stats.timer("stat"):
+            for fname in sorted(fnames):
+                if (
+                    changed_fnames is not None
+                    and fname in self.graph_mtimes
+                    and fname not in changed_fnames
+                ):
+                    continue
+                file_mtime = self.get_mtime(fname)
+                if fname in self.graph_mtimes and self.graph_mtimes[fname] == file_mtime:
+                    continue
+                stale.append((fname, file_mtime))
+
+        if self.change_tracker:
+            self.changed_fnames = set()
+
+        self.stats.counts["files"] = len(fnames)
+        self.stats.counts["files read"] += len(stale)
+        if not stale:
+            return changed
+
+        stale_fnames = [fname for fname, file_mtime in stale if file_mtime is not None]
+        with self.stats.timer("tags"):
+            all_tags = self.update_tags_cache(stale_fnames)
+        with self.stats.timer("idents"):
+            all_idents = self.update_ident_cache(stale_fnames)
+
+        for fname, file_mtime in stale:
+            with self.stats.timer("graph"):
+                self.add_to_graph(fname, file_mtime, all_tags, all_idents)
 
-        fnames = set(chat_fnames).union(set(other_fnames))
-        chat_rel_fnames = set()
+        return True
+
+    def add_to_graph(self, fname, file_mtime, all_tags, all_idents):
+        rel_fname = self.get_rel_fname(fname)
+        self.graph_mtimes[fname] = file_mtime
+
+        if file_mtime is None:
+            self.graph.remove_file(rel_fname)
+            return
 
-        for fname in sorted(fnames):
-            # dump(fname)
-            rel_fname = os.path.relpath(fname, self.root)
+        tags = all_tags.get(fname)
+        if tags is None:
+            with self.stats.timer("tags"):
+                tags = self.get_tags(fname)
 
-            if fname in chat_fnames:
-                personalization[rel_fname] = 1.0
-                chat_rel_fnames.add(rel_fname)
+        definitions = []
+        for tag in tags:
+            ident = tag["name"]
 
-            data = self.run_ctags(fname)
+            scope = tag.get("scope")
+            kind = tag.get("kind")
+            name = tag.get("name")
+            signature = tag.get("signature")
 
-            for tag in data:
-                ident = tag["name"]
-                defines[ident].add(rel_fname)
+            last = name
+            if signature:
+                last += " " + signature
 
-                scope = tag.get("scope")
-                kind = tag.get("kind")
-                name = tag.get("name")
-                signature = tag.get("signature")
+            # the same few kinds and scopes repeat across many tags
+            res = [rel_fname]
+            if scope:
+                res.append(sys.intern(scope))
+            res += [sys.intern(kind), last]
 
-                last = name
-                if signature:
-                    last += " " + signature
+            definitions.append((ident, tuple(res)))
 
-                res = [rel_fname]
-                if scope:
-                    res.append(scope)
-                res += [kind, last]
+        idents = all_idents.get(fname)
+        if idents is None:
+            with self.stats.timer("idents"):
+                idents = self.get_name_identifiers(fname, uniq=False)
 
-                key = (rel_fname, ident)
-                definitions[key].add(tuple(res))
-                # definitions[key].add((rel_fname,))
+        self.graph.add_file(rel_fname, definitions, idents)
+        with self.stats.timer("tokenize"):
+            self.load_line_tokens(fname, definitions)
 
-            idents = self.get_name_identifiers(fname, uniq=False)
-            for ident in idents:
-                # dump("ref", fname, ident)
-                references[ident].append(rel_fname)
+    def get_ranked_tags(self, chat_fnames, other_fnames):
+        fnames = set(chat_fnames).union(set(other_fnames))
+        changed = self.update_graph(fnames)
 
-        idents = set(defines.keys()).intersection(set(references.keys()))
+        # nothing changed since the last turn, so neither has the ranking
+        key = (sorted(chat_fnames), sorted(other_fnames))
+        if not changed and self.last_ranked_tags and self.last_ranked_tags[0] == key:
+            return list(self.last_ranked_tags[1])
 
-        G = nx.MultiDiGraph()
+        with self.stats.timer("rank"):
+            ranked_tags = self.rank_tags(chat_fnames, other_fnames, len(fnames))
 
-        for ident in idents:
-            definers = defines[ident]
-            for referencer, num_refs in Counter(references[ident]).items():
-                for definer in definers:
-                    if referencer == definer:
-                        continue
-                    G.add_edge(referencer, definer, weight=num_refs, ident=ident)
+        self.last_ranked_tags = (key, ranked_tags)
+        return list(ranked_tags)
 
-        if personalization:
-            pers_args = dict(personalization=personalization, dangling=personalization)
-        else:
-            pers_args = dict()
+    def rank_tags(self, chat_fnames, other_fnames, num_fnames):
+        personalization = dict()
+        chat_rel_fnames = set()
+        for fname in chat_fnames:
+            rel_fname = self.get_rel_fname(fname)
+            personalization[rel_fname] = 1.0
+            chat_rel_fnames.add(rel_fname)
+
+        # pagerank only flows from the chat files along references, so the
+        # files far from them barely matter
+        neighborhood = None
+        if chat_rel_fnames and num_fnames > self.neighborhood_threshold:
+            neighborhood = self.graph.neighborhood(
+                chat_rel_fnames, self.neighborhood_hops, self.neighborhood_max_files
+            )
 
         try:
-            ranked = nx.pagerank(G, weight="weight", **pers_args)
+            ranked, ranked_definitions = self.graph.rank(
+                personalization, self.rank_engine, neighborhood
+            )
         except ZeroDivisionError:
             return []
 
-        # distribute the rank from each source node, across all of its out edges
-        ranked_definitions = defaultdict(float)
-        for src in G.nodes:
-            src_rank = ranked[src]
-            total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
-            # dump(src, src_rank, total_weight)
-            for _src, dst, data in G.out_edges(src, data=True):
-                data["rank"] = src_rank * data["weight"] / total_weight
-                ident = data["ident"]
-                ranked_definitions[(dst, ident)] += data["rank"]
-
         ranked_tags = []
-        ranked_definitions = sorted(ranked_definitions.items(), reverse=True, key=lambda x: x[1])
         for (fname, ident), rank in ranked_definitions:
             # print(f"{rank:.03f} {fname} {ident}")
             if fname in chat_rel_fnames:
                 continue
-            ranked_tags += list(definitions.get((fname, ident), []))
+            ranked_tags += self.graph.get_definitions(fname, ident)
 
         rel_other_fnames_without_tags = set(
             os.path.relpath(fname, self.root) for fname in other_fnames
@@ -382,9 +1087,11 @@ class RepoMap:
             if fname not in fnames_already_included:
                 ranked_tags.append((fname,))
 
-        for fname in rel_other_fnames_without_tags:
+        for fname in sorted(rel_other_fnames_without_tags):
             ranked_tags.append((fname,))
 
+        self.stats.counts["ranked files"] = len(ranked)
+        self.stats.counts["ranked definitions"] = len(ranked_definitions)
         return ranked_tags
 
     def get_ranked_tags_map(self, chat_fnames, other_fnames=None):
@@ -392,10 +1099,51 @@ class RepoMap:
             other_fnames = list()
 
         ranked_tags = self.get_ranked_tags(chat_fnames, other_fnames)
-        num_tags = len(ranked_tags)
 
+        with self.stats.timer("fit"):
+            # one pass over the per-line token counts finds the cutoff,
+            # and a single exact count confirms it
+            num_tags = self.estimate_num_tags(ranked_tags)
+            tree = to_tree(ranked_tags[:num_tags])
+            if self.token_count(tree) < self.max_map_tokens:
+                self.stats.counts["map tags"] = num_tags
+                return tree
+
+            return self.search_num_tags(ranked_tags, num_tags - 1)
+
+    def estimate_num_tags(self, ranked_tags):
+        """
+        How many of the top ranked_tags fit in max_map_tokens, summing the
+        token counts of the lines each tag adds to the to_tree() output.
+        """
+        seen = set()
+        num_tokens = 0
+        for i, tag in enumerate(ranked_tags):
+            # to_tree() prints one line per distinct prefix of the sorted tags
+            for depth in range(1, len(tag) + 1):
+                prefix = tag[:depth]
+                if prefix in seen:
+                    continue
+                seen.add(prefix)
+
+                line = "\t" * (depth - 1) + tag[depth - 1] + "\n"
+                num_tokens += self.line_token_count(line)
+
+            if num_tokens >= self.max_map_tokens:
+                return i
+
+        return len(ranked_tags)
+
+    def line_token_count(self, line):
+        num_tokens = self.line_tokens.get(line)
+        if num_tokens is None:
+            num_tokens = self.token_count(line)
+            self.line_tokens[line] = num_tokens
+        return num_tokens
+
+    def search_num_tags(self, ranked_tags, upper_bound):
+        "Binary search for the largest tree under max_map_tokens, with exact counts"
         lower_bound = 0
-        upper_bound = num_tags
         best_tree = None
 
         while lower_bound <= upper_bound:
@@ -406,6 +1154,7 @@ class RepoMap:
 
             if num_tokens < self.max_map_tokens:
                 best_tree = tree
+                self.stats.counts["map tags"] = middle
                 lower_bound = middle + 1
             else:
                 upper_bound = middle - 1
@@ -0,0 +1,211 @@
+import ast
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from .dump import dump  # noqa: F401
+
+
+class TagExtractor:
+    """
+    A RepoMap tag backend. It turns source files into ctags style records,
+    dicts with name, kind and optional scope and signature entries.
+    """
+
+    name = None
+
+    def accepts(self, fname):
+        return True
+
+    def get_tags(self, repo_map, fnames):
+        "Returns a dict mapping each of the fnames to its list of tags"
+        raise NotImplementedError
+
+
+class CtagsExtractor(TagExtractor):
+    "Runs universal-ctags over batches of files"
+
+    name = "ctags"
+
+    def get_tags(self, repo_map, fnames):
+        # ctags reads the file list one name per line
+        fnames = [fname for fname in fnames if "\n" not in fname]
+        if not fnames:
+            return dict()
+
+        # split the work so that every worker gets a ctags process
+        batch_size = -(-len(fnames) // repo_map.map_workers)
+        batch_size = max(1, min(batch_size, repo_map.ctags_batch_size))
+        batches = [fnames[i : i + batch_size] for i in range(0, len(fnames), batch_size)]
+
+        def run_batch(batch):
+            try:
+                return batch, repo_map.run_ctags_batch(batch)
+            except subprocess.CalledProcessError as err:
+                return batch, err
+
+        if repo_map.map_workers > 1 and len(batches) > 1:
+            # the work happens in the ctags subprocesses, so threads are enough
+            with ThreadPoolExecutor(max_workers=repo_map.map_workers) as executor:
+                results = list(executor.map(run_batch, batches))
+        else:
+            results = map(run_batch, batches)
+
+        res = dict()
+        for batch, data in results:
+            if isinstance(data, Exception):
+                repo_map.io.tool_error(f"Error running ctags on {len(batch)} files: {data}")
+                continue
+            res.update(data)
+
+        return res
+
+
+class PythonAstExtractor(TagExtractor):
+    "Parses python files in-process with the stdlib ast module"
+
+    name = "python-ast"
+    extensions = (".py", ".pyi")
+
+    def accepts(self, fname):
+        return fname.endswith(self.extensions)
+
+    def get_tags(self, repo_map, fnames):
+        results = repo_map.map_in_workers(get_python_tags, fnames)
+        return dict(zip(fnames, results))
+
+
+def get_python_tags(fname, encoding):
+    "Module level, so that it can be run in a worker process"
+    try:
+        with open(fname, "r", encoding=encoding) as f:
+            content = f.read()
+    except (FileNotFoundError, UnicodeError):
+        return list()
+
+    return get_python_tags_from_content(fname, content)
+
+
+def get_python_tags_from_content(fname, content):
+    try:
+        tree = ast.parse(content, filename=fname)
+    except (SyntaxError, ValueError):
+        return list()
+
+    lines = split_source_lines(content)
+    tags = []
+
+    def add_tag(node, name, kind, scope, scope_kind, signature=None):
+        tag = dict(_type="tag", name=name, path=fname, line=node.lineno, kind=kind)
+        if scope:
+            tag["scope"] = ".".join(scope)
+            tag["scopeKind"] = scope_kind
+        if signature is not None:
+            tag["signature"] = signature
+        tags.append(tag)
+
+    def walk(body, scope, scope_kind):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                add_tag(node, node.name, "class", scope, scope_kind)
+                walk(node.body, scope + [node.name], "class")
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                kind = "member" if scope_kind == "class" else "function"
+                signature = format_arguments(node.args, lines)
+                add_tag(node, node.name, kind, scope, scope_kind, signature)
+                walk(node.body, scope + [node.name], "function")
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                # like ctags, skip the local variables of functions
+                if scope_kind == "function":
+                    continue
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    for name in get_assigned_names(target):
+                        add_tag(node, name, "variable", scope, scope_kind)
+            else:
+                # if/try/with/for blocks at module or class level
+                for field in ("body", "orelse", "finalbody"):
+                    walk(getattr(node, field, None) or [], scope, scope_kind)
+                for handler in getattr(node, "handlers", None) or []:
+                    walk(handler.body, scope, scope_kind)
+
+    walk(tree.body, [], None)
+    return tags
+
+
+def get_assigned_names(target):
+    if isinstance(target, ast.Name):
+        return [target.id]
+    if isinstance(target, (ast.Tuple, ast.List)):
+        names = []
+        for elt in target.elts:
+            names += get_assigned_names(elt)
+        return names
+    if isinstance(target, ast.Starred):
+        return get_assigned_names(target.value)
+    return []
+
+
+def split_source_lines(content):
+    "Split lines like the ast module does, keeping the line endings"
+    lines = []
+    start = 0
+    for match in re.finditer(r"\r\n|\r|\n", content):
+        lines.append(content[start : match.end()])
+        start = match.end()
+    lines.append(content[start:])
+    return lines
+
+
+def get_source_segment(lines, node):
+    """
+    Like ast.get_source_segment(), but working from lines which are split
+    once per file rather than on every call.
+    """
+    if getattr(node, "end_lineno", None) is None or getattr(node, "end_col_offset", None) is None:
+        return
+
+    lineno = node.lineno - 1
+    end_lineno = node.end_lineno - 1
+
+    # the column offsets count utf-8 bytes
+    if lineno == end_lineno:
+        return lines[lineno].encode()[node.col_offset : node.end_col_offset].decode()
+
+    first = lines[lineno].encode()[node.col_offset :].decode()
+    last = lines[end_lineno].encode()[: node.end_col_offset].decode()
+    return "".join([first] + lines[lineno + 1 : end_lineno] + [last])
+
+
+def format_arguments(args, lines):
+    "Rebuild a ctags style signature, since ast.unparse() isn't in python 3.8"
+
+    def fmt(arg, default=None):
+        res = arg.arg
+        if arg.annotation is not None:
+            res += ": " + (get_source_segment(lines, arg.annotation) or "...")
+        if default is not None:
+            res += "=" + (get_source_segment(lines, default) or "...")
+        return res
+
+    positional = list(getattr(args, "posonlyargs", [])) + list(args.args)
+    defaults = [None] * (len(positional) - len(args.defaults)) + list(args.defaults)
+
+    parts = []
+    for i, (arg, default) in enumerate(zip(positional, defaults)):
+        parts.append(fmt(arg, default))
+        if args.posonlyargs and i == len(args.posonlyargs) - 1:
+            parts.append("/")
+
+    if args.vararg:
+        parts.append("*" + fmt(args.vararg))
+    elif args.kwonlyargs:
+        parts.append("*")
+
+    for arg, default in zip(args.kwonlyargs, args.kw_defaults):
+        parts.append(fmt(arg, default))
+
+    if args.kwarg:
+        parts.append("**" + fmt(args.kwarg))
+
+    return "(" + ", ".join(parts) + ")"
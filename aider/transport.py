@@ -0,0 +1,140 @@
+import asyncio
+import atexit
+import concurrent.futures
+import ssl
+import threading
+
+import aiohttp
+import certifi
+import openai
+
+from .dump import dump  # noqa: F401
+
+
+class AsyncTransport:
+    """
+    Sends the openai requests from an asyncio loop in a background thread,
+    through one pooled aiohttp session, so the connections to the api are
+    kept alive and reused instead of paying for a new TLS handshake each call.
+
+    The calls block the thread which makes them, but any number of threads
+    can make them at once and their requests are in flight concurrently.
+    submit() runs a coroutine without waiting for it.
+    """
+
+    def __init__(self, limit=10, keepalive_timeout=60):
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+
+        self.loop = None
+        self.thread = None
+        self.session = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.loop:
+                return
+
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, daemon=True)
+            thread.start()
+
+            # aiohttp sessions belong to the loop they're made in
+            future = asyncio.run_coroutine_threadsafe(self.make_session(), loop)
+            self.session = future.result()
+            self.loop = loop
+            self.thread = thread
+
+    async def make_session(self):
+        # the same CA bundle and proxy env vars (HTTPS_PROXY, NO_PROXY...) requests used
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+        connector = aiohttp.TCPConnector(
+            limit=self.limit, keepalive_timeout=self.keepalive_timeout, ssl=ssl_context
+        )
+        return aiohttp.ClientSession(connector=connector, trust_env=True)
+
+    def submit(self, coro):
+        "Run coro on the loop with the pooled session, and return a concurrent.futures.Future"
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.with_session(coro), self.loop)
+
+    async def with_session(self, coro):
+        # openai's async calls use the session in this context var, instead of making their own
+        openai.aiosession.set(self.session)
+        return await coro
+
+    def run(self, coro):
+        "Run coro on the loop and wait for its result"
+        future = self.submit(coro)
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            # let the cancelled call unwind on the loop before anything else touches its state
+            future.cancel()
+            concurrent.futures.wait([future], timeout=5)
+            raise
+
+    def chat_completion(self, **kwargs):
+        "Like openai.ChatCompletion.create(), and a plain iterator of the chunks if stream=True"
+        res = self.run(openai.ChatCompletion.acreate(**kwargs))
+        if kwargs.get("stream"):
+            return self.iter_chunks(res)
+        return res
+
+    def list_models(self):
+        "Like openai.Model.list()"
+        return self.run(openai.Model.alist())
+
+    def iter_chunks(self, chunks):
+        done = False
+        try:
+            while True:
+                done, chunk = self.run(get_next(chunks))
+                if done:
+                    return
+                yield chunk
+        finally:
+            if not done:
+                # the stream was abandoned, release its connection. run() has waited for
+                # any interrupted read, so the stream isn't still running on the loop.
+                self.submit(chunks.aclose())
+
+    def close(self):
+        with self.lock:
+            loop = self.loop
+            self.loop = None
+        if not loop:
+            return
+
+        future = asyncio.run_coroutine_threadsafe(self.session.close(), loop)
+        try:
+            future.result(timeout=5)
+        except (aiohttp.ClientError, asyncio.TimeoutError, TimeoutError):
+            pass
+
+        loop.call_soon_threadsafe(loop.stop)
+        self.thread.join(timeout=5)
+        if not loop.is_running():
+            loop.close()
+
+
+async def get_next(chunks):
+    "(True, None) at the end of the async iterator chunks, or else (False, the next chunk)"
+    try:
+        return False, await chunks.__anext__()
+    except StopAsyncIteration:
+        return True, None
+
+
+transport = None
+
+
+def get_transport():
+    "The transport shared by everything in the process, so they share its connections"
+    global transport
+
+    if not transport:
+        transport = AsyncTransport()
+        atexit.register(transport.close)
+    return transport
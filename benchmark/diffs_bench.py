@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+Time the live diffs of a partially streamed file on synthetic files of increasing size.
+
+Each file is generated deterministically from its size, as python modules
+with the repeated blank lines, decorators and return statements of real
+code. A few edits are made to it, and then the diff is timed with the
+update cut off at several points, the way it's shown while streaming:
+
+  last  diffs.find_last_non_deleted(), how far into the original it got
+  diff  diffs.diff_partial_update(), the whole live diff
+
+The same runs are timed with the difflib based versions which diffs.py
+used before its own line diff, which also checks that both find the same
+place in the original file.
+
+The results are written as json, with the timings rounded and everything else
+stable across runs, so the files from two commits can be diffed or compared:
+
+  python benchmark/diffs_bench.py --output before.json
+  python benchmark/diffs_bench.py --output after.json --compare before.json
+"""
+
+import argparse
+import difflib
+import json
+import platform
+import random
+import subprocess
+import time
+from pathlib import Path
+
+from aider import diffs
+from aider.dump import dump  # noqa: F401
+
+NUM_EDITS = 5
+
+# the share of the updated file which has been streamed, for each run
+CUTOFFS = (0.25, 0.5, 0.9, 1.0)
+
+
+def make_file(num_lines):
+    "A python file of num_lines lines"
+    rng = random.Random(num_lines)
+
+    lines = []
+    num = 0
+    while len(lines) < num_lines:
+        lines += ["\n", "\n", f"class Widget{num}:\n"]
+        for method in range(rng.randint(2, 6)):
+            if rng.random() < 0.3:
+                lines += ["    @property\n"]
+            lines += [f"    def method_{method}(self, value=None):\n"]
+            for stmt in range(rng.randint(1, 8)):
+                lines += [f"        value = self.update_{rng.randrange(50)}(value, {stmt})\n"]
+            lines += ["        return value\n", "\n"]
+        num += 1
+
+    return lines[:num_lines]
+
+
+def make_edits(lines_orig):
+    "A copy of lines_orig with some lines replaced, inserted and deleted"
+    rng = random.Random(len(lines_orig))
+
+    lines = list(lines_orig)
+    for num in range(NUM_EDITS):
+        pos = rng.randrange(len(lines))
+        size = rng.randint(1, 10)
+        new_lines = [f"        edited_{num}_{i}()\n" for i in range(rng.randint(0, 10))]
+        lines[pos : pos + size] = new_lines
+
+    return lines
+
+
+def old_find_last_non_deleted(lines_orig, lines_updated):
+    num_orig = 0
+    last_non_deleted_orig = None
+
+    for line in difflib.ndiff(lines_orig, lines_updated):
+        code = line[0]
+        if code in " -":
+            num_orig += 1
+        if code == " ":
+            last_non_deleted_orig = num_orig
+
+    return last_non_deleted_orig
+
+
+def old_diff_partial_update(lines_orig, lines_updated, final=False, fname=None):
+    num_orig_lines = len(lines_orig)
+
+    if final:
+        last_non_deleted = num_orig_lines
+    else:
+        last_non_deleted = old_find_last_non_deleted(lines_orig, lines_updated)
+
+    if last_non_deleted is None:
+        return ""
+
+    bar = diffs.progress_bar_line(last_non_deleted, num_orig_lines)
+
+    lines_orig = lines_orig[:last_non_deleted]
+
+    if not final:
+        lines_updated = lines_updated[:-1] + [bar]
+
+    diff = difflib.unified_diff(lines_orig, lines_updated, n=5)
+    diff = "".join(list(diff)[2:])
+
+    return diffs.fence_diff(diff, fname)
+
+
+def time_func(func, args, repeat):
+    "The fastest of repeat calls, in ms, and the result"
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = func(*args)
+        secs = time.perf_counter() - start
+        if best is None or secs < best:
+            best = secs
+
+    return round(best * 1000, 2), res
+
+
+def benchmark_file(num_lines, repeat):
+    lines_orig = make_file(num_lines)
+    lines_updated = make_edits(lines_orig)
+
+    runs = []
+    for cutoff in CUTOFFS:
+        partial = lines_updated[: int(len(lines_updated) * cutoff)]
+        final = cutoff == 1.0
+
+        last_ms, last = time_func(diffs.find_last_non_deleted, (lines_orig, partial), repeat)
+        old_last_ms, old_last = time_func(old_find_last_non_deleted, (lines_orig, partial), repeat)
+
+        args = (lines_orig, partial, final)
+        diff_ms, diff = time_func(diffs.diff_partial_update, args, repeat)
+        old_diff_ms, old_diff = time_func(old_diff_partial_update, args, repeat)
+
+        runs.append(
+            dict(
+                cutoff=cutoff,
+                lines=len(partial),
+                last=dict(ms=last_ms, old_ms=old_last_ms, value=last, old_value=old_last),
+                diff=dict(ms=diff_ms, old_ms=old_diff_ms, same=diff == old_diff),
+            )
+        )
+
+    return dict(lines=num_lines, runs=runs)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return
+
+
+def compare(results, old_results):
+    "Print how the timings changed from old_results"
+    old_files = dict((res["lines"], res) for res in old_results["files"])
+
+    print()
+    print(f"Compared to {old_results.get('commit')}:")
+    for res in results["files"]:
+        old_res = old_files.get(res["lines"])
+        if not old_res:
+            continue
+
+        old_runs = dict((run["cutoff"], run) for run in old_res["runs"])
+        for run in res["runs"]:
+            old_run = old_runs.get(run["cutoff"])
+            if not old_run:
+                continue
+
+            changes = []
+            for key in ("last", "diff"):
+                new, old = run[key]["ms"], old_run[key]["ms"]
+                ratio = new / old if old else float("inf")
+                changes.append(f"{key} {old} -> {new}ms ({ratio:.2f}x)")
+            print(f"  {res['lines']:>6} lines, {run['cutoff']:4.0%}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="1000,5000,20000",
+        help="Comma separated numbers of lines in the files (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        default="diffs_bench.json",
+        help="Write the results to this json file (default: %(default)s)",
+    )
+    parser.add_argument("--compare", metavar="FILE", help="Compare with the results in FILE")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Time each diff this many times and keep the fastest (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    results = dict(
+        commit=get_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        files=[],
+    )
+
+    for num_lines in sizes:
+        res = benchmark_file(num_lines, args.repeat)
+        results["files"].append(res)
+
+        print(f"{num_lines:>6} lines:")
+        for run in res["runs"]:
+            last, diff = run["last"], run["diff"]
+            print(
+                f"  {run['cutoff']:4.0%}: last {last['ms']}ms (difflib {last['old_ms']}ms),"
+                f" diff {diff['ms']}ms (difflib {diff['old_ms']}ms),"
+                f" at line {last['value']} (difflib {last['old_value']})"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
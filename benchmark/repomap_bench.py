@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+
+"""
+Time RepoMap.get_ranked_tags_map() on synthetic repos of increasing size.
+
+Each repo is generated deterministically from its size, as a mix of python
+and javascript modules grouped into packages. Modules reference symbols from
+their own package and from a few heavily used "hub" modules, like real code.
+
+Every run happens in a fresh process, so the peak memory is its own:
+
+  cold  the file cache is empty, every file is read and parsed
+  warm  the file cache on disk is kept from the cold run
+
+The results are written as json, with the timings rounded and everything else
+stable across runs, so the files from two commits can be diffed or compared:
+
+  python benchmark/repomap_bench.py --output before.json
+  python benchmark/repomap_bench.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aider.dump import dump  # noqa: F401
+from aider.io import InputOutput
+from aider.repomap import RepoMap
+
+# bump this when the generated repos change, so kept repos get regenerated
+GENERATOR_VERSION = 1
+
+FILES_PER_PACKAGE = 50
+REFS_PER_FILE = 6
+
+# the share of references made to modules in the same package
+LOCAL_REFS = 0.6
+
+
+def get_fname(num):
+    ext = ".js" if num % 5 == 4 else ".py"
+    return f"pkg{num // FILES_PER_PACKAGE:04d}/mod{num % FILES_PER_PACKAGE:02d}{ext}"
+
+
+def get_symbols(num):
+    "The class, its methods and the functions defined by module num"
+    return (
+        f"Widget{num}",
+        [f"render_{num % 97}", f"update_{num}"],
+        [f"make_widget_{num}", f"check_{num % 31}"],
+    )
+
+
+def pick_targets(rng, num, num_files):
+    package = num - num % FILES_PER_PACKAGE
+    package_size = min(FILES_PER_PACKAGE, num_files - package)
+
+    targets = set()
+    while len(targets) < min(REFS_PER_FILE, num_files - 1):
+        if rng.random() < LOCAL_REFS:
+            target = package + rng.randrange(package_size)
+        else:
+            # cubing skews the picks towards the low numbered hub modules
+            target = int(num_files * rng.random() ** 3)
+        if target != num:
+            targets.add(target)
+    return sorted(targets)
+
+
+def make_python_module(num, targets):
+    cls, methods, funcs = get_symbols(num)
+
+    lines = []
+    for target in targets:
+        module = get_fname(target)[: -len(".py")].replace("/", ".")
+        lines.append(f"from {module} import {get_symbols(target)[0]}")
+
+    lines += ["", "", f"class {cls}:", "    def __init__(self, parent=None):"]
+    lines.append("        self.parent = parent")
+    lines.append("        self.children = []")
+    for method in methods:
+        lines += ["", f"    def {method}(self, value, *args):"]
+        for target in targets:
+            target_cls, target_methods, target_funcs = get_symbols(target)
+            lines.append(f"        {target_funcs[0]}(value).{target_methods[0]}(*args)")
+        lines.append("        return value")
+
+    for func in funcs:
+        lines += ["", "", f"def {func}(value=None):"]
+        lines.append(f"    widget = {cls}(value)")
+        lines.append(f"    widget.{methods[1]}(value)")
+        lines.append("    return widget")
+
+    return "\n".join(lines) + "\n"
+
+
+def make_js_module(num, targets):
+    cls, methods, funcs = get_symbols(num)
+
+    lines = []
+    for target in targets:
+        lines.append(f'import {{ {get_symbols(target)[0]} }} from "../{get_fname(target)}";')
+
+    lines += ["", f"export class {cls} {{", "  constructor(parent) {"]
+    lines += ["    this.parent = parent;", "    this.children = [];", "  }"]
+    for method in methods:
+        lines += ["", f"  {method}(value, ...args) {{"]
+        for target in targets:
+            target_cls, target_methods, target_funcs = get_symbols(target)
+            lines.append(f"    {target_funcs[0]}(value).{target_methods[0]}(...args);")
+        lines += ["    return value;", "  }"]
+    lines.append("}")
+
+    for func in funcs:
+        lines += ["", f"export function {func}(value) {{"]
+        lines.append(f"  const widget = new {cls}(value);")
+        lines.append(f"  widget.{methods[1]}(value);")
+        lines += ["  return widget;", "}"]
+
+    return "\n".join(lines) + "\n"
+
+
+def make_repo(root, num_files):
+    "Write num_files synthetic modules into root, unless they are already there"
+    root = Path(root)
+    marker = root / ".repomap_bench.json"
+    spec = dict(version=GENERATOR_VERSION, files=num_files)
+
+    if marker.exists() and json.loads(marker.read_text()) == spec:
+        return
+
+    if root.exists():
+        shutil.rmtree(root)
+
+    rng = random.Random(num_files)
+    for num in range(num_files):
+        fname = root / get_fname(num)
+        if num % FILES_PER_PACKAGE == 0:
+            fname.parent.mkdir(parents=True)
+            if fname.suffix == ".py":
+                (fname.parent / "__init__.py").write_text("")
+
+        targets = pick_targets(rng, num, num_files)
+        if fname.suffix == ".py":
+            fname.write_text(make_python_module(num, targets))
+        else:
+            fname.write_text(make_js_module(num, targets))
+
+    marker.write_text(json.dumps(spec))
+
+
+def get_repo_fnames(root, num_files):
+    fnames = [str(Path(root) / get_fname(num)) for num in range(num_files)]
+
+    # a hub module and an ordinary one, like a typical chat
+    chat_fnames = [fnames[0], fnames[num_files // 2]]
+    other_fnames = [fname for fname in fnames if fname not in chat_fnames]
+    return chat_fnames, other_fnames
+
+
+def get_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def run_map(root, num_files, map_tokens, map_workers):
+    "Build one map in this process, and return what it took"
+    chat_fnames, other_fnames = get_repo_fnames(root, num_files)
+
+    repo_map = RepoMap(
+        map_tokens=map_tokens,
+        root=root,
+        io=InputOutput(),
+        map_workers=map_workers,
+    )
+    start_rss_mb = get_peak_rss_mb()
+
+    start = time.perf_counter()
+    tree = repo_map.get_ranked_tags_map(chat_fnames, other_fnames)
+    secs = time.perf_counter() - start
+
+    peak_rss_mb = get_peak_rss_mb()
+    cache = repo_map.file_cache.cache
+
+    return dict(
+        secs=round(secs, 3),
+        peak_rss_mb=round(peak_rss_mb, 1),
+        map_rss_mb=round(peak_rss_mb - start_rss_mb, 1),
+        map_lines=tree.count("\n"),
+        map_tokens=repo_map.token_count(tree),
+        stats=repo_map.stats.to_dict(),
+        cache_entries=len(cache),
+        cache_mb=round(cache.volume() / (1024 * 1024), 1),
+    )
+
+
+def run_map_in_process(*args):
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_map, args)
+
+
+def get_dir_mb(dname):
+    size = 0
+    for path, _, fnames in os.walk(dname):
+        for fname in fnames:
+            size += os.path.getsize(os.path.join(path, fname))
+    return round(size / (1024 * 1024), 1)
+
+
+def benchmark_repo(root, num_files, args):
+    start = time.perf_counter()
+    make_repo(root, num_files)
+    generate_secs = time.perf_counter() - start
+
+    cache_dname = Path(root) / RepoMap.FILE_CACHE_DIR
+    shutil.rmtree(cache_dname, ignore_errors=True)
+
+    run_args = (str(root), num_files, args.map_tokens, args.map_workers)
+    cold = run_map_in_process(*run_args)
+
+    # keep the fastest warm run, the slower ones are noise
+    warm = None
+    for _ in range(args.repeat):
+        res = run_map_in_process(*run_args)
+        if warm is None or res["secs"] < warm["secs"]:
+            warm = res
+
+    num_js = sum(1 for num in range(num_files) if get_fname(num).endswith(".js"))
+    return dict(
+        files=num_files,
+        python_files=num_files - num_js,
+        js_files=num_js,
+        generate_secs=round(generate_secs, 3),
+        cache_dir_mb=get_dir_mb(cache_dname),
+        cold=cold,
+        warm=warm,
+    )
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return
+
+
+def compare(results, old_results):
+    "Print how the timings and memory changed from old_results"
+    old_repos = dict((repo["files"], repo) for repo in old_results["repos"])
+
+    print()
+    print(f"Compared to {old_results.get('commit')}:")
+    for repo in results["repos"]:
+        old_repo = old_repos.get(repo["files"])
+        if not old_repo:
+            continue
+
+        for run in ("cold", "warm"):
+            new, old = repo[run], old_repo[run]
+            changes = []
+            for key in ("secs", "peak_rss_mb"):
+                ratio = new[key] / old[key] if old[key] else float("inf")
+                changes.append(f"{key} {old[key]} -> {new[key]} ({ratio:.2f}x)")
+            print(f"  {repo['files']:>6} files, {run}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,50000",
+        help="Comma separated numbers of files in the repos (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        default="repomap_bench.json",
+        help="Write the results to this json file (default: %(default)s)",
+    )
+    parser.add_argument("--compare", metavar="FILE", help="Compare with the results in FILE")
+    parser.add_argument(
+        "--dir",
+        help="Generate the repos here and keep them between runs (default: a temp dir)",
+    )
+    parser.add_argument("--map-tokens", type=int, default=1024, help="(default: %(default)s)")
+    parser.add_argument("--map-workers", type=int, default=1, help="(default: %(default)s)")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Time the warm map this many times and keep the fastest (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    results = dict(
+        commit=get_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        map_tokens=args.map_tokens,
+        map_workers=args.map_workers,
+        repos=[],
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base_dname = Path(args.dir or temp_dir)
+        for num_files in sizes:
+            repo = benchmark_repo(base_dname / f"repo{num_files}", num_files, args)
+            results["repos"].append(repo)
+
+            print(f"{num_files:>6} files:")
+            for run in ("cold", "warm"):
+                res = repo[run]
+                print(
+                    f"  {run}: {res['secs']:.3f}s, peak rss {res['peak_rss_mb']} MB,"
+                    f" {res['map_lines']} map lines"
+                )
+            print(
+                f"  file cache: {repo['cold']['cache_entries']} entries, {repo['cache_dir_mb']} MB"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import random
+import sys
+import time
+
+from aider.dump import dump  # noqa: F401
+from aider.repomap import iter_tree_lines, to_tree
+
+
+def to_tree_concat(tags):
+    "The previous to_tree(), which built the output with repeated string concatenation"
+    if not tags:
+        return ""
+
+    tags = sorted(tags)
+
+    output = ""
+    last = [None] * len(tags[0])
+    tab = "\t"
+    for tag in tags:
+        tag = list(tag)
+
+        for i in range(len(last) + 1):
+            if i == len(last):
+                break
+            if last[i] != tag[i]:
+                break
+
+        num_common = i
+
+        indent = tab * num_common
+        rest = tag[num_common:]
+        for item in rest:
+            output += indent + item + "\n"
+            indent += tab
+        last = tag
+
+    return output
+
+
+def make_tags(num_tags):
+    random.seed(0)
+
+    tags = []
+    for i in range(num_tags):
+        fname = f"pkg{i % 97}/module{i % 1013}.py"
+        if i % 10 == 0:
+            tags.append((fname,))
+            continue
+
+        scope = f"Class{i % 31}"
+        tags.append((fname, scope, "member", f"method_{i} (self, arg{i % 7}, **kwargs)"))
+
+    random.shuffle(tags)
+    return tags
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def main():
+    num_tags = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    tags = make_tags(num_tags)
+
+    old, old_secs = timeit(to_tree_concat, tags)
+    new, new_secs = timeit(to_tree, tags)
+    assert old == new
+
+    print(f"{num_tags} tags, {len(new)} chars")
+    print(f"to_tree concat:    {old_secs:.3f}s")
+    print(f"to_tree streaming: {new_secs:.3f}s")
+
+    # extending an already sorted prefix only renders the new tags
+    sorted_tags = sorted(tags)
+    lines = iter_tree_lines(sorted_tags)
+    step = max(1, num_tags // 10)
+
+    start = time.perf_counter()
+    output = []
+    for _ in range(0, num_tags, step):
+        output.extend(line for _, line in zip(range(step), lines))
+    output.extend(lines)
+    incremental_secs = time.perf_counter() - start
+
+    assert "".join(output) == new
+    print(f"incremental, in steps of {step} lines: {incremental_secs:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from aider.changes import InotifyChangeTracker, PollingChangeTracker, get_change_tracker
+from tests.utils import IgnorantTemporaryDirectory
+
+
+class ChangeTrackerTests:
+    tracker_class = None
+
+    def test_get_changes(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            fname = root / "file.py"
+            fname.write_text("one\n")
+            (root / "sub").mkdir()
+            other = root / "sub" / "other.py"
+            other.write_text("two\n")
+
+            tracker = self.tracker_class(temp_dir)
+            token = tracker.subscribe()
+            tracker.set_files([str(fname), str(other)])
+            tracker.poll()
+
+            # nothing is known about the time before the first call
+            self.assertIsNone(tracker.get_changes(token))
+            self.assertEqual(tracker.get_changes(token), set())
+
+            fname.write_text("one changed\n")
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(fname)})
+            self.assertEqual(tracker.get_changes(token), set())
+
+            other.unlink()
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(other)})
+
+            other.write_text("two again\n")
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(other)})
+
+            tracker.close()
+
+    def test_changes_wait_for_poll(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = Path(temp_dir) / "file.py"
+            fname.write_text("one\n")
+
+            tracker = self.tracker_class(temp_dir)
+            token = tracker.subscribe()
+            tracker.set_files([str(fname)])
+            tracker.get_changes(token)
+
+            fname.write_text("one changed\n")
+            self.assertEqual(tracker.get_changes(token), set())
+
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(fname)})
+
+            tracker.close()
+
+    def test_set_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            first = root / "first.py"
+            second = root / "second.py"
+            first.write_text("one\n")
+            second.write_text("two\n")
+
+            tracker = self.tracker_class(temp_dir)
+            token = tracker.subscribe()
+            tracker.set_files([str(first)])
+            tracker.get_changes(token)
+
+            # only the files it was given are reported
+            second.write_text("two changed\n")
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), set())
+
+            # the ones added and dropped may not match what the subscriber saw before
+            tracker.set_files([str(second)])
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(first), str(second)})
+
+            tracker.set_files([str(second)])
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), set())
+
+            tracker.close()
+
+    def test_directory_replaced(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            sub = root / "a" / "b"
+            sub.mkdir(parents=True)
+            fname = sub / "file.py"
+            fname.write_text("one\n")
+
+            tracker = self.tracker_class(temp_dir)
+            token = tracker.subscribe()
+            tracker.set_files([str(fname)])
+            tracker.get_changes(token)
+
+            fname.unlink()
+            sub.rmdir()
+            (root / "a").rmdir()
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(fname)})
+
+            sub.mkdir(parents=True)
+            fname.write_text("one again\n")
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(fname)})
+
+            fname.write_text("one changed\n")
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(fname)})
+
+            tracker.close()
+
+    def test_subscribers(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = Path(temp_dir) / "file.py"
+            fname.write_text("one\n")
+
+            tracker = self.tracker_class(temp_dir)
+            first = tracker.subscribe()
+            second = tracker.subscribe()
+            tracker.set_files([str(fname)])
+            tracker.get_changes(first)
+            tracker.get_changes(second)
+
+            fname.write_text("one changed\n")
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(first), {str(fname)})
+
+            # each subscriber sees every change once
+            self.assertEqual(tracker.get_changes(first), set())
+            self.assertEqual(tracker.get_changes(second), {str(fname)})
+
+            tracker.close()
+
+
+class TestPollingChangeTracker(ChangeTrackerTests, unittest.TestCase):
+    tracker_class = PollingChangeTracker
+
+    def test_same_size_edit(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = Path(temp_dir) / "file.py"
+            fname.write_text("one\n")
+
+            tracker = self.tracker_class(temp_dir)
+            token = tracker.subscribe()
+            tracker.set_files([str(fname)])
+            tracker.get_changes(token)
+
+            # in place, so the directory mtime stays the same
+            fname.write_text("two\n")
+            stat = fname.stat()
+            os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(fname)})
+
+            tracker.close()
+
+    def test_stats_only_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            fname = root / "file.py"
+            fname.write_text("one\n")
+            modules = root / "node_modules" / "pkg"
+            modules.mkdir(parents=True)
+            for i in range(20):
+                (modules / f"mod{i}.js").write_text("")
+
+            tracker = self.tracker_class(temp_dir)
+            tracker.set_files([str(fname)])
+
+            with patch("os.stat", wraps=os.stat) as mock_stat:
+                tracker.poll()
+            statted = [str(call.args[0]) for call in mock_stat.call_args_list]
+            self.assertEqual(statted, [str(fname)])
+
+    def test_missing_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            sub = root / "sub"
+            sub.mkdir()
+            fname = sub / "file.py"
+
+            tracker = self.tracker_class(temp_dir)
+            token = tracker.subscribe()
+            tracker.set_files([str(fname)])
+            tracker.get_changes(token)
+
+            # with an old mtime, the directory is all that needs stat-ing
+            os.utime(sub, ns=(0, 0))
+            tracker.poll()
+            with patch("os.stat", wraps=os.stat) as mock_stat:
+                tracker.poll()
+            statted = [str(call.args[0]) for call in mock_stat.call_args_list]
+            self.assertEqual(statted, [str(sub)])
+
+            fname.write_text("one\n")
+            tracker.poll()
+            self.assertEqual(tracker.get_changes(token), {str(fname)})
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is linux only")
+class TestInotifyChangeTracker(ChangeTrackerTests, unittest.TestCase):
+    tracker_class = InotifyChangeTracker
+
+    def test_get_change_tracker(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            tracker = get_change_tracker(temp_dir, allow_polling=False)
+            self.assertIsInstance(tracker, InotifyChangeTracker)
+            tracker.close()
+
+    def test_watches_only_file_dirs(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            fname = root / "src" / "file.py"
+            fname.parent.mkdir()
+            fname.write_text("one\n")
+            (root / "node_modules" / "pkg").mkdir(parents=True)
+            (root / "src" / "build").mkdir()
+
+            tracker = self.tracker_class(temp_dir)
+            tracker.set_files([str(fname)])
+            self.assertEqual(list(tracker.dirs.values()), [str(fname.parent)])
+
+            tracker.close()
+
+    def test_overflow(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            tracker = self.tracker_class(temp_dir)
+            token = tracker.subscribe()
+            tracker.get_changes(token)
+
+            # the kernel dropped events, so nothing can be trusted
+            overflow = tracker.event_header.pack(-1, tracker.IN_Q_OVERFLOW, 0, 0)
+            tracker.handle_events(overflow)
+            self.assertIsNone(tracker.get_changes(token))
+            self.assertEqual(tracker.get_changes(token), set())
+
+            tracker.close()
+
+
+class TestGetChangeTracker(unittest.TestCase):
+    def test_polling_fallback(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            with patch("aider.changes.sys.platform", "darwin"):
+                self.assertIsNone(get_change_tracker(temp_dir, allow_polling=False))
+
+                tracker = get_change_tracker(temp_dir)
+                self.assertIsInstance(tracker, PollingChangeTracker)
@@ -2,11 +2,12 @@ import os
 import tempfile
 import unittest
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import aiohttp
 import git
 import openai
-import requests
 
 from aider import models
 from aider.coders import Coder
@@ -47,6 +48,105 @@ class TestCoder(unittest.TestCase):
             fname.unlink()
             self.assertEqual(coder.get_last_modified(), 0)
 
+    def test_get_last_modified_with_change_tracker(self):
+        mock_io = MagicMock()
+
+        with GitTemporaryDirectory():
+            repo = git.Repo(Path.cwd())
+            fname = Path("new.txt")
+            fname.touch()
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "new")
+
+            coder = Coder.create(models.GPT4, None, mock_io, track_changes=True)
+            self.assertIsNotNone(coder.change_tracker)
+
+            coder.poll_changes()
+            mod = coder.get_last_modified()
+
+            # nothing changed, so nothing is stat-ed
+            coder.poll_changes()
+            with patch.object(Path, "stat") as mock_stat:
+                self.assertEqual(coder.get_last_modified(), mod)
+                coder.get_all_abs_files()
+            mock_stat.assert_not_called()
+
+            fname.write_text("hi")
+            coder.poll_changes()
+            self.assertLess(mod, coder.get_last_modified())
+
+            fname.unlink()
+            coder.poll_changes()
+            self.assertEqual(coder.get_last_modified(), 0)
+
+            coder.change_tracker.close()
+
+    def test_should_dirty_commit_with_change_tracker(self):
+        mock_io = MagicMock()
+
+        with GitTemporaryDirectory():
+            repo = git.Repo(Path.cwd())
+            fname = Path("new.txt")
+            fname.touch()
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "new")
+
+            coder = Coder.create(models.GPT4, None, mock_io, track_changes=True)
+            coder.poll_changes()
+            fname.write_text("hi")
+            self.assertTrue(coder.should_dirty_commit(""))
+            coder.last_asked_for_commit_time = coder.get_last_modified()
+
+            # nothing changed since, so git status isn't run
+            coder.poll_changes()
+            with patch.object(coder.git_batch, "is_dirty") as mock_is_dirty:
+                self.assertFalse(coder.should_dirty_commit(""))
+            mock_is_dirty.assert_not_called()
+
+            coder.change_tracker.close()
+
+    def test_track_changes_default(self):
+        mock_io = MagicMock()
+
+        with GitTemporaryDirectory():
+            # by default, only when the files can be watched instead of polled
+            with patch("aider.changes.sys.platform", "darwin"):
+                coder = Coder.create(models.GPT4, None, mock_io, track_changes=None)
+                self.assertIsNone(coder.change_tracker)
+
+                coder = Coder.create(models.GPT4, None, mock_io, track_changes=True)
+                self.assertIsNotNone(coder.change_tracker)
+
+            coder = Coder.create(models.GPT4, None, mock_io, track_changes=False)
+            self.assertIsNone(coder.change_tracker)
+
+    def test_poll_changes_once_a_turn(self):
+        mock_io = MagicMock()
+        mock_io.get_input.side_effect = ["hi", EOFError]
+
+        with GitTemporaryDirectory():
+            repo = git.Repo(Path.cwd())
+            fname = Path("new.txt")
+            fname.touch()
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "new")
+
+            coder = Coder.create(models.GPT4, None, mock_io, track_changes=True)
+            coder.send_new_user_message = MagicMock(return_value=None)
+
+            with patch.object(coder.change_tracker, "poll") as mock_poll:
+                coder.run()
+            mock_poll.assert_called_once()
+            coder.send_new_user_message.assert_called_once_with("hi")
+
+            # and once more before each reflected message
+            coder.send_new_user_message = MagicMock(side_effect=["reflected", None])
+            with patch.object(coder.change_tracker, "poll") as mock_poll:
+                coder.run(with_message="hi")
+            self.assertEqual(mock_poll.call_count, 2)
+
+            coder.change_tracker.close()
+
     def test_should_dirty_commit(self):
         # Mock the IO object
         mock_io = MagicMock()
@@ -67,6 +167,68 @@ class TestCoder(unittest.TestCase):
             self.assertFalse(coder.should_dirty_commit("/exit"))
             self.assertFalse(coder.should_dirty_commit("/help"))
 
+    def test_commit(self):
+        mock_io = MagicMock()
+
+        with GitTemporaryDirectory():
+            repo = git.Repo(Path.cwd())
+            for num in range(10):
+                Path(f"file{num}.txt").write_text(f"{num}\n")
+            repo.git.add(".")
+            repo.git.commit("-m", "initial")
+            for num in range(5):
+                repo.git.commit("--allow-empty", "-m", f"history {num}")
+
+            coder = Coder.create(models.GPT4, None, mock_io, fnames=["file0.txt"])
+
+            Path("file0.txt").write_text("chat file\n")
+            Path("file1.txt").write_text("other file\n")
+            Path("untracked.txt").write_text("untracked\n")
+
+            # only the chat file is committed
+            with patch("builtins.print"):
+                commit_hash, _ = coder.commit(message="chat files")
+            self.assertEqual(repo.head.commit.hexsha[:7], commit_hash)
+            self.assertEqual(list(repo.head.commit.stats.files), ["file0.txt"])
+
+            # then the rest of the dirty tracked files, in one status, diff, add and commit
+            repo.git.rm("file2.txt")
+            with patch.object(coder.git_batch, "run", wraps=coder.git_batch.run) as mock_run:
+                coder.commit(message="repo files", which="repo_files")
+            git_cmds = [call.args[0] for call in mock_run.call_args_list]
+            self.assertEqual(git_cmds, ["--no-optional-locks", "diff", "add", "commit"])
+
+            self.assertEqual(sorted(repo.head.commit.stats.files), ["file1.txt", "file2.txt"])
+            self.assertFalse(coder.git_batch.is_dirty())
+            self.assertIn("untracked.txt", repo.untracked_files)
+
+            # nothing left to commit
+            self.assertIsNone(coder.commit(message="nothing", which="repo_files"))
+
+    def test_show_send_output_stream_throttled(self):
+        mock_io = MagicMock()
+
+        with GitTemporaryDirectory():
+            coder = Coder.create(models.GPT4, None, mock_io, render_fps=10)
+            coder.partial_response_content = ""
+            coder.partial_response_function_call = dict()
+
+            chunks = []
+            for word in ("one ", "two ", "three"):
+                choice = SimpleNamespace(finish_reason=None, delta=SimpleNamespace(content=word))
+                chunks.append(SimpleNamespace(choices=[choice]))
+
+            # no time passes, so just the first chunk and the final response are drawn
+            with patch("aider.coders.base_coder.Live"), patch(
+                "aider.mdstream.time.monotonic", return_value=100.0
+            ), patch.object(
+                coder, "render_incremental_response", wraps=coder.render_incremental_response
+            ) as mock_render:
+                coder.show_send_output_stream(chunks, False)
+
+            self.assertEqual(mock_render.call_count, 2)
+            self.assertEqual(coder.partial_response_content, "one two three")
+
     def test_check_for_file_mentions(self):
         # Mock the IO object
         mock_io = MagicMock()
@@ -238,7 +400,7 @@ class TestCoder(unittest.TestCase):
         # Assert that the returned message is the expected one
         self.assertEqual(result, 'a good "commit message"')
 
-    @patch("aider.coders.base_coder.openai.ChatCompletion.create")
+    @patch("aider.coders.base_coder.openai.ChatCompletion.acreate", new_callable=AsyncMock)
     @patch("builtins.print")
     def test_send_with_retries_rate_limit_error(self, mock_print, mock_chat_completion_create):
         # Mock the IO object
@@ -260,7 +422,7 @@ class TestCoder(unittest.TestCase):
         # Assert that print was called once
         mock_print.assert_called_once()
 
-    @patch("aider.coders.base_coder.openai.ChatCompletion.create")
+    @patch("aider.coders.base_coder.openai.ChatCompletion.acreate", new_callable=AsyncMock)
     @patch("builtins.print")
     def test_send_with_retries_connection_error(self, mock_print, mock_chat_completion_create):
         # Mock the IO object
@@ -272,7 +434,7 @@ class TestCoder(unittest.TestCase):
         # Set up the mock to raise ConnectionError on the first call
         # and return None on the second call
         mock_chat_completion_create.side_effect = [
-            requests.exceptions.ConnectionError("Connection error"),
+            aiohttp.ServerDisconnectedError("Connection error"),
             None,
         ]
 
@@ -402,22 +564,23 @@ class TestCoder(unittest.TestCase):
         # both files should still be here
         self.assertEqual(len(coder.abs_fnames), 2)
 
-    @patch("aider.coders.base_coder.openai.ChatCompletion.create")
+    @patch("aider.coders.base_coder.openai.ChatCompletion.acreate", new_callable=AsyncMock)
     def test_run_with_invalid_request_error(self, mock_chat_completion_create):
         # Mock the IO object
         mock_io = MagicMock()
 
-        # Initialize the Coder object with the mocked IO and mocked repo
-        coder = Coder.create(models.GPT4, None, mock_io)
+        with GitTemporaryDirectory():
+            # Initialize the Coder object with the mocked IO and mocked repo
+            coder = Coder.create(models.GPT4, None, mock_io)
 
-        # Set up the mock to raise InvalidRequestError
-        mock_chat_completion_create.side_effect = openai.error.InvalidRequestError(
-            "Invalid request", "param"
-        )
+            # Set up the mock to raise InvalidRequestError
+            mock_chat_completion_create.side_effect = openai.error.InvalidRequestError(
+                "Invalid request", "param"
+            )
 
-        # Call the run method and assert that InvalidRequestError is raised
-        with self.assertRaises(openai.error.InvalidRequestError):
-            coder.run(with_message="hi")
+            # Call the run method and assert that InvalidRequestError is raised
+            with self.assertRaises(openai.error.InvalidRequestError):
+                coder.run(with_message="hi")
 
     def test_get_tracked_files(self):
         # Create a temporary directory
@@ -463,5 +626,35 @@ class TestCoder(unittest.TestCase):
         # Assert that coder.get_tracked_files() returns the three filenames
         self.assertEqual(set(tracked_files), set(created_files))
 
+    def test_get_tracked_files_cached(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo(Path.cwd())
+            Path("one.txt").write_text("one\n")
+            repo.git.add("one.txt")
+            repo.git.commit("-m", "one")
+
+            coder = Coder.create(models.GPT4, None, io=InputOutput())
+
+            tracked_files = coder.get_tracked_files()
+            self.assertIsInstance(tracked_files, frozenset)
+            self.assertEqual(tracked_files, {"one.txt"})
+
+            # the files aren't listed again until HEAD or the index changes
+            with patch.object(coder.git_batch, "ls_files") as mock_ls_files:
+                self.assertIs(coder.get_tracked_files(), tracked_files)
+            mock_ls_files.assert_not_called()
+
+            # staged files count as tracked
+            Path("two.txt").write_text("two\n")
+            repo.git.add("two.txt")
+            self.assertEqual(coder.get_tracked_files(), {"one.txt", "two.txt"})
+
+            repo.git.commit("-m", "two")
+            self.assertEqual(coder.get_tracked_files(), {"one.txt", "two.txt"})
+
+            repo.git.rm("one.txt")
+            repo.git.commit("-m", "rm one")
+            self.assertEqual(coder.get_tracked_files(), {"two.txt"})
+
     if __name__ == "__main__":
         unittest.main()
@@ -5,7 +5,7 @@ import sys
 import tempfile
 from io import StringIO
 from pathlib import Path
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import git
 
@@ -14,6 +14,7 @@ from aider.coders import Coder
 from aider.commands import Commands
 from aider.dump import dump  # noqa: F401
 from aider.io import InputOutput
+from aider.repomap import RepoMap
 from tests.utils import GitTemporaryDirectory
 
 
@@ -179,6 +180,65 @@ class TestCommands(TestCase):
             files_in_repo = repo.git.ls_files()
             self.assertIn("test.txt", files_in_repo)
 
+    def test_cmd_map_stats(self):
+        io = InputOutput(pretty=False, yes=True)
+        coder = Coder.create(models.GPT35, None, io)
+        commands = Commands(io, coder)
+
+        self.assertIn("/map-stats", commands.get_commands())
+
+        with mock.patch.object(io, "tool_error") as mock_error:
+            commands.run("/map-stats")
+            mock_error.assert_called_once_with("The repo map is disabled.")
+
+        with open("foo.py", "w") as f:
+            f.write("def foo():\n    pass\n")
+
+        coder.repo_map = RepoMap(root=self.tempdir, io=io)
+        coder.repo_map.get_repo_map([], [os.path.join(self.tempdir, "foo.py")])
+
+        with mock.patch.object(io, "tool_output") as mock_output:
+            commands.run("/map-stats")
+            report = mock_output.call_args[0][0]
+
+        self.assertIn("Repo-map stats", report)
+        self.assertIn("files read: 1", report)
+
+        del coder.repo_map
+
+    def test_cmd_undo(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+            fname = Path("foo.txt")
+            fname.write_text("one\n")
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "initial")
+            initial_sha = repo.head.commit.hexsha
+
+            io = InputOutput(pretty=False, yes=True)
+            coder = Coder.create(models.GPT35, None, io, fnames=[str(fname)])
+            commands = Commands(io, coder)
+
+            fname.write_text("two\n")
+            commit_hash, _ = coder.commit(message="change foo", prefix="aider: ")
+            coder.last_aider_commit_hash = commit_hash
+            self.assertEqual(repo.head.commit.hexsha[:7], commit_hash)
+
+            with mock.patch("builtins.print") as mock_print:
+                commands.cmd_diff("")
+            self.assertIn("two", mock_print.call_args[0][0])
+
+            commands.cmd_undo("")
+            self.assertEqual(repo.head.commit.hexsha, initial_sha)
+            self.assertEqual(fname.read_text(), "one\n")
+
+            # the initial commit wasn't made by aider
+            with mock.patch.object(io, "tool_error") as mock_error:
+                commands.cmd_undo("")
+            mock_error.assert_called_once_with(
+                "The last commit was not made by aider in this chat session."
+            )
+
     def test_cmd_tokens(self):
         # Initialize the Commands and InputOutput objects
         io = InputOutput(pretty=False, yes=True)
@@ -0,0 +1,341 @@
+import difflib
+import random
+import re
+import unittest
+from pathlib import Path
+
+import aider
+from aider.diffs import (
+    LiveDiff,
+    diff_lines,
+    diff_partial_update,
+    find_last_non_deleted,
+    format_hunk,
+    group_opcodes,
+    progress_bar_line,
+)
+
+# real code, with plenty of blank and repeated lines
+SOURCE_FILES = ["diffs.py", "repomap.py", "coders/base_coder.py"]
+
+hunk_header_pattern = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@\n")
+progress_bar_pattern = re.compile(r"\+ *(\d+) / *\d+ lines \[")
+
+
+def ndiff_last_non_deleted(lines_orig, lines_updated):
+    "How find_last_non_deleted() used to work, with difflib.ndiff()"
+    num_orig = 0
+    last_non_deleted = None
+    for line in difflib.ndiff(lines_orig, lines_updated):
+        if line[0] in " -":
+            num_orig += 1
+        if line[0] == " ":
+            last_non_deleted = num_orig
+    return last_non_deleted
+
+
+def get_source_lines(fname):
+    return (Path(aider.__file__).parent / fname).read_text().splitlines(keepends=True)
+
+
+def make_edits(rng, lines_orig):
+    "Replace, insert and delete a few runs of lines, like the model would"
+    lines = list(lines_orig)
+    for num in range(rng.randint(1, 4)):
+        pos = rng.randrange(len(lines))
+        size = rng.randint(0, 12)
+        new_lines = [f"    edited_{num}_{i}()\n" for i in range(rng.randint(0, 8))]
+        new_lines += rng.choice([[], ["\n"], ["        return\n", "\n"], [")\n"]])
+        lines[pos : pos + size] = new_lines
+    return lines
+
+
+def check_diff(test, diff, lines_orig, lines_updated, final=False):
+    """
+    Check that a diff from diff_partial_update() or LiveDiff is well formed: its
+    hunks are in order and match the lines they cover, and the lines outside
+    them are unchanged. Returns how far into lines_orig the diff got.
+    """
+    if not diff:
+        # nothing matched yet
+        test.assertFalse(final)
+        return
+
+    lines = diff.splitlines(keepends=True)
+    fence = lines[0][: -len("diff\n")]
+    test.assertRegex(fence, "^```+$")
+    test.assertEqual(lines[-2:], [fence + "\n", "\n"])
+    lines = [line for line in lines[1:-2] if not line.startswith(("--- ", "+++ "))]
+
+    if final:
+        last_non_deleted = len(lines_orig)
+    else:
+        # the progress bar stands in for the last line, which may be incomplete
+        match = progress_bar_pattern.search(diff)
+        last_non_deleted = int(match.group(1))
+        bar = progress_bar_line(last_non_deleted, len(lines_orig))
+        lines_updated = lines_updated[:-1] + [bar]
+    lines_orig = lines_orig[:last_non_deleted]
+
+    pos_orig = pos_updated = 0
+    num = 0
+    while num < len(lines):
+        match = hunk_header_pattern.fullmatch(lines[num])
+        test.assertTrue(match, lines[num])
+
+        start_orig, len_orig, start_updated, len_updated = (
+            int(val) if val is not None else 1 for val in match.groups()
+        )
+        # empty ranges are numbered by the line before them
+        start_orig -= bool(len_orig)
+        start_updated -= bool(len_updated)
+
+        test.assertGreaterEqual(start_orig, pos_orig)
+        test.assertEqual(lines_orig[pos_orig:start_orig], lines_updated[pos_updated:start_updated])
+
+        num += 1
+        body = []
+        while num < len(lines) and not lines[num].startswith("@@"):
+            test.assertIn(lines[num][0], " -+")
+            body.append(lines[num])
+            num += 1
+
+        old = [line[1:] for line in body if line[0] != "+"]
+        new = [line[1:] for line in body if line[0] != "-"]
+        pos_orig, pos_updated = start_orig + len_orig, start_updated + len_updated
+        test.assertEqual(old, lines_orig[start_orig:pos_orig])
+        test.assertEqual(new, lines_updated[start_updated:pos_updated])
+
+    test.assertEqual(lines_orig[pos_orig:], lines_updated[pos_updated:])
+    return last_non_deleted
+
+
+class TestLiveDiff(unittest.TestCase):
+    def get_edits(self, lines_orig):
+        edits = dict()
+
+        lines = list(lines_orig)
+        edits["unchanged"] = lines
+
+        lines = list(lines_orig)
+        lines[50:53] = ["new a\n", "new b\n"]
+        edits["replaced"] = lines
+
+        lines = list(lines_orig)
+        del lines[100:140]
+        edits["deleted"] = lines
+
+        lines = list(lines_orig)
+        lines[10:10] = [f"inserted {i}\n" for i in range(30)]
+        edits["inserted"] = lines
+
+        lines = list(lines_orig)
+        lines[20] = "changed\n"
+        lines[150] = "changed\n"
+        lines.append("appended\n")
+        edits["several"] = lines
+
+        return edits
+
+    def test_matches_diff_partial_update(self):
+        lines_orig = [f"line {i}\n" for i in range(200)]
+
+        for name, lines_updated in self.get_edits(lines_orig).items():
+            live_diff = LiveDiff(lines_orig, fname="file.txt")
+            for num in range(len(lines_updated) + 1):
+                partial = lines_updated[:num]
+                self.assertEqual(
+                    live_diff.update(partial),
+                    diff_partial_update(lines_orig, partial, fname="file.txt"),
+                    f"{name} after {num} lines",
+                )
+
+            self.assertEqual(
+                live_diff.update(lines_updated, final=True),
+                diff_partial_update(lines_orig, lines_updated, final=True, fname="file.txt"),
+                name,
+            )
+
+    def test_real_files(self):
+        rng = random.Random(1)
+        for fname in SOURCE_FILES:
+            lines_orig = get_source_lines(fname)
+            for _ in range(3):
+                lines_updated = make_edits(rng, lines_orig)
+
+                live_diff = LiveDiff(lines_orig, fname=fname)
+                for num in range(len(lines_updated) + 1):
+                    partial = lines_updated[:num]
+                    check_diff(self, live_diff.update(partial), lines_orig, partial)
+
+                self.assertEqual(
+                    live_diff.update(lines_updated, final=True),
+                    diff_partial_update(lines_orig, lines_updated, final=True, fname=fname),
+                )
+
+    def test_partial_diff_can_differ(self):
+        # the lines after "a" aren't back in sync until sync_lines of them match, so for now
+        # they're all new, while diff_partial_update() lines them up with the second blank line
+        lines_orig = ["a\n", "\n", "b\n", "\n", "c\n", "d\n", "e\n", "f\n"]
+        partial = ["a\n", "new\n", "\n", "c\n", "d"]
+
+        live_diff = LiveDiff(lines_orig)
+        diff = live_diff.update(partial)
+        expected = diff_partial_update(lines_orig, partial)
+
+        self.assertNotEqual(diff, expected)
+        check_diff(self, diff, lines_orig, partial)
+        check_diff(self, expected, lines_orig, partial)
+
+    def test_hunks_are_formatted_once(self):
+        lines_orig = [f"line {i}\n" for i in range(200)]
+        lines_updated = list(lines_orig)
+        lines_updated[20] = "changed\n"
+
+        live_diff = LiveDiff(lines_orig)
+        live_diff.update(lines_updated[:100])
+
+        # the hunk is done, and only the lines since it are still opcodes
+        self.assertEqual(len(live_diff.hunks), 1)
+        self.assertEqual(live_diff.opcodes, [("equal", 21, 99, 21, 99)])
+        self.assertIn("+changed\n", live_diff.hunks[0])
+
+    def test_new_lines_which_resync_later(self):
+        lines_orig = [f"line {i}\n" for i in range(20)]
+        lines_updated = lines_orig[:5] + ["new\n", "line 6\n"]
+
+        live_diff = LiveDiff(lines_orig)
+
+        # a single matching line isn't enough to sync back up yet
+        live_diff.update(lines_updated + ["line 7\n"])
+        self.assertEqual(live_diff.updated_pos, 5)
+
+        live_diff.update(lines_updated + ["line 7\n", "line 8\n", "line"])
+        self.assertEqual(live_diff.opcodes[-2], ("replace", 5, 6, 5, 6))
+        self.assertEqual(live_diff.orig_pos, 9)
+
+
+class TestDiffLines(unittest.TestCase):
+    def get_edits(self):
+        lines_orig = [f"line {i}\n" for i in range(300)]
+        edits = TestLiveDiff.get_edits(None, lines_orig)
+
+        lines = list(lines_orig)
+        lines[250:] = [f"tail {i}\n" for i in range(10)]
+        edits["new tail"] = lines
+
+        lines = list(lines_orig)
+        lines[0:5] = []
+        lines[140:160] = lines[140:160][::-1]
+        edits["moved"] = lines
+
+        return lines_orig, edits
+
+    def test_opcodes_rebuild_updated(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            lines_a = [rng.choice("abcd\n") for _ in range(rng.randrange(30))]
+            lines_b = [rng.choice("abcde\n") for _ in range(rng.randrange(30))]
+
+            lines = []
+            pos_a = pos_b = 0
+            for tag, i1, i2, j1, j2 in diff_lines(lines_a, lines_b):
+                self.assertEqual((i1, j1), (pos_a, pos_b))
+                if tag == "equal":
+                    self.assertEqual(lines_a[i1:i2], lines_b[j1:j2])
+                lines += lines_b[j1:j2]
+                pos_a, pos_b = i2, j2
+
+            self.assertEqual(lines, lines_b)
+            self.assertEqual((pos_a, pos_b), (len(lines_a), len(lines_b)))
+
+    def test_matches_difflib(self):
+        lines_orig, edits = self.get_edits()
+
+        for name, lines_updated in edits.items():
+            opcodes = diff_lines(lines_orig, lines_updated)
+            matcher = difflib.SequenceMatcher(None, lines_orig, lines_updated, autojunk=False)
+            self.assertEqual(opcodes, matcher.get_opcodes(), name)
+
+            diff = "".join(
+                format_hunk(group, lines_orig, lines_updated) for group in group_opcodes(opcodes, 5)
+            )
+            expected = difflib.unified_diff(lines_orig, lines_updated, n=5)
+            self.assertEqual(diff, "".join(list(expected)[2:]), name)
+
+            for num in range(0, len(lines_updated) + 1, 7):
+                partial = lines_updated[:num]
+                self.assertEqual(
+                    find_last_non_deleted(lines_orig, partial),
+                    ndiff_last_non_deleted(lines_orig, partial),
+                    f"{name} after {num} lines",
+                )
+
+    def test_repeated_lines(self):
+        # no line is unique, so there's nothing to anchor the diff
+        block = ["def f():\n", "    return 1\n", "\n"]
+        lines_orig = block * 1000
+        lines_updated = list(lines_orig)
+        lines_updated[300:300] = ["def g():\n", "    return 2\n"]
+
+        partial = lines_updated[:1502]
+        self.assertEqual(find_last_non_deleted(lines_orig, partial), 1500)
+
+        diff = diff_partial_update(lines_orig, lines_updated, final=True)
+        self.assertIn("@@ -296,10 +296,12 @@", diff)
+        self.assertIn("\n+def g():\n+    return 2\n", diff)
+
+    def test_real_files(self):
+        rng = random.Random(0)
+        for fname in SOURCE_FILES:
+            lines_orig = get_source_lines(fname)
+            for _ in range(3):
+                lines_updated = make_edits(rng, lines_orig)
+
+                lines = []
+                for tag, i1, i2, j1, j2 in diff_lines(lines_orig, lines_updated):
+                    if tag == "equal":
+                        self.assertEqual(lines_orig[i1:i2], lines_updated[j1:j2])
+                    lines += lines_updated[j1:j2]
+                self.assertEqual(lines, lines_updated)
+
+                diff = diff_partial_update(lines_orig, lines_updated, final=True)
+                check_diff(self, diff, lines_orig, lines_updated, final=True)
+
+                for num in range(0, len(lines_updated) + 1, 11):
+                    partial = lines_updated[:num]
+                    diff = diff_partial_update(lines_orig, partial)
+                    check_diff(self, diff, lines_orig, partial)
+
+    def test_known_differences_from_difflib(self):
+        # a line which is in the original more than once can be kept from a different place
+        lines_orig = ["x = 1\n", ")\n", ")\n"]
+        lines_updated = [")\n"]
+        self.assertEqual(
+            diff_lines(lines_orig, lines_updated),
+            [
+                ("delete", 0, 2, 0, 0),
+                ("equal", 2, 3, 0, 1),
+            ],
+        )
+        matcher = difflib.SequenceMatcher(None, lines_orig, lines_updated, autojunk=False)
+        self.assertEqual(
+            matcher.get_opcodes(),
+            [
+                ("delete", 0, 1, 0, 0),
+                ("equal", 1, 2, 0, 1),
+                ("delete", 2, 3, 1, 1),
+            ],
+        )
+
+        # a partial update only matches as far into the original as is cheaper than new lines,
+        # ndiff matches the one line after skipping three
+        lines_orig = ["    return x\n", ")\n", "x = 1\n", "x = 1\n"]
+        partial = ["x = 1\n"]
+        self.assertIsNone(find_last_non_deleted(lines_orig, partial))
+        self.assertEqual(ndiff_last_non_deleted(lines_orig, partial), 3)
+
+        # when it's a tie, the match wins
+        lines_orig = ["def f():\n", "x = 1\n", "x = 1\n"]
+        self.assertEqual(find_last_non_deleted(lines_orig, partial), 2)
+        self.assertEqual(ndiff_last_non_deleted(lines_orig, partial), 2)
@@ -0,0 +1,122 @@
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import git
+from git.exc import GitCommandError
+
+from aider.gitbatch import GitBatch
+from tests.utils import GitTemporaryDirectory
+
+
+class TestGitBatch(unittest.TestCase):
+    def test_rev_parse_sees_new_commits(self):
+        with GitTemporaryDirectory() as temp_dir:
+            repo = git.Repo(temp_dir)
+            git_batch = GitBatch(temp_dir)
+
+            # no commits yet
+            self.assertIsNone(git_batch.rev_parse("HEAD"))
+
+            Path("one.txt").write_text("one\n")
+            repo.git.add("one.txt")
+            repo.git.commit("-m", "first commit")
+            self.assertEqual(git_batch.rev_parse("HEAD"), repo.head.commit.hexsha)
+
+            # the same cat-file process answers, and sees the next commit
+            proc = git_batch.cat_file_proc
+            Path("one.txt").write_text("two\n")
+            repo.git.commit("-am", "second commit\n\nwith a body")
+            self.assertEqual(git_batch.rev_parse("HEAD"), repo.head.commit.hexsha)
+            self.assertIs(git_batch.cat_file_proc, proc)
+
+            self.assertEqual(git_batch.get_commit_message("HEAD"), "second commit\n\nwith a body\n")
+            self.assertEqual(git_batch.get_commit_message("HEAD~1"), "first commit\n")
+            self.assertIsNone(git_batch.rev_parse("origin/main"))
+
+            sha, kind, content = git_batch.cat_file("HEAD:one.txt")
+            self.assertEqual(kind, "blob")
+            self.assertEqual(content, b"two\n")
+
+            git_batch.close()
+
+    def test_ls_files_and_is_dirty(self):
+        with GitTemporaryDirectory() as temp_dir:
+            repo = git.Repo(temp_dir)
+            git_batch = GitBatch(temp_dir)
+
+            Path("sub").mkdir()
+            Path("sub/fänny.md").write_text("one\n")
+            Path("README.md").write_text("two\n")
+            repo.git.add(".")
+            repo.git.commit("-m", "added")
+
+            self.assertEqual(git_batch.ls_files(), {"README.md", "sub/fänny.md"})
+            self.assertFalse(git_batch.is_dirty())
+
+            # untracked files don't make it dirty, but edits and staged files do
+            Path("new.txt").write_text("new\n")
+            self.assertFalse(git_batch.is_dirty())
+
+            repo.git.add("new.txt")
+            self.assertTrue(git_batch.is_dirty())
+            self.assertIn("new.txt", git_batch.ls_files())
+
+            repo.git.commit("-m", "new")
+            self.assertFalse(git_batch.is_dirty())
+
+            Path("README.md").write_text("changed\n")
+            self.assertTrue(git_batch.is_dirty())
+
+            git_batch.close()
+
+    def test_run(self):
+        with GitTemporaryDirectory() as temp_dir:
+            git_batch = GitBatch(temp_dir)
+
+            self.assertEqual(git_batch.run("config", "user.name"), "Test User")
+
+            with self.assertRaises(GitCommandError):
+                git_batch.run("no-such-command")
+
+    def test_get_status(self):
+        with GitTemporaryDirectory() as temp_dir:
+            repo = git.Repo(temp_dir)
+            git_batch = GitBatch(temp_dir)
+
+            for fname in ("a.txt", "b.txt", "c.txt"):
+                Path(fname).write_text(f"{fname}\n")
+            repo.git.add(".")
+            repo.git.commit("-m", "added")
+
+            repo.git.mv("a.txt", "renamed.txt")
+            Path("b.txt").write_text("changed\n")
+            repo.git.rm("c.txt")
+
+            self.assertEqual(
+                sorted(git_batch.get_status()),
+                [(" M", "b.txt"), ("D ", "c.txt"), ("R ", "renamed.txt")],
+            )
+
+            # just the given paths, taken literally, even over several runs. Without
+            # the original path, the rename shows as an add.
+            with patch("aider.gitbatch.MAX_PATHS_CHARS", 10):
+                self.assertEqual(
+                    sorted(git_batch.get_status(["b.txt", "*.txt", "renamed.txt"])),
+                    [(" M", "b.txt"), ("A ", "renamed.txt")],
+                )
+            self.assertEqual(git_batch.get_status([]), [])
+
+    def test_run_paths(self):
+        with GitTemporaryDirectory() as temp_dir:
+            git_batch = GitBatch(temp_dir)
+
+            fnames = [f"file{num}.txt" for num in range(20)]
+            for fname in fnames:
+                Path(fname).write_text(f"{fname}\n")
+
+            with patch("aider.gitbatch.MAX_PATHS_CHARS", 50):
+                with patch.object(git_batch, "run", wraps=git_batch.run) as mock_run:
+                    git_batch.run_paths(["add"], fnames)
+            self.assertGreater(mock_run.call_count, 1)
+            self.assertEqual(git_batch.ls_files(), set(fnames))
@@ -1,8 +1,16 @@
 import os
 import unittest
+from pathlib import Path
 from unittest.mock import patch
 
 from aider.io import AutoCompleter, InputOutput
+from tests.utils import IgnorantTemporaryDirectory
+
+
+def backdate(fname):
+    "Move the mtime of fname back far enough for its contents to be cached"
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10 * 10**9))
 
 
 class TestInputOutput(unittest.TestCase):
@@ -19,6 +27,84 @@ class TestInputOutput(unittest.TestCase):
         autocompleter = AutoCompleter(root, rel_fnames, addable_rel_fnames, commands, "utf-8")
         self.assertEqual(autocompleter.words, set(rel_fnames))
 
+    def test_read_text_cache(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = Path(temp_dir) / "file.txt"
+            fname.write_text("one\n")
+            backdate(fname)
+
+            io = InputOutput(pretty=False)
+            self.assertEqual(io.read_text(fname), "one\n")
+
+            # unchanged, so it isn't read again
+            with patch("builtins.open") as mock_open:
+                self.assertEqual(io.read_text(fname), "one\n")
+            mock_open.assert_not_called()
+
+            # changed behind its back
+            fname.write_text("two, longer\n")
+            backdate(fname)
+            self.assertEqual(io.read_text(fname), "two, longer\n")
+
+            # written through, once its mtime is old enough to trust
+            io.write_text(fname, "three\n")
+            self.assertNotIn(str(fname), io.text_cache)
+            backdate(fname)
+            self.assertEqual(io.read_text(fname), "three\n")
+            with patch("builtins.open") as mock_open:
+                self.assertEqual(io.read_text(fname), "three\n")
+            mock_open.assert_not_called()
+
+            # \r is translated on reading, so that isn't cached
+            io.write_text(fname, "four\r\n")
+            self.assertEqual(io.read_text(fname), "four\n")
+
+            fname.unlink()
+            with patch.object(io, "tool_error"):
+                self.assertIsNone(io.read_text(fname))
+            self.assertEqual(io.text_cache_chars, 0)
+
+    def test_read_text_cache_racy(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = Path(temp_dir) / "file.py"
+            fname.write_text("x = 1\n")
+            stat = fname.stat()
+
+            io = InputOutput(pretty=False)
+            self.assertEqual(io.read_text(fname), "x = 1\n")
+            self.assertNotIn(str(fname), io.text_cache)
+
+            # rewritten in place within the same mtime tick
+            fname.write_text("x = 2\n")
+            os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            self.assertEqual(io.read_text(fname), "x = 2\n")
+
+            # an mtime old enough to trust gets cached
+            backdate(fname)
+            self.assertEqual(io.read_text(fname), "x = 2\n")
+            self.assertIn(str(fname), io.text_cache)
+
+    def test_read_text_cache_size(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            io = InputOutput(pretty=False)
+            io.text_cache_size = 25
+
+            fnames = []
+            for num in range(3):
+                fname = Path(temp_dir) / f"file{num}.txt"
+                fname.write_text(f"{num}" * 10)
+                backdate(fname)
+                fnames.append(str(fname))
+
+            io.read_text(fnames[0])
+            io.read_text(fnames[1])
+            io.read_text(fnames[0])
+            io.read_text(fnames[2])
+
+            # the least recently used file went first
+            self.assertEqual(list(io.text_cache), [fnames[0], fnames[2]])
+            self.assertEqual(io.text_cache_chars, 20)
+
 
 if __name__ == "__main__":
     unittest.main()
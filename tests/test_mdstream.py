@@ -0,0 +1,111 @@
+import io
+import unittest
+from unittest.mock import patch
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+from aider.mdstream import MarkdownStream, is_blank, split_blocks
+
+sample = """Here is the change.
+
+# Heading
+Some *text* that
+wraps across lines.
+
+- one
+- two
+
+  continued
+
+1. first
+2. second
+
+```python
+def f():
+
+    return 1
+```
+Then more text.
+
+> quoted
+> lines
+
+    indented code
+
+    more
+
+Final paragraph.
+"""
+
+
+class TestMarkdownStream(unittest.TestCase):
+    def make_stream(self, fps=0):
+        console = Console(file=io.StringIO(), width=50, force_terminal=True)
+        live = Live(console=console, auto_refresh=False)
+        return console, MarkdownStream(live, fps=fps)
+
+    def test_split_blocks(self):
+        blocks, rest = split_blocks("one\ntwo\n\nthree\n\nfou")
+        self.assertEqual(blocks, ["one\ntwo\n\n"])
+        self.assertEqual(rest, "three\n\nfou")
+
+        # blank lines inside a fence, list items and indented lines don't end a block
+        text = "```\na\n\nb\n```\n- a\n\n- b\n\n  more\n"
+        blocks, rest = split_blocks(text)
+        self.assertEqual(blocks, ["```\na\n\nb\n```\n"])
+        self.assertEqual(rest, "- a\n\n- b\n\n  more\n")
+
+        # an unclosed fence is still open
+        blocks, rest = split_blocks("# Title\n````\ncode\n```\n")
+        self.assertEqual(blocks, ["# Title\n"])
+        self.assertEqual(rest, "````\ncode\n```\n")
+
+    def test_stream_matches_full_render(self):
+        console, md_stream = self.make_stream()
+
+        for i in range(1, len(sample) + 1):
+            md_stream.update(sample[:i])
+            console.render_lines(md_stream, pad=False)
+
+        lines = console.render_lines(md_stream, pad=False)
+        expected = console.render_lines(Markdown(sample), pad=False)
+        while is_blank(expected[0]):
+            expected.pop(0)
+        while is_blank(expected[-1]):
+            expected.pop()
+        self.assertEqual(lines, expected)
+
+    def test_done_blocks_render_once(self):
+        console, md_stream = self.make_stream()
+
+        md_stream.update("First paragraph.\n\nSec\n")
+        console.render_lines(md_stream)
+        block = md_stream.blocks[0]
+
+        with patch("aider.mdstream.Markdown", wraps=Markdown) as mock_markdown:
+            md_stream.update("First paragraph.\n\nSecond paragraph")
+            console.render_lines(md_stream)
+
+        # just the tail was parsed again
+        self.assertEqual(mock_markdown.call_count, 1)
+        self.assertEqual(mock_markdown.call_args[0][0], "Second paragraph")
+        self.assertIs(md_stream.blocks[0], block)
+
+        # the start changed, so the blocks are rebuilt
+        md_stream.update("Other paragraph.\n\nSecond paragraph\n")
+        self.assertEqual(md_stream.done_text, "Other paragraph.\n\n")
+        self.assertEqual(md_stream.blocks[0].text, "Other paragraph.\n\n")
+
+    def test_is_due(self):
+        console, md_stream = self.make_stream(fps=10)
+
+        with patch("aider.mdstream.time.monotonic", return_value=100.0):
+            self.assertTrue(md_stream.is_due())
+            md_stream.update("one")
+            self.assertFalse(md_stream.is_due())
+            self.assertTrue(md_stream.is_due(final=True))
+
+        with patch("aider.mdstream.time.monotonic", return_value=100.2):
+            self.assertTrue(md_stream.is_due())
@@ -1,11 +1,29 @@
+import json
 import os
+import random
+import tracemalloc
 import unittest
-from unittest.mock import patch
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from unittest.mock import MagicMock, patch
 
-from aider.io import InputOutput
-from aider.repomap import RepoMap
+import git
 
-from tests.utils import IgnorantTemporaryDirectory
+from aider.changes import PollingChangeTracker
+from aider.idents import get_identifier_scanner
+from aider.io import InputOutput
+from aider.ranking import ReferenceGraph, rank_networkx, rank_sparse
+from aider.repomap import (
+    MapStats,
+    RepoMap,
+    get_pygments_identifiers,
+    iter_tree_lines,
+    to_tree,
+)
+from aider.tags import CtagsExtractor, get_python_tags_from_content
+from tests.utils import GitTemporaryDirectory, IgnorantTemporaryDirectory
 
 
 class TestRepoMap(unittest.TestCase):
@@ -113,6 +131,669 @@ print(my_function(3, 4))
             repo_map = RepoMap(io=InputOutput())
             self.assertTrue(repo_map.has_ctags)
 
+    def test_update_tags_cache_batches_ctags(self):
+        test_files = ["one.py", "two.py", "three.py"]
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i, file in enumerate(test_files):
+                fname = os.path.join(temp_dir, file)
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    pass\n")
+                fnames.append(fname)
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), tag_extractors=[CtagsExtractor()])
+
+            output = "\n".join(
+                json.dumps(dict(_type="tag", name=f"func{i}", path=fname, kind="function"))
+                for i, fname in enumerate(fnames[:2])
+            )
+
+            with patch("subprocess.check_output") as mock_run:
+                mock_run.return_value = output.encode("utf-8")
+                tags = repo_map.update_tags_cache(fnames)
+
+                # one ctags process for all the files
+                self.assertEqual(mock_run.call_count, 1)
+                args, kwargs = mock_run.call_args
+                self.assertIn("-L", args[0])
+                self.assertEqual(kwargs["input"].decode("utf-8").splitlines(), fnames)
+
+                self.assertEqual(tags[fnames[0]][0]["name"], "func0")
+                self.assertEqual(tags[fnames[1]][0]["name"], "func1")
+                self.assertEqual(tags[fnames[2]], [])
+
+                # everything is cached now, so no more ctags runs
+                self.assertEqual(repo_map.update_tags_cache(fnames), tags)
+                self.assertEqual(repo_map.get_tags(fnames[0]), tags[fnames[0]])
+                self.assertEqual(mock_run.call_count, 1)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_update_ident_cache_with_workers(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(6):
+                fname = os.path.join(temp_dir, f"file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}(arg):\n    return helper{i}(arg)\n")
+                fnames.append(fname)
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), map_workers=2)
+            repo_map.min_worker_batch = 2
+            with patch("aider.repomap.ProcessPoolExecutor", wraps=ProcessPoolExecutor) as mock_pool:
+                all_idents = repo_map.update_ident_cache(fnames[:3])
+                all_idents.update(repo_map.update_ident_cache(fnames[3:]))
+
+            # one pool serves every update
+            self.assertEqual(mock_pool.call_count, 1)
+
+            # the workers aren't forked from this process, which may have other threads running
+            self.assertNotEqual(mock_pool.call_args.kwargs["mp_context"].get_start_method(), "fork")
+            self.assertEqual(repo_map.file_cache.stats["idents misses"], len(fnames))
+
+            for i, fname in enumerate(fnames):
+                idents = repo_map.get_name_identifiers(fname)
+                self.assertEqual(idents, set(all_idents[fname]))
+                self.assertEqual(idents, set(repo_map.get_name_identifiers_uncached(fname)))
+                self.assertIn(f"helper{i}", idents)
+
+            repo_map.close_workers()
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_map_in_workers(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), map_workers=2)
+            fnames = ["a.py", "b.py", "c.py"]
+            expected = [(fname, "utf-8") for fname in fnames]
+
+            def pair(fname, encoding):
+                return fname, encoding
+
+            # too few files to be worth the workers
+            with patch.object(repo_map, "get_executor") as mock_executor:
+                self.assertEqual(repo_map.map_in_workers(pair, fnames), expected)
+            mock_executor.assert_not_called()
+
+            # a worker died, so they're done here instead
+            repo_map.min_worker_batch = 2
+            executor = MagicMock()
+            executor.map.side_effect = BrokenProcessPool()
+            repo_map.executor = executor
+            self.assertEqual(repo_map.map_in_workers(pair, fnames), expected)
+            executor.shutdown.assert_called_once()
+            self.assertIsNone(repo_map.executor)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_python_ast_tags(self):
+        content = """\
+import os
+
+CONSTANT, (other, *rest) = 1, (2, 3)
+
+class MyClass(Base):
+    attr: int = 0
+
+    def my_method(self, arg1, arg2=None, *args, key: str = "k", **kwargs):
+        local = arg1
+        def inner():
+            pass
+        return local
+
+async def my_function(a, b, /, c):
+    return a
+
+if os.name == "nt":
+    def windows_only():
+        pass
+"""
+        tags = get_python_tags_from_content("example.py", content)
+        tags = [(tag["name"], tag["kind"], tag.get("scope"), tag.get("signature")) for tag in tags]
+
+        self.assertEqual(
+            tags,
+            [
+                ("CONSTANT", "variable", None, None),
+                ("other", "variable", None, None),
+                ("rest", "variable", None, None),
+                ("MyClass", "class", None, None),
+                ("attr", "variable", "MyClass", None),
+                (
+                    "my_method",
+                    "member",
+                    "MyClass",
+                    '(self, arg1, arg2=None, *args, key: str="k", **kwargs)',
+                ),
+                ("inner", "function", "MyClass.my_method", "()"),
+                ("my_function", "function", None, "(a, b, /, c)"),
+                ("windows_only", "function", None, "()"),
+            ],
+        )
+
+        self.assertEqual(get_python_tags_from_content("bad.py", "def ("), [])
+
+    def test_get_repo_map_python_ast_without_ctags(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "defines.py"), "w") as f:
+                f.write("class MyClass:\n    def my_method(self, arg):\n        pass\n")
+            with open(os.path.join(temp_dir, "uses.py"), "w") as f:
+                f.write("from defines import MyClass\n\nMyClass().my_method(1)\n")
+
+            with patch("subprocess.check_output") as mock_run:
+                mock_run.side_effect = FileNotFoundError()
+                repo_map = RepoMap(root=temp_dir, io=InputOutput())
+
+                self.assertFalse(repo_map.has_ctags)
+                self.assertTrue(repo_map.use_tags)
+
+                other_files = [
+                    os.path.join(temp_dir, "defines.py"),
+                    os.path.join(temp_dir, "uses.py"),
+                ]
+                result = repo_map.get_repo_map([], other_files)
+
+                self.assertIn("MyClass", result)
+                self.assertIn("my_method (self, arg)", result)
+
+                # ast tags are cached like ctags ones
+                content_key = repo_map.file_cache.get_content_key(other_files[0])
+                kind = ("tags", "python-ast", ".py")
+                self.assertIsNotNone(repo_map.file_cache.get(kind, content_key))
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_identifier_scanner_matches_pygments(self):
+        root = Path(__file__).parent.parent
+        fnames = sorted(root.glob("aider/**/*.py")) + sorted(root.glob("tests/**/*.py"))
+        self.assertTrue(fnames)
+
+        for fname in fnames:
+            fname = str(fname)
+            content = Path(fname).read_text(encoding="utf-8")
+
+            scanner = get_identifier_scanner(fname)
+            self.assertIsNotNone(scanner)
+            self.assertEqual(
+                Counter(scanner(content)),
+                Counter(get_pygments_identifiers(fname, content)),
+                fname,
+            )
+
+        self.assertIsNone(get_identifier_scanner("file.js"))
+
+    def test_rank_engines_agree(self):
+        random.seed(0)
+        fnames = [f"file{i}.py" for i in range(40)]
+        idents = [f"ident{i}" for i in range(60)]
+
+        defines = defaultdict(set)
+        references = defaultdict(Counter)
+        for ident in idents:
+            for fname in random.sample(fnames, random.randint(1, 3)):
+                defines[ident].add(fname)
+            for _ in range(random.randint(0, 10)):
+                references[ident][random.choice(fnames)] += 1
+
+        for personalization in (dict(), {"file0.py": 1.0, "file1.py": 1.0}):
+            nx_ranked, nx_definitions = rank_networkx(defines, references, personalization)
+            ranked, definitions = rank_sparse(defines, references, personalization)
+
+            self.assertEqual(set(ranked), set(nx_ranked))
+            for fname, rank in nx_ranked.items():
+                self.assertAlmostEqual(ranked[fname], rank)
+
+            self.assertEqual(set(dict(definitions)), set(dict(nx_definitions)))
+            for key, rank in nx_definitions:
+                self.assertAlmostEqual(dict(definitions)[key], rank)
+
+            ranks = [rank for _key, rank in definitions]
+            self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+            # starting from the previous ranks converges to the same place
+            warm_ranked, _ = rank_sparse(defines, references, personalization, nstart=ranked)
+            for fname, rank in ranked.items():
+                self.assertAlmostEqual(warm_ranked[fname], rank, places=5)
+
+        with self.assertRaises(ZeroDivisionError):
+            rank_sparse(defines, references, {"missing.py": 1.0})
+
+        self.assertEqual(rank_sparse(dict(), dict(), dict()), (dict(), []))
+
+    def test_reference_graph_memory(self):
+        random.seed(0)
+        num_files = 2000
+
+        inputs = []
+        for i in range(num_files):
+            rel_fname = f"pkg{i % 20}/module{i}.py"
+            definitions = [
+                (f"func_{i}_{j}", (rel_fname, "function", f"func_{i}_{j} (arg)")) for j in range(5)
+            ]
+            idents = [
+                f"func_{random.randrange(num_files)}_{random.randrange(5)}" for _ in range(100)
+            ]
+            idents += ["self", "print", "len"] * 20 + [f"local_{k}" for k in range(50)]
+            inputs.append((rel_fname, definitions, idents))
+
+        tracemalloc.start()
+        try:
+            graph = ReferenceGraph()
+            for rel_fname, definitions, idents in inputs:
+                graph.add_file(rel_fname, definitions, idents)
+            graph_size, _ = tracemalloc.get_traced_memory()
+
+            ranked, ranked_definitions = graph.rank({"pkg0/module0.py": 1.0}, "sparse")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(len(ranked), num_files)
+
+        # a graph of dicts and Counters of strings took 22 MB, and 55 MB to rank
+        mb = 1024 * 1024
+        self.assertLess(graph_size, 12 * mb)
+        self.assertLess(peak, 30 * mb)
+
+    def test_get_ranked_tags_updates_changed_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            defines = os.path.join(temp_dir, "defines.py")
+            uses = os.path.join(temp_dir, "uses.py")
+            with open(defines, "w") as f:
+                f.write("def old_func():\n    pass\n")
+            with open(uses, "w") as f:
+                f.write("from defines import old_func\n\nold_func()\n")
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput())
+            ranked_tags = repo_map.get_ranked_tags([uses], [defines])
+            self.assertIn(("defines.py", "function", "old_func ()"), ranked_tags)
+
+            # no changes, so nothing is re-read
+            with patch.object(repo_map, "get_tags") as mock_get_tags:
+                self.assertEqual(repo_map.get_ranked_tags([uses], [defines]), ranked_tags)
+                mock_get_tags.assert_not_called()
+
+            with open(defines, "w") as f:
+                f.write("def new_func():\n    pass\n")
+            with open(uses, "w") as f:
+                f.write("from defines import new_func\n\nnew_func()\n")
+            os.utime(defines, (0, 1))
+            os.utime(uses, (0, 1))
+
+            ranked_tags = repo_map.get_ranked_tags([uses], [defines])
+            self.assertIn(("defines.py", "function", "new_func ()"), ranked_tags)
+            self.assertNotIn(("defines.py", "function", "old_func ()"), ranked_tags)
+            self.assertNotIn("old_func", repo_map.graph.defines)
+            self.assertNotIn("old_func", repo_map.graph.references)
+
+            fresh_map = RepoMap(root=temp_dir, io=InputOutput())
+            self.assertEqual(fresh_map.get_ranked_tags([uses], [defines]), ranked_tags)
+
+            # files which leave the map, leave the graph
+            repo_map.get_ranked_tags([uses], [])
+            self.assertNotIn("defines.py", repo_map.graph.files)
+            self.assertNotIn("new_func", repo_map.graph.defines)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+            del fresh_map
+
+    def test_get_repo_map_is_memoized(self):
+        with GitTemporaryDirectory() as temp_dir:
+            fname = os.path.join(temp_dir, "file.py")
+            with open(fname, "w") as f:
+                f.write("def func():\n    pass\n")
+
+            repo = git.Repo(temp_dir)
+            repo.git.add(fname)
+            repo.git.commit("-m", "initial")
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io, verbose=True, repo=repo)
+            result = repo_map.get_repo_map([], [fname])
+            self.assertIn("file.py", result)
+
+            with patch.object(repo_map, "render_repo_map") as mock_render:
+                with patch.object(io, "tool_output") as mock_output:
+                    self.assertEqual(repo_map.get_repo_map([], [fname]), result)
+                    mock_output.assert_any_call("Repo-map cache: 1 hits, 1 misses")
+                mock_render.assert_not_called()
+
+                # a different budget, a modified file or a new commit are all misses
+                repo_map.max_map_tokens += 1
+                repo_map.get_repo_map([], [fname])
+                self.assertEqual(mock_render.call_count, 1)
+
+                with open(fname, "a") as f:
+                    f.write("\ndef other_func():\n    pass\n")
+                repo_map.get_repo_map([], [fname])
+                self.assertEqual(mock_render.call_count, 2)
+
+                repo.git.commit("-am", "second")
+                repo_map.get_repo_map([], [fname])
+                self.assertEqual(mock_render.call_count, 3)
+
+                repo_map.get_repo_map([], [fname])
+                self.assertEqual(mock_render.call_count, 3)
+
+            self.assertEqual(repo_map.map_cache_hits, 2)
+            self.assertEqual(repo_map.map_cache_misses, 4)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_get_ranked_tags_in_neighborhood(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            # a calls b, which calls c, which calls d
+            sources = dict(
+                a="from b import func_b\n\nfunc_b()\n",
+                b="from c import func_c\n\ndef func_b():\n    func_c()\n",
+                c="from d import func_d\n\ndef func_c():\n    func_d()\n",
+                d="def func_d():\n    pass\n",
+                e="def func_e():\n    pass\n",
+            )
+            fnames = dict()
+            for name, source in sources.items():
+                fnames[name] = os.path.join(temp_dir, f"{name}.py")
+                with open(fnames[name], "w") as f:
+                    f.write(source)
+
+            chat_fnames = [fnames["a"]]
+            other_fnames = [fnames[name] for name in "bcde"]
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput())
+            full = repo_map.get_ranked_tags(chat_fnames, other_fnames)
+            self.assertIn(("d.py", "function", "func_d ()"), full)
+
+            repo_map.neighborhood_threshold = 0
+            repo_map.neighborhood_hops = 1
+            repo_map.last_ranked_tags = None
+            bounded = repo_map.get_ranked_tags(chat_fnames, other_fnames)
+
+            self.assertEqual(repo_map.graph.neighborhood({"a.py"}, 1, 10), {"a.py", "b.py"})
+            self.assertEqual(bounded[0], ("b.py", "function", "func_b ()"))
+            self.assertEqual(bounded[2:], [("c.py",), ("d.py",), ("e.py",)])
+
+            # far enough out, it's the whole ranking again
+            repo_map.neighborhood_hops = 3
+            repo_map.last_ranked_tags = None
+            self.assertEqual(repo_map.get_ranked_tags(chat_fnames, other_fnames), full)
+
+            # the file budget stops the search
+            self.assertEqual(repo_map.graph.neighborhood({"a.py"}, 3, 2), {"a.py", "b.py"})
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_get_directory_summary_map(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for dirname in ("alpha", "beta", "gamma"):
+                for i in range(40):
+                    fname = os.path.join(temp_dir, dirname, "inner", f"{dirname}_{i}.py")
+                    os.makedirs(os.path.dirname(fname), exist_ok=True)
+                    with open(fname, "w") as f:
+                        f.write(f"def {dirname}_func_{i}():\n    pass\n")
+                    fnames.append(fname)
+
+            chat_fname = os.path.join(temp_dir, "main.py")
+            with open(chat_fname, "w") as f:
+                f.write("from beta.inner.beta_7 import beta_func_7\n\nbeta_func_7()\n")
+
+            # without tags, the smallest directories are expanded first
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), map_tokens=200, tag_extractors=[])
+            self.assertGreater(
+                repo_map.token_count(repo_map.get_simple_files_map(fnames)), repo_map.max_map_tokens
+            )
+
+            files_listing, ctags_msg = repo_map.choose_files_listing([chat_fname], fnames)
+            self.assertEqual(ctags_msg, " summarized by directory")
+            self.assertLessEqual(repo_map.token_count(files_listing), repo_map.max_map_tokens)
+            self.assertEqual(files_listing.splitlines()[0], "alpha" + os.sep)
+            self.assertIn("\tinner" + os.sep + " (40 files)\n", files_listing)
+
+            # with tags, the directories near the chat files go first
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), map_tokens=400)
+            files_listing = repo_map.get_directory_summary_map([chat_fname], fnames)
+            self.assertLessEqual(repo_map.token_count(files_listing), repo_map.max_map_tokens)
+            self.assertIn("\t\tbeta_7.py\n", files_listing)
+            self.assertIn(" (40 files: alpha_func_0, alpha_func_1, alpha_func_10)", files_listing)
+
+            # too small a budget for even the top level
+            repo_map.max_map_tokens = 5
+            self.assertIsNone(repo_map.get_directory_summary_map([chat_fname], fnames))
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_map_stats(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            defines = os.path.join(temp_dir, "defines.py")
+            uses = os.path.join(temp_dir, "uses.py")
+            with open(defines, "w") as f:
+                f.write("def func():\n    pass\n")
+            with open(uses, "w") as f:
+                f.write("from defines import func\n\nfunc()\n")
+
+            stats_json = os.path.join(temp_dir, "stats.json")
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io, verbose=True, map_stats_json=stats_json)
+
+            with patch.object(io, "tool_output") as mock_output:
+                repo_map.get_repo_map([uses], [defines])
+
+            stats = repo_map.stats
+            for phase in ("cache key", "stat", "tags", "idents", "graph", "rank", "fit"):
+                self.assertIn(phase, stats.secs)
+            self.assertEqual(stats.counts["files"], 2)
+            self.assertEqual(stats.counts["files read"], 2)
+            self.assertEqual(stats.counts["map cache misses"], 1)
+            self.assertEqual(stats.counts["file cache tags misses"], 2)
+            self.assertEqual(stats.counts["ranked files"], 2)
+            self.assertEqual(stats.counts["map tags"], 2)
+
+            mock_output.assert_any_call(stats.report())
+
+            # nested phases aren't counted twice
+            nested_stats = MapStats()
+            with patch("aider.repomap.time.perf_counter", side_effect=[0, 1, 3, 10]):
+                with nested_stats.timer("outer"):
+                    with nested_stats.timer("inner"):
+                        pass
+            self.assertEqual(nested_stats.secs, Counter(outer=8, inner=2))
+
+            # each map adds a line of json
+            repo_map.get_repo_map([uses], [defines])
+            self.assertEqual(repo_map.stats.counts["map cache hits"], 1)
+
+            with open(stats_json) as f:
+                lines = [json.loads(line) for line in f]
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(lines[0]["counts"]["files read"], 2)
+            self.assertIn("rank", lines[0]["secs"])
+            self.assertEqual(lines[1]["counts"], dict(repo_map.stats.counts))
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_change_tracker(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            defines = os.path.join(temp_dir, "defines.py")
+            uses = os.path.join(temp_dir, "uses.py")
+            with open(defines, "w") as f:
+                f.write("def func():\n    pass\n")
+            with open(uses, "w") as f:
+                f.write("from defines import func\n\nfunc()\n")
+
+            tracker = PollingChangeTracker(temp_dir)
+            tracker.set_files([uses, defines])
+            repo_map = RepoMap(root=temp_dir, io=InputOutput(), change_tracker=tracker)
+            repo_map.get_repo_map([uses], [defines])
+            self.assertEqual(repo_map.stats.counts["files read"], 2)
+
+            # nothing changed, so no file gets stat-ed
+            tracker.poll()
+            with patch.object(repo_map, "get_mtime") as mock_mtime:
+                repo_map.get_repo_map([uses], [defines])
+                self.assertFalse(repo_map.update_graph([uses, defines]))
+            mock_mtime.assert_not_called()
+            self.assertEqual(repo_map.stats.counts["map cache hits"], 1)
+
+            with open(defines, "w") as f:
+                f.write("def func(arg):\n    pass\n")
+
+            tracker.poll()
+            result = repo_map.get_repo_map([uses], [defines])
+            self.assertIn("func (arg)", result)
+            self.assertEqual(repo_map.stats.counts["map cache misses"], 1)
+            self.assertEqual(repo_map.stats.counts["files read"], 1)
+
+            tracker.close()
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_warm_up(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            defines = os.path.join(temp_dir, "defines.py")
+            uses = os.path.join(temp_dir, "uses.py")
+            with open(defines, "w") as f:
+                f.write("def func():\n    pass\n")
+            with open(uses, "w") as f:
+                f.write("from defines import func\n\nfunc()\n")
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput())
+            repo_map.warm_up([uses], [defines])
+            self.assertIsNotNone(repo_map.warm_up_thread)
+
+            repo_map.wait_for_warm_up()
+            self.assertIsNone(repo_map.warm_up_thread)
+            self.assertEqual(set(repo_map.graph.files), {"defines.py", "uses.py"})
+
+            # the first map has nothing left to read
+            with patch.object(repo_map, "update_tags_cache") as mock_update:
+                result = repo_map.get_repo_map([uses], [defines])
+                mock_update.assert_not_called()
+            self.assertIn("func ()", result)
+
+            # nothing to warm up without a budget
+            repo_map.max_map_tokens = 0
+            repo_map.warm_up([uses], [defines])
+            self.assertIsNone(repo_map.warm_up_thread)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_get_ranked_tags_map_fits_budget(self):
+        ranked_tags = []
+        for i in range(200):
+            fname = f"dir{i % 7}/file{i % 23}.py"
+            ranked_tags.append((fname, f"Class{i % 5}", "member", f"method{i} (self, arg)"))
+            ranked_tags.append((fname,))
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            repo_map = RepoMap(root=temp_dir, io=InputOutput())
+
+            with patch.object(repo_map, "get_ranked_tags", return_value=ranked_tags):
+                for max_map_tokens in (10, 100, 500, 2000, 100000):
+                    repo_map.max_map_tokens = max_map_tokens
+                    expected = repo_map.search_num_tags(ranked_tags, len(ranked_tags))
+
+                    with patch.object(repo_map, "search_num_tags") as mock_search:
+                        self.assertEqual(repo_map.get_ranked_tags_map([], ["other.py"]), expected)
+                        mock_search.assert_not_called()
+
+                # if the estimate is off, fall back to searching with exact counts
+                repo_map.max_map_tokens = 500
+                expected = repo_map.search_num_tags(ranked_tags, len(ranked_tags))
+                with patch.object(repo_map, "line_token_count", return_value=0):
+                    self.assertEqual(repo_map.get_ranked_tags_map([], ["other.py"]), expected)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_to_tree(self):
+        tags = [
+            ("b.py", "Other", "class", "Other"),
+            ("a.py",),
+            ("b.py", "MyClass", "member", "method (self)"),
+            ("b.py", "MyClass", "member", "other_method (self)"),
+            ("c.py", "function", "func ()"),
+            ("b.py", "MyClass", "member", "method (self)"),
+        ]
+
+        expected = """\
+a.py
+b.py
+\tMyClass
+\t\tmember
+\t\t\tmethod (self)
+\t\t\tother_method (self)
+\tOther
+\t\tclass
+\t\t\tOther
+c.py
+\tfunction
+\t\tfunc ()
+"""
+        self.assertEqual(to_tree(tags), expected)
+        self.assertEqual(to_tree([]), "")
+
+        # rendering a sorted prefix, then carrying on from where it stopped
+        tags = iter(sorted(tags))
+        lines = iter_tree_lines(tags)
+        head = [line for _, line in zip(range(3), lines)]
+        self.assertEqual(head, ["a.py\n", "b.py\n", "\tMyClass\n"])
+        self.assertEqual("".join(head + list(lines)), expected)
+
+    def test_file_cache_survives_branch_switches(self):
+        with GitTemporaryDirectory() as temp_dir:
+            fname = os.path.join(temp_dir, "file.py")
+            other_fname = os.path.join(temp_dir, "other.py")
+            with open(fname, "w") as f:
+                f.write("def func():\n    pass\n")
+            with open(other_fname, "w") as f:
+                f.write("from file import func\n\nfunc()\n")
+
+            repo = git.Repo(temp_dir)
+            repo.git.add(fname, other_fname)
+            repo.git.commit("-m", "initial")
+            main_branch = repo.active_branch.name
+
+            repo.git.checkout("-b", "feature")
+            with open(fname, "w") as f:
+                f.write("def func():\n    return 1\n")
+            repo.git.commit("-am", "feature")
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io, repo=repo, map_cache_stats=True)
+            stats = repo_map.file_cache.stats
+
+            repo_map.get_repo_map([], [fname, other_fname])
+            repo.git.checkout(main_branch)
+            repo_map.get_repo_map([], [fname, other_fname])
+            misses = stats["tags misses"], stats["idents misses"]
+            self.assertEqual(misses, (3, 3))
+
+            # every version of every file has been seen now
+            for branch in ("feature", main_branch, "feature"):
+                repo.git.checkout(branch)
+                with patch.object(io, "tool_output") as mock_output:
+                    repo_map.get_repo_map([], [fname, other_fname])
+                    report = mock_output.call_args[0][0]
+                self.assertEqual((stats["tags misses"], stats["idents misses"]), misses)
+
+            self.assertIn("Repo-map file cache:", report)
+            self.assertIn("tags: 3 hits, 3 misses", report)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
     def test_get_repo_map_without_ctags(self):
         # Create a temporary directory with a sample Python file containing identifiers
         test_files = [
@@ -0,0 +1,218 @@
+import concurrent.futures
+import json
+import os
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+import openai
+
+from aider import models
+from aider.coders import Coder
+from aider.dump import dump  # noqa: F401
+from aider.transport import AsyncTransport
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.num_connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_json(200, dict(object="list", data=[dict(id="gpt-4", object="model")]))
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        self.server.paths.append(self.path)
+
+        if self.server.errors:
+            self.send_json(self.server.errors.pop(0), dict(error=dict(message="try later")))
+            return
+
+        if self.server.barrier:
+            self.server.barrier.wait(timeout=5)
+
+        if self.server.stall:
+            # send the headers and one chunk, and then nothing more until released
+            chunk = dict(choices=[dict(index=0, delta=dict(content="a"), finish_reason=None)])
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            self.server.stall.wait(timeout=5)
+            self.close_connection = True
+            return
+
+        text = body["messages"][-1]["content"]
+        if not body.get("stream"):
+            message = dict(role="assistant", content=text)
+            usage = dict(prompt_tokens=1, completion_tokens=1, total_tokens=2)
+            self.send_json(200, dict(choices=[dict(index=0, message=message)], usage=usage))
+            return
+
+        events = ""
+        for word in text.split(" "):
+            delta = dict(content=word + " ")
+            chunk = dict(choices=[dict(index=0, delta=delta, finish_reason=None)])
+            events += f"data: {json.dumps(chunk)}\n\n"
+        events += "data: [DONE]\n\n"
+
+        self.send_body(200, "text/event-stream", events)
+
+    def send_json(self, status, data):
+        self.send_body(status, "application/json", json.dumps(data))
+
+    def send_body(self, status, content_type, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestAsyncTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.num_connections = 0
+        self.server.requests = []
+        self.server.paths = []
+        self.server.errors = []
+        self.server.barrier = None
+        self.server.stall = None
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+
+        self.orig_api = openai.api_base, openai.api_key
+        openai.api_base = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        openai.api_key = "fake-key"
+
+        self.transport = AsyncTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        openai.api_base, openai.api_key = self.orig_api
+
+    def get_messages(self, text):
+        return [dict(role="user", content=text)]
+
+    def test_stream(self):
+        chunks = self.transport.chat_completion(
+            model="gpt-4", messages=self.get_messages("hello there world"), stream=True
+        )
+        text = "".join(chunk.choices[0].delta.content for chunk in chunks)
+        self.assertEqual(text, "hello there world ")
+
+    def test_connections_are_reused(self):
+        for i in range(3):
+            res = self.transport.chat_completion(
+                model="gpt-4", messages=self.get_messages(f"reply {i}"), stream=False
+            )
+            self.assertEqual(res.choices[0].message.content, f"reply {i}")
+
+            chunks = self.transport.chat_completion(
+                model="gpt-4", messages=self.get_messages("streamed"), stream=True
+            )
+            list(chunks)
+
+        self.assertEqual([model.id for model in self.transport.list_models()["data"]], ["gpt-4"])
+
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.num_connections, 1)
+
+    def test_concurrent_requests(self):
+        # neither reply is sent until both requests have arrived
+        self.server.barrier = threading.Barrier(2)
+
+        futures = [
+            self.transport.submit(
+                openai.ChatCompletion.acreate(model="gpt-4", messages=self.get_messages(text))
+            )
+            for text in ("main reply", "commit message")
+        ]
+
+        replies = [future.result(timeout=10).choices[0].message.content for future in futures]
+        self.assertEqual(replies, ["main reply", "commit message"])
+
+    def test_proxy_env_var(self):
+        port = self.server.server_address[1]
+        openai.api_base = "http://api.example.invalid/v1"
+
+        # the fake server stands in for the proxy, which gets the full url of each request
+        env = dict(HTTP_PROXY=f"http://127.0.0.1:{port}", NO_PROXY="", no_proxy="")
+        with patch.dict(os.environ, env):
+            res = self.transport.chat_completion(
+                model="gpt-4", messages=self.get_messages("proxied"), stream=False
+            )
+
+        self.assertEqual(res.choices[0].message.content, "proxied")
+        self.assertEqual(self.server.paths, ["http://api.example.invalid/v1/chat/completions"])
+
+    def test_interrupted_stream(self):
+        self.server.stall = threading.Event()
+
+        chunks = self.transport.chat_completion(
+            model="gpt-4", messages=self.get_messages("stalled"), stream=True
+        )
+        self.assertEqual(next(chunks).choices[0].delta.content, "a")
+
+        # ^C while waiting for the next chunk
+        submit = self.transport.submit
+        futures = []
+
+        def record_submit(coro):
+            futures.append(submit(coro))
+            return futures[-1]
+
+        with patch.object(self.transport, "submit", side_effect=record_submit):
+            with patch.object(concurrent.futures.Future, "result", side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    next(chunks)
+
+        # the stream is closed once the interrupted read is done with it
+        self.assertEqual(len(futures), 2)
+        self.assertIsNone(futures[-1].result(timeout=5))
+
+        stall, self.server.stall = self.server.stall, None
+        stall.set()
+
+        # the transport is still usable
+        res = self.transport.chat_completion(
+            model="gpt-4", messages=self.get_messages("next"), stream=False
+        )
+        self.assertEqual(res.choices[0].message.content, "next")
+
+    @patch("backoff._sync.time.sleep")
+    @patch("builtins.print")
+    def test_coder_send_retries(self, mock_print, mock_sleep):
+        self.server.errors = [503, 429]
+
+        with patch("aider.coders.base_coder.check_model_availability", return_value=True):
+            coder = Coder.create(
+                models.GPT4,
+                None,
+                MagicMock(),
+                pretty=False,
+                use_git=False,
+                transport=self.transport,
+            )
+
+        with patch("sys.stdout.write"):
+            coder.send(self.get_messages("all good"), silent=True)
+
+        self.assertEqual(coder.partial_response_content, "all good ")
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(mock_print.call_count, 2)
@@ -95,6 +95,41 @@ class TestWholeFileCoder(unittest.TestCase):
         # the live diff should be concise, since we haven't changed anything yet
         self.assertLess(len(lines), 20)
 
+    def test_update_files_live_diff_incremental(self):
+        sample_file = "sample.txt"
+        orig_lines = [f"line {i}\n" for i in range(200)]
+        Path(sample_file).write_text("".join(orig_lines))
+
+        new_lines = list(orig_lines)
+        new_lines[50:53] = ["new a\n", "new b\n"]
+        response = f"Here is the update:\n\n{sample_file}\n```\n{''.join(new_lines)}```\n\nDone.\n"
+
+        io = InputOutput(yes=True)
+        coder = WholeFileCoder(main_model=models.GPT35, io=io, fnames=[sample_file])
+        fresh_coder = WholeFileCoder(
+            main_model=models.GPT35, io=InputOutput(yes=True), fnames=[sample_file]
+        )
+
+        with patch.object(io, "read_text", wraps=io.read_text) as mock_read_text:
+            for end in range(0, len(response) + 1, 7):
+                coder.partial_response_content = response[:end]
+                fresh_coder.partial_response_content = response[:end]
+                fresh_coder.live_diffs_state = None
+
+                # streaming in chunks renders the same as the whole response at once
+                self.assertEqual(
+                    coder.update_files(mode="diff"), fresh_coder.update_files(mode="diff")
+                )
+
+        # the original file is read once for the block, not for every chunk
+        self.assertEqual(mock_read_text.call_count, 1)
+
+        coder.partial_response_content = response
+        output = coder.update_files(mode="diff")
+        self.assertIn("-line 50", output)
+        self.assertIn("+new a", output)
+        self.assertTrue(output.endswith("Done.\n"))
+
     def test_update_files_with_existing_fence(self):
         # Create a sample file in the temporary directory
         sample_file = "sample.txt"